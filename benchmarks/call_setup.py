@@ -0,0 +1,140 @@
+"""Benchmark of the latency of the channel bootstrap when a call starts.
+
+The legacy bootstrap looks the channel up, inserts it when it is new and then writes the route
+variables of the call (uniqueid and AGI environment), with the round trips that the channel
+durability requires. `Channel.start_call` reads or inserts the channel with its variables in a
+single statement. Both are run for new uniqueids, one call after another, and for uniqueids that
+already have a channel (a flow run again by the dialplan).
+
+The memory channel store is used unless a database is given, so a run without `--database`
+only compares the in-process cost.
+
+Usage:
+    python -m benchmarks.call_setup [--calls 2000] [--warmup 100]
+        [--database postgresql://...] [--durability variable]
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+from time import perf_counter, time
+from typing import Any, Awaitable, Callable, Dict, List
+
+from ivrflow.__main__ import IVRFlow
+from ivrflow.channel import Channel
+from ivrflow.config import config
+
+AGI_ENVIRONMENT: Dict[str, str] = {
+    "agi_request": "agi://127.0.0.1/call_setup",
+    "agi_channel": "PJSIP/bench-00000001",
+    "agi_language": "es",
+    "agi_type": "PJSIP",
+    "agi_callerid": "3001234567",
+    "agi_calleridname": "Bench",
+    "agi_dnid": "100",
+    "agi_context": "ivrflow",
+    "agi_extension": "100",
+    "agi_priority": "1",
+    "agi_enhanced": "0.0",
+    "agi_accountcode": "",
+    "agi_threadid": "140000000000000",
+}
+
+
+def route_variables(uniqueid: str) -> Dict[str, Any]:
+    return {
+        "uniqueid": uniqueid,
+        "agi": {
+            key[4:]: value for key, value in {**AGI_ENVIRONMENT, "agi_uniqueid": uniqueid}.items()
+        },
+    }
+
+
+async def legacy_setup(uniqueid: str) -> Channel:
+    channel = await Channel.get_by_channel_uniqueid(channel_uniqueid=uniqueid)
+    await channel.set_variables(route_variables(uniqueid))
+    return channel
+
+
+async def single_statement_setup(uniqueid: str) -> Channel:
+    return await Channel.start_call(channel_uniqueid=uniqueid, variables=route_variables(uniqueid))
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+async def measure(setup: Callable[[str], Awaitable[Channel]], uniqueids: List[str]) -> List[float]:
+    durations = []
+    for uniqueid in uniqueids:
+        # Every call starts without the channel in the cache, as in a fresh process or worker
+        Channel.by_channel_uniqueid.pop(uniqueid, None)
+        start = perf_counter()
+        await setup(uniqueid)
+        durations.append(perf_counter() - start)
+        Channel.by_channel_uniqueid.pop(uniqueid, None)
+
+    return durations
+
+
+def report(name: str, durations: List[float]) -> None:
+    print(
+        f"{name:<32} calls={len(durations):<6} "
+        f"mean={sum(durations) / len(durations) * 1000:.3f} ms "
+        f"p50={percentile(durations, 0.5) * 1000:.3f} ms "
+        f"p99={percentile(durations, 0.99) * 1000:.3f} ms"
+    )
+
+
+def prepare(args: argparse.Namespace) -> None:
+    config["ivrflow.channel_durability"] = args.durability
+    config["ivrflow.channel_store.backend"] = "postgres" if args.database else "memory"
+    config["ivrflow.channel_store.snapshot"] = False
+
+    IVRFlow.prepare_loop()
+    if args.database:
+        config["ivrflow.database"] = args.database
+        IVRFlow.prepare_db()
+    else:
+        Channel.init_cls(config=config)
+
+
+async def run(args: argparse.Namespace) -> None:
+    if args.database:
+        await IVRFlow.start_db()
+
+    prefix = f"{int(time())}"
+    setups = {"legacy": legacy_setup, "single statement": single_statement_setup}
+
+    for name, setup in setups.items():
+        await measure(setup, [f"{prefix}-{name}-warmup-{i}" for i in range(args.warmup)])
+
+    for name, setup in setups.items():
+        uniqueids = [f"{prefix}-{name}-{i}" for i in range(args.calls)]
+        report(f"{name} (new channel)", await measure(setup, uniqueids))
+        report(f"{name} (existing)", await measure(setup, uniqueids))
+
+    print(f"store: {config['ivrflow.channel_store.backend']}, durability: {args.durability}")
+    if args.database:
+        await IVRFlow.db.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--database", help="postgres URL, the memory store is used without it")
+    parser.add_argument("--durability", choices=("variable", "node", "call"), default="variable")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    prepare(args)
+    IVRFlow.loop.run_until_complete(run(args))
+
+
+if __name__ == "__main__":
+    main()
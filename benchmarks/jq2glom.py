@@ -0,0 +1,57 @@
+"""Throughput of `JQ2Glom.to_glom_path` with the grammar only, the fast tokenizer, and the cache.
+
+Usage:
+    python -m benchmarks.jq2glom [--iterations 20000]
+"""
+
+from __future__ import annotations
+
+import argparse
+from time import perf_counter
+from typing import Callable, List
+
+from glom import Path
+
+from ivrflow.utils.jq2glom import JQ2Glom
+
+# The shapes of the variable ids used by channel variables
+PATHS: List[str] = [
+    "route.customer.id",
+    "route.opt",
+    "hook.on_hangup.node_id",
+    "customer.phones[0].number",
+    "items.0",
+    "uniqueid",
+    'route["customer name"]',
+]
+
+
+def bench(name: str, to_path: Callable[[str], Path], iterations: int) -> None:
+    start = perf_counter()
+    for _ in range(iterations):
+        for expr in PATHS:
+            to_path(expr)
+    elapsed = perf_counter() - start
+
+    conversions = iterations * len(PATHS)
+    print(
+        f"{name:<16} {conversions / elapsed:12,.0f} paths/s  {elapsed / conversions * 1e6:8.2f} us/path"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    jq2glom = JQ2Glom()
+    for expr in PATHS:
+        assert jq2glom.to_glom_path(expr) == jq2glom._parse(expr), expr
+
+    bench("grammar (before)", jq2glom._parse, max(args.iterations // 20, 1))
+    bench("fast tokenizer", lambda e: jq2glom._fast_parse(e) or jq2glom._parse(e), args.iterations)
+    bench("cached (after)", jq2glom.to_glom_path, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Micro-benchmark of the per-render cost of the legacy and native render modes.
+
+Every node of the flows in `flows/` (and every middleware of `flows/flow_utils.yaml`) is
+rendered field by field, with `Util.render_data` and with the precompiled render plans.
+
+Usage:
+    python -m benchmarks.render_modes [--flows-dir flows] [--iterations 2000]
+"""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Dict, List, Tuple
+
+import yaml
+
+from ivrflow.flow_compiler import RenderPlan
+from ivrflow.jinja.template_cache import TemplateCache
+from ivrflow.utils import Util
+
+# Extra fields with the shapes found in production flows, so the benchmark is not limited
+# to the few templates of the sample flows.
+EXTRA_FIELDS: List[Any] = [
+    "https://api.example.com/customers/{{ route.customer_id }}",
+    {"Authorization": "Bearer {{ route.token }}", "content-type": "application/json"},
+    {"customer": {"id": "{{ route.customer_id }}", "tags": ["ivr", "{{ route.lang }}"]}},
+    "{% if route.opt|int >= 18 %}True{% else %}False{% endif %}",
+    "{{ route.items }}",
+    "tt-monkeys",
+]
+
+VARIABLES: Dict[str, Any] = {
+    "route": {
+        "customer_id": 1234,
+        "token": "abc.def.ghi",
+        "lang": "es",
+        "opt": "21",
+        "items": [1, 2, 3],
+    }
+}
+
+
+def load_fields(flows_dir: Path) -> Tuple[List[Any], Dict[str, Any]]:
+    fields: List[Any] = list(EXTRA_FIELDS)
+    variables: Dict[str, Any] = dict(VARIABLES)
+
+    for path in sorted(flows_dir.glob("*.yaml")):
+        with open(path, "r") as file:
+            content: Dict = yaml.safe_load(file) or {}
+
+        variables.update({"flow": content.get("flow_variables", {})})
+        for obj in content.get("nodes", []) + content.get("middlewares", []):
+            fields.extend(value for key, value in obj.items() if key not in ("id", "type"))
+
+    return fields, variables
+
+
+def bench(name: str, fields: List[Any], variables: Dict, iterations: int) -> float:
+    plans = [RenderPlan.compile(field) for field in fields]
+    renders = len(fields) * iterations
+
+    start = perf_counter()
+    for _ in range(iterations):
+        for field in fields:
+            Util.render_data(field, variables)
+    render_data_us = (perf_counter() - start) / renders * 1e6
+
+    start = perf_counter()
+    for _ in range(iterations):
+        for plan in plans:
+            plan.render(variables)
+    plan_us = (perf_counter() - start) / renders * 1e6
+
+    print(
+        f"{name:<8} render_data: {render_data_us:8.2f} us/render   plan: {plan_us:8.2f} us/render"
+    )
+    return render_data_us
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--flows-dir", type=Path, default=Path("flows"))
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    fields, variables = load_fields(args.flows_dir)
+    print(f"{len(fields)} fields, {args.iterations} iterations")
+
+    for mode in ("legacy", "native"):
+        Util.native_render = mode == "native"
+        TemplateCache.clear()
+        bench(mode, fields, variables, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
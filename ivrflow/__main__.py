@@ -3,11 +3,10 @@ from __future__ import annotations
 import asyncio
 import sys
 from logging import Logger, getLogger
-from time import time
+from time import perf_counter, time
 from typing import Dict, Tuple
 
 from aioagi import runner
-from aioagi.app import AGIApplication
 from aioagi.exceptions import AGIAppError, AGIHangup
 from aioagi.urldispathcer import AGIView
 from aiohttp import ClientSession, TraceConfig
@@ -20,18 +19,31 @@ try:
 except ImportError:
     uvloop = None
 
-from . import VERSION
+from . import VERSION, metrics
+from .agi_server import IVRFlowApplication
+from .ami_events import AMIEvents
 from .channel import Channel
 from .config import config
+from .db import ChannelPartitions
 from .db import init as init_db
 from .db import upgrade_table
 from .db.channel import ChannelState
 from .email_client import EmailClient
 from .flow import Flow
+from .flow_cache import FlowCache
 from .flow_utils import EmailServer, FlowUtils
+from .flow_watcher import FlowWatcher
+from .hangup_watcher import HangupWatcher
 from .http_middleware import end_auth_middleware, start_auth_middleware
+from .jinja.template_cache import TemplateCache
+from .middlewares import TokenCache
 from .nodes import Base, Email, HTTPRequest, NoOp, SetVars, Switch
+from .originate import OriginateDispatcher
+from .profiler import Profiler, on_request_end, on_request_exception, on_request_start
+from .utils import JQCache, Util
 from .web import APIServer
+from .web.base import set_flow_utils
+from .workers import Workers
 
 log: Logger = getLogger("ivrflow.main")
 
@@ -41,8 +53,11 @@ class IVRFlow(AGIView):
     db: Database
     http_client: ClientSession
     flow_utils: "FlowUtils" | None = None
-    management_api: APIServer
+    management_api: APIServer | None = None
     ami_connect_task: asyncio.Task | None = None
+    channel_sweep_task: asyncio.Task | None = None
+    flow_watcher_task: asyncio.Task | None = None
+    channel_partitions_task: asyncio.Task | None = None
     ALLOWED_AFTER_HANGUP_NODES = (HTTPRequest, Switch, SetVars, Email, NoOp)
 
     @property
@@ -58,6 +73,8 @@ class IVRFlow(AGIView):
             owner_name="ivrflow",
         )
         init_db(cls.db)
+        Channel.init_cls(config=config)
+        ChannelPartitions.init_cls(config=config)
 
     @classmethod
     async def start_email_connections(self):
@@ -94,6 +111,12 @@ class IVRFlow(AGIView):
         trace_config = TraceConfig()
         trace_config.on_request_start.append(start_auth_middleware)
         trace_config.on_request_end.append(end_auth_middleware)
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        trace_config.on_request_start.append(metrics.on_request_start)
+        trace_config.on_request_end.append(metrics.on_request_end)
+        trace_config.on_request_exception.append(metrics.on_request_exception)
         cls.http_client = ClientSession(trace_configs=[trace_config], loop=cls.loop)
 
     @classmethod
@@ -104,12 +127,36 @@ class IVRFlow(AGIView):
 
     @classmethod
     def init_flow_complements(cls):
+        TemplateCache.init_cls(config=config)
+        Util.init_cls(config=config)
+        JQCache.init_cls(config=config)
+        TokenCache.init_cls(config=config)
+        HangupWatcher.init_cls(config=config)
+        Profiler.init_cls(config=config)
+        FlowWatcher.init_cls(config=config)
+        FlowWatcher.add_listener(cls.set_flow_utils)
         cls.flow_utils = FlowUtils()
         Flow.init_cls(flow_utils=cls.flow_utils)
 
+    @classmethod
+    def set_flow_utils(cls, flow_utils: FlowUtils) -> None:
+        """It swaps the flow utils used by the new calls and the management API"""
+        email_servers = getattr(cls.flow_utils.data, "email_servers", None)
+        cls.flow_utils = flow_utils
+        Flow.init_cls(flow_utils=flow_utils)
+        set_flow_utils(flow_utils)
+        if getattr(flow_utils.data, "email_servers", None) != email_servers:
+            asyncio.create_task(cls.start_email_connections())
+
     @classmethod
     async def stop(cls) -> None:
-        if config["ami.enabled"]:
+        if cls.channel_sweep_task and not cls.channel_sweep_task.done():
+            cls.channel_sweep_task.cancel()
+        if cls.flow_watcher_task and not cls.flow_watcher_task.done():
+            cls.flow_watcher_task.cancel()
+        if cls.channel_partitions_task and not cls.channel_partitions_task.done():
+            cls.channel_partitions_task.cancel()
+        if cls.ami_manager:
             log.info("Stopping AMI...")
             if cls.ami_connect_task and not cls.ami_connect_task.done():
                 cls.ami_connect_task.cancel()
@@ -123,12 +170,19 @@ class IVRFlow(AGIView):
 
     @classmethod
     async def start(cls):
-        if config["ami.enabled"]:
+        if cls.ami_manager:
             cls.ami_connect_task = asyncio.create_task(cls.ami_manager.connect())
         await cls.start_db()
+        cls.channel_sweep_task = asyncio.create_task(Channel.sweep_cache())
+        if Workers.is_api_worker():
+            cls.channel_partitions_task = asyncio.create_task(ChannelPartitions.run())
+        if FlowWatcher.enabled:
+            cls.flow_watcher_task = asyncio.create_task(FlowWatcher.run())
         if cls.flow_utils:
             asyncio.create_task(cls.start_email_connections())
-        await cls.management_api.start()
+        Workers.listen(cls.loop)
+        if cls.management_api:
+            await cls.management_api.start()
 
     @classmethod
     def init(cls):
@@ -139,7 +193,8 @@ class IVRFlow(AGIView):
     def _prepare(cls):
         start_ts = time()
 
-        log.info(f"Initializing IVRFlow {VERSION}")
+        worker = f" worker {Workers.index}" if Workers.index is not None else ""
+        log.info(f"Initializing IVRFlow {VERSION}{worker}")
         try:
             cls.prepare()
         except Exception:
@@ -155,7 +210,51 @@ class IVRFlow(AGIView):
         cls.prepare_db()
         cls.init_http_client()
         cls.prepare_ami()
-        cls.init_management_api()
+        cls.init_metrics()
+        if Workers.is_api_worker():
+            cls.init_management_api()
+        Workers.on(
+            "invalidate_flow",
+            lambda flow_id: FlowCache.invalidate_by_flow_id(flow_id, broadcast=False),
+        )
+
+    @classmethod
+    def init_metrics(cls) -> None:
+        """Init lifecycle method where the gauges read on each scrape are set."""
+
+        def db_pool() -> Dict[Tuple[str], int]:
+            pool = cls.db.pool
+            return {
+                ("size",): pool.get_size(),
+                ("idle",): pool.get_idle_size(),
+                ("max",): pool.get_max_size(),
+            }
+
+        def hit_ratio(stats: Dict[str, int]) -> float:
+            lookups = stats["hits"] + stats["misses"]
+            return stats["hits"] / lookups if lookups else 0
+
+        metrics.db_pool_connections.set_function(db_pool)
+        metrics.ami_connected.set_function(
+            lambda: int(bool(cls.ami_manager and cls.ami_manager.authenticated))
+        )
+        metrics.cache_hit_ratio.set_function(
+            lambda: {
+                ("flow",): hit_ratio(FlowCache.stats),
+                ("template",): hit_ratio(TemplateCache.stats),
+                ("jq",): hit_ratio(JQCache.stats),
+                ("token",): hit_ratio(TokenCache.stats),
+            }
+        )
+        metrics.cache_size.set_function(
+            lambda: {
+                ("flow",): len(FlowCache.entries_by_name),
+                ("template",): TemplateCache.get_stats()["size"],
+                ("jq",): JQCache.get_stats()["size"],
+                ("token",): len(TokenCache.tokens_by_key),
+                ("channel",): len(Channel.by_channel_uniqueid),
+            }
+        )
 
     @classmethod
     def prepare_loop(cls) -> None:
@@ -174,7 +273,8 @@ class IVRFlow(AGIView):
 
     @classmethod
     def prepare_ami(cls) -> None:
-        if config["ami.enabled"]:
+        # The rest of the workers only use AMI to detect the hangups of their calls
+        if config["ami.enabled"] and (Workers.is_api_worker() or config["ami.events.enabled"]):
             cls.ami_manager = SafeAMIManager(
                 app=cls,
                 title="AMI",
@@ -187,27 +287,50 @@ class IVRFlow(AGIView):
         else:
             cls.ami_manager = None
 
+        AMIEvents.init_cls(config=config, ami_manager=cls.ami_manager)
+        OriginateDispatcher.init_cls(config=config, ami_manager=cls.ami_manager)
+
     async def sip(self):
-        async with Base.agi_ctx(asterisk_conn=self.request, http_session=self.http_client):
-            await self.algorithm()
+        await self.serve()
 
     async def local(self):
-        async with Base.agi_ctx(asterisk_conn=self.request, http_session=self.http_client):
-            await self.algorithm()
+        await self.serve()
 
     async def dahdi(self):
-        async with Base.agi_ctx(asterisk_conn=self.request, http_session=self.http_client):
-            await self.algorithm()
+        await self.serve()
+
+    async def serve(self) -> None:
+        metrics.CALLS_STARTED.inc()
+        metrics.ACTIVE_CALLS.inc()
+        try:
+            async with Base.agi_ctx(asterisk_conn=self.request, http_session=self.http_client):
+                await self.algorithm()
+        except Exception:
+            metrics.CALLS_FINISHED["unexpected_error"].inc()
+            raise
+        finally:
+            metrics.ACTIVE_CALLS.dec()
 
     async def post_init(self) -> Tuple[Flow, Channel]:
         Base.init_cls(config=config)
         uniqueid: str = self.request.headers["agi_uniqueid"]
+        variables = {"uniqueid": uniqueid}
+        if config["ivrflow.agi_environment.enabled"]:
+            variables["agi"] = {
+                key[4:]: value
+                for key, value in self.request.headers.items()
+                if key.startswith("agi_")
+            }
 
-        channel = await Channel.get_by_channel_uniqueid(channel_uniqueid=uniqueid)
-        await channel.set_variable("uniqueid", uniqueid)
+        channel = await Channel.start_call(channel_uniqueid=uniqueid, variables=variables)
+        Base.bind_channel(channel)
 
         flow = Flow()
-        await flow.load_flow(self.flow_name)
+        try:
+            await flow.load_flow(self.flow_name)
+        except Exception:
+            await channel.release()
+            raise
 
         return flow, channel
 
@@ -215,67 +338,121 @@ class IVRFlow(AGIView):
         flow: Flow
         channel: Channel
 
-        flow, channel = await self.post_init()
+        profile = Profiler.start(self.request.headers["agi_uniqueid"], self.flow_name)
+        if profile is not None:
+            Profiler.wrap_agi(self.request.agi)
+
+        try:
+            flow, channel = await self.post_init()
+        except BaseException:
+            # The profile of a call that could not start is still finished, with the time of its
+            # setup, so it does not stay in the context of the connection
+            if profile is not None:
+                Profiler.finish(profile, "post_init_error")
+            raise
+
         uid: str = channel.channel_uniqueid
+        watcher = HangupWatcher.watch(uid, self.request.protocol, self.flow_name)
 
         reason = "completed"
         node = None
 
-        while channel.state != ChannelState.END:
-            node = flow.node(channel=channel)
-            if node is None:
-                reason = "invalid_node"
-                break
+        # The watcher and the channel are released even if the flow fails unexpectedly
+        try:
+            while channel.state != ChannelState.END:
+                node = flow.node(channel=channel)
+                if node is None:
+                    reason = "invalid_node"
+                    break
+
+                if channel.state == ChannelState.HANGUP and not isinstance(
+                    node, self.ALLOWED_AFTER_HANGUP_NODES
+                ):
+                    reason = "hangup_node_not_allowed"
+                    break
 
-            if channel.state == ChannelState.HANGUP and not isinstance(
-                node, self.ALLOWED_AFTER_HANGUP_NODES
-            ):
-                reason = "hangup_node_not_allowed"
-                break
+                if profile is not None:
+                    profile.start_node(node.id, node.type)
+
+                started = perf_counter()
+                try:
+                    log.debug(
+                        f"[{uid}] Starting node: ({node.id}) state: ({channel.state}) type: ({node.type})"
+                    )
+                    if watcher is not None and channel.state != ChannelState.HANGUP:
+                        await watcher.run(node)
+                    else:
+                        await node.run()
+                except (AGIAppError, AGIHangup) as e:
+                    hangup_var = "hook.on_hangup.node_id"
+                    next_node_id = await channel.get_variable(hangup_var)
+                    reason = "hangup_detected"
+
+                    log.warning(
+                        f"[{uid}] Hangup detected in node: ({node.id}) next node: ({next_node_id})"
+                    )
+                    if not next_node_id:
+                        reason = "on_hangup_node_not_found"
+                        await channel.update_ivr(node_id=None, state=ChannelState.HANGUP)
+                        break
+
+                    await channel.update_ivr(node_id=next_node_id, state=ChannelState.HANGUP)
+                except Exception:
+                    reason = "unexpected_error"
+                    log.exception(f"[{uid}] Exception in algorithm")
+                    break
+                finally:
+                    metrics.node_duration.labels(node.type).observe(perf_counter() - started)
+                    if profile is not None:
+                        profile.end_node()
 
-            try:
                 log.debug(
-                    f"[{uid}] Starting node: ({node.id}) state: ({channel.state}) type: ({node.type})"
-                )
-                await node.run()
-            except (AGIAppError, AGIHangup) as e:
-                hangup_var = "hook.on_hangup.node_id"
-                next_node_id = await channel.get_variable(hangup_var)
-                reason = "hangup_detected"
-
-                log.warning(
-                    f"[{uid}] Hangup detected in node: ({node.id}) next node: ({next_node_id})"
+                    f"[{uid}] Finished node: ({node.id}) State: ({channel.state}) type: ({node.type})"
                 )
-                if not next_node_id:
-                    reason = "on_hangup_node_not_found"
-                    await channel.update_ivr(node_id=None, state=ChannelState.HANGUP)
-                    break
+        finally:
+            if watcher is not None:
+                watcher.stop()
 
-                await channel.update_ivr(node_id=next_node_id, state=ChannelState.HANGUP)
+            try:
+                await channel.release()
             except Exception:
-                reason = "unexpected_error"
-                log.exception(f"[{uid}] Exception in algorithm")
-                break
-
-            log.debug(
-                f"[{uid}] Finished node: ({node.id}) State: ({channel.state}) type: ({node.type})"
-            )
+                log.exception(f"[{uid}] Error writing the channel")
 
         log.info(
             f"[{uid}] Flow finished reason ({reason}) "
             f"state ({channel.state}) node ({getattr(node, 'id', None)})"
         )
 
+        metrics.CALLS_FINISHED[reason].inc()
+        if profile is not None:
+            Profiler.finish(profile, reason)
 
-if __name__ == "__main__":
+
+def serve_agi() -> None:
     try:
         IVRFlow.init()
-        app = AGIApplication()
+        app = IVRFlowApplication()
         app.router.add_route("*", "/{key:.+}", IVRFlow)
-        runner.run_app(app)
+        runner.run_app(
+            app,
+            host=config["agi.hostname"],
+            port=config["agi.port"],
+            reuse_port=Workers.index is not None,
+        )
     finally:
         log.info("Stopping IVRFlow...")
         loop = asyncio.new_event_loop()
         loop.run_until_complete(IVRFlow.stop())
         loop.close()
         log.info("IVRFlow has stopped")
+
+
+if __name__ == "__main__":
+    if config["ivrflow.workers.count"] > 1:
+        Workers.supervise(
+            count=config["ivrflow.workers.count"],
+            run_worker=serve_agi,
+            restart_delay=config["ivrflow.workers.restart_delay"],
+        )
+    else:
+        serve_agi()
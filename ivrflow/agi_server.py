@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from logging import getLogger
+from typing import Callable, List
+
+from aioagi.app import AGIApplication
+from aioagi.protocol import AGIRequestHandler
+from aioagi.server import AGIServer
+from mautrix.util.logging import TraceLogger
+
+log: TraceLogger = getLogger("ivrflow.agi_server")
+
+HANGUP_LINE = b"HANGUP"
+
+
+class IVRFlowRequestHandler(AGIRequestHandler):
+    """
+    Wrapper for AGIRequestHandler to notify when the caller hangs up.
+
+    Asterisk does not close a FastAGI connection when the caller hangs up, it sends an
+    unsolicited `HANGUP` line and keeps the connection open until the script closes it, and
+    the flow of a call only noticed it when its next AGI command failed. The callbacks in
+    `hangup_callbacks` are called once, when the `HANGUP` line is received or the connection
+    is lost, whichever comes first."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.hangup_callbacks: List[Callable[[], None]] = []
+
+    def data_received(self, data):
+        # Only the lines after the AGI environment are replies, the HANGUP line is also parsed
+        # by aioagi, which closes the connection
+        if self._payload_parser is not None and HANGUP_LINE in data.splitlines():
+            self.notify_hangup()
+
+        super().data_received(data)
+
+    def connection_lost(self, exc):
+        super().connection_lost(exc)
+        self.notify_hangup()
+
+    def notify_hangup(self) -> None:
+        callbacks, self.hangup_callbacks = self.hangup_callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                log.exception("Error in a hangup callback")
+
+
+class IVRFlowServer(AGIServer):
+    def __call__(self):
+        return IVRFlowRequestHandler(self, loop=self._loop, **self._kwargs)
+
+
+class IVRFlowApplication(AGIApplication):
+    """AGI application whose connections notify when the caller hangs up"""
+
+    server_cls = IVRFlowServer
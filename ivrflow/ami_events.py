@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+from logging import getLogger
+from time import time
+from typing import Any, Callable, Dict, List
+
+from aioagi.ami.manager import AMIManager
+from aioagi.ami.message import AMIMessage
+from mautrix.util.logging import TraceLogger
+
+from . import metrics
+from .types import ChannelUniqueID
+
+log: TraceLogger = getLogger("ivrflow.ami_events")
+
+# Called with the event, it can be a coroutine function
+EventListener = Callable[[AMIMessage], Any]
+
+
+class LiveChannel:
+    """State of a channel taken from the AMI events, kept until its Hangup event"""
+
+    __slots__ = ("uniqueid", "channel", "state", "caller_id", "exten", "variables", "updated_at")
+
+    def __init__(self, uniqueid: ChannelUniqueID) -> None:
+        self.uniqueid = uniqueid
+        self.channel: str | None = None
+        self.state: str | None = None
+        self.caller_id: str | None = None
+        self.exten: str | None = None
+        self.variables: Dict[str, str] = {}
+        self.updated_at = time()
+
+    def update(self, event: AMIMessage) -> None:
+        self.channel = event.get("Channel", self.channel)
+        self.state = event.get("ChannelStateDesc", self.state)
+        self.caller_id = event.get("CallerIDNum", self.caller_id)
+        self.exten = event.get("Exten", self.exten)
+        self.updated_at = time()
+
+    def serialize(self) -> Dict[str, Any]:
+        return {
+            "uniqueid": self.uniqueid,
+            "channel": self.channel,
+            "state": self.state,
+            "caller_id": self.caller_id,
+            "exten": self.exten,
+            "variables": self.variables,
+            "updated_at": self.updated_at,
+        }
+
+
+class AMIEvents:
+    """Subscription to the AMI event stream.
+
+    A single callback is registered in the AMI manager for every event, the events that are
+    not in `ami.events.subscribe` are dropped with a set lookup. The listeners of a channel
+    are indexed by its uniqueid, so dispatching an event does not depend on the number of
+    running calls. The events also keep the live state of each channel.
+    """
+
+    enabled: bool = False
+    subscribed: set[str] = set()
+    variables: set[str] = set()
+    channel_ttl: float = 0
+    listeners: Dict[ChannelUniqueID, List[EventListener]] = {}
+    event_listeners: Dict[str, List[EventListener]] = {}
+    channels: OrderedDict[ChannelUniqueID, LiveChannel] = OrderedDict()
+    stats: Dict[str, int] = {"received": 0, "dispatched": 0, "listener_errors": 0}
+
+    @classmethod
+    def init_cls(cls, config: Dict, ami_manager: AMIManager | None) -> None:
+        cls.enabled = bool(ami_manager) and config["ami.events.enabled"]
+        cls.subscribed = set(config["ami.events.subscribe"])
+        cls.variables = set(config["ami.events.variables"])
+        cls.channel_ttl = config["ami.events.channel_ttl"]
+        if cls.enabled:
+            ami_manager.register_event("*", cls.on_event)
+
+    @classmethod
+    def subscribe(cls, uniqueid: ChannelUniqueID, listener: EventListener) -> None:
+        """It adds a listener of the events of a channel"""
+        cls.listeners.setdefault(uniqueid, []).append(listener)
+
+    @classmethod
+    def unsubscribe(cls, uniqueid: ChannelUniqueID, listener: EventListener) -> None:
+        listeners = cls.listeners.get(uniqueid)
+        if not listeners:
+            return
+
+        try:
+            listeners.remove(listener)
+        except ValueError:
+            pass
+
+        if not listeners:
+            del cls.listeners[uniqueid]
+
+    @classmethod
+    def add_event_listener(cls, event_name: str, listener: EventListener) -> None:
+        """It adds a listener of every event with the given name"""
+        cls.event_listeners.setdefault(event_name, []).append(listener)
+
+    @classmethod
+    def on_event(cls, _: AMIManager, event: AMIMessage) -> None:
+        name = event.get("Event")
+        if name not in cls.subscribed:
+            return
+
+        cls.stats["received"] += 1
+        metrics.ami_events.labels(name).inc()
+        uniqueid = event.get("Uniqueid")
+        if uniqueid:
+            cls._update_channel(name, uniqueid, event)
+            cls._notify(cls.listeners.get(uniqueid), event)
+
+        cls._notify(cls.event_listeners.get(name), event)
+
+        if name == "Hangup":
+            cls.channels.pop(uniqueid, None)
+
+    @classmethod
+    def _notify(cls, listeners: List[EventListener] | None, event: AMIMessage) -> None:
+        if not listeners:
+            return
+
+        # A listener can unsubscribe itself while it is being notified
+        for listener in tuple(listeners):
+            cls.stats["dispatched"] += 1
+            try:
+                result = listener(event)
+                if asyncio.iscoroutine(result):
+                    asyncio.ensure_future(result)
+            except Exception:
+                cls.stats["listener_errors"] += 1
+                log.exception(f"Error in the listener of the {event.get('Event')} event")
+
+    @classmethod
+    def _update_channel(cls, name: str, uniqueid: ChannelUniqueID, event: AMIMessage) -> None:
+        live_channel = cls.channels.get(uniqueid)
+        if live_channel is None:
+            if name == "Hangup":
+                return
+
+            cls._prune_channels()
+            live_channel = cls.channels[uniqueid] = LiveChannel(uniqueid)
+        else:
+            cls.channels.move_to_end(uniqueid)
+
+        live_channel.update(event)
+        if name == "VarSet" and event.get("Variable") in cls.variables:
+            live_channel.variables[event["Variable"]] = event.get("Value")
+
+    @classmethod
+    def _prune_channels(cls) -> None:
+        # The channels are sorted by their last event, a channel whose Hangup event was lost
+        # (for example during an AMI reconnection) is dropped after `channel_ttl` seconds
+        limit = time() - cls.channel_ttl
+        while cls.channels:
+            live_channel = next(iter(cls.channels.values()))
+            if live_channel.updated_at > limit:
+                break
+            cls.channels.popitem(last=False)
+
+    @classmethod
+    def get_channel(cls, uniqueid: ChannelUniqueID) -> LiveChannel | None:
+        return cls.channels.get(uniqueid)
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        return {
+            **cls.stats,
+            "enabled": cls.enabled,
+            "channels": len(cls.channels),
+            "subscribed_channels": len(cls.listeners),
+        }
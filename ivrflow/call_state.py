@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+from typing import Dict
+from weakref import WeakSet
+
+
+class CallState:
+    """Counters of a call that are only needed while its flow is running.
+
+    It is owned by the channel of the call and released with it when the flow finishes,
+    so a caller that hangs up in the middle of a retry does not leave anything behind.
+    """
+
+    instances: WeakSet[CallState] = WeakSet()
+
+    def __init__(self) -> None:
+        # Validation attempts made in switch nodes, None until the first failed validation
+        self.validation_attempts: int | None = None
+        # Authentication attempts of the http_request node that is being retried
+        self.http_attempts: Dict | None = None
+        self.instances.add(self)
+
+    def clear(self) -> None:
+        self.validation_attempts = None
+        self.http_attempts = None
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, int]:
+        states = list(cls.instances)
+        return {
+            "calls": len(states),
+            "validation_attempts": sum(s.validation_attempts is not None for s in states),
+            "http_attempts": sum(s.http_attempts is not None for s in states),
+        }
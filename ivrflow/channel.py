@@ -1,27 +1,43 @@
 from __future__ import annotations
 
+import asyncio
 import json
+from collections import OrderedDict
+from datetime import datetime
 from logging import getLogger
-from typing import Any, Dict, List, cast
+from time import monotonic
+from typing import Any, Callable, Dict, List, cast
 
 from glom import Delete, PathAccessError, assign, glom
 from mautrix.util.logging import TraceLogger
 
+from .call_state import CallState
 from .config import Config
 from .db.channel import Channel as DBChannel
-from .db.channel import ChannelState
-from .scope import Scope
+from .db.channel import ChannelDurability, ChannelState
+from .db.channel_store import ChannelStore
+from .scope import Scope, ScopeHandler
 from .types import ChannelUniqueID
 from .utils.jq2glom import JQ2Glom
 from .utils.util import Util
 
 
 class Channel(DBChannel):
-    by_channel_uniqueid: Dict[ChannelUniqueID, "Channel"] = {}
+    # Ordered from the least to the most recently used channel
+    by_channel_uniqueid: OrderedDict[ChannelUniqueID, "Channel"] = OrderedDict()
 
     config: Config
     log: TraceLogger = getLogger("ivrflow.channel")
 
+    cache_max_size: int = 10000
+    cache_idle_ttl: float = 3600
+    cache_sweep_interval: float = 60
+    cache_stats: Dict[str, int] = {"evicted_finished": 0, "evicted_idle": 0, "evicted_size": 0}
+    # Channels whose flow is running, they are kept in the cache until it finishes
+    calls_running: int = 0
+    # Functions called with each channel removed from the cache
+    eviction_hooks: List[Callable[["Channel"], None]] = []
+
     # JQ2Glom instance
     _jq2glom: JQ2Glom = JQ2Glom()
 
@@ -32,7 +48,8 @@ class Channel(DBChannel):
         state: ChannelState = None,
         id: int = None,
         variables: str = "{}",
-        stack: str = "{}",
+        stack: str = "[]",
+        created_at: datetime | None = None,
     ) -> None:
         super().__init__(
             id=id,
@@ -41,15 +58,149 @@ class Channel(DBChannel):
             state=state,
             variables=f"{variables}",
             stack=stack,
+            created_at=created_at,
+        )
+        self._call_state: CallState | None = None
+        self._in_call: bool = False
+
+    @property
+    def in_call(self) -> bool:
+        """Set while the flow of a call runs on the channel, so it is not evicted under it"""
+        return self._in_call
+
+    @in_call.setter
+    def in_call(self, value: bool) -> None:
+        if value != self._in_call:
+            Channel.calls_running += 1 if value else -1
+            self._in_call = value
+
+    @property
+    def call_state(self) -> CallState:
+        """State of the call that is kept in memory until its flow finishes"""
+        if self._call_state is None:
+            self._call_state = CallState()
+        return self._call_state
+
+    @classmethod
+    def init_cls(cls, config: Config) -> None:
+        cls.config = config
+        cls.durability = ChannelDurability(config["ivrflow.channel_durability"])
+        cls.cache_max_size = config["ivrflow.channel_cache.max_size"]
+        cls.cache_idle_ttl = config["ivrflow.channel_cache.idle_ttl"]
+        cls.cache_sweep_interval = config["ivrflow.channel_cache.sweep_interval"]
+        # Set on the db class, the management API reads the channels through it
+        DBChannel.store = ChannelStore.create(
+            config["ivrflow.channel_store.backend"],
+            db=cls.db,
+            snapshot=config["ivrflow.channel_store.snapshot"],
         )
-        self.log = self.log.getChild(self.channel_uniqueid)
 
     def _add_to_cache(self) -> None:
         if self.channel_uniqueid:
+            self._last_access = monotonic()
             self.by_channel_uniqueid[self.channel_uniqueid] = self
+            self.by_channel_uniqueid.move_to_end(self.channel_uniqueid)
+            self._enforce_max_size()
+
+    @classmethod
+    def _enforce_max_size(cls) -> None:
+        excess = len(cls.by_channel_uniqueid) - cls.cache_max_size
+        # When every cached channel is in a call there is nothing to evict, the cache goes
+        # back under its size as the calls finish
+        if excess <= 0 or len(cls.by_channel_uniqueid) <= cls.calls_running:
+            return
+
+        evicted = []
+        for channel in cls.by_channel_uniqueid.values():
+            # Channels with buffered changes are kept until they are written, and the ones of
+            # running calls until their flow finishes
+            if channel.dirty or channel.in_call:
+                continue
+            evicted.append(channel)
+            if len(evicted) == excess:
+                break
+
+        for channel in evicted:
+            cls._evict(channel, reason="size")
+
+    @classmethod
+    def _evict(cls, channel: "Channel", reason: str) -> None:
+        if cls.by_channel_uniqueid.get(channel.channel_uniqueid) is not channel:
+            return
+
+        del cls.by_channel_uniqueid[channel.channel_uniqueid]
+        cls.store.forget(channel.channel_uniqueid)
+        cls.cache_stats[f"evicted_{reason}"] += 1
+        channel.log.debug(f"[{channel.channel_uniqueid}] Removed from the cache ({reason})")
+        for hook in cls.eviction_hooks:
+            try:
+                hook(channel)
+            except Exception:
+                channel.log.exception(f"[{channel.channel_uniqueid}] Error in eviction hook")
+
+    async def release(self) -> None:
+        """It writes the buffered changes of the channel and removes it from the cache
+
+        It is called when the flow of the call has finished. With the postgres store the
+        channel stays in the database and is loaded again if the same uniqueid comes back,
+        the memory store only keeps it if a snapshot is configured.
+        """
+        try:
+            await self.flush()
+            await self.store.release(self.values)
+        finally:
+            self.in_call = False
+            if self._call_state is not None:
+                self._call_state.clear()
+                self._call_state = None
+            self._evict(self, reason="finished")
+
+    @classmethod
+    async def expire_idle(cls) -> None:
+        """It removes from the cache the channels that have not been used for `idle_ttl`
+
+        The channels of running calls are kept, e.g. a call bridged for longer than
+        `idle_ttl` in a single node, they are removed when their flow finishes.
+        """
+        limit = monotonic() - cls.cache_idle_ttl
+        for channel in list(cls.by_channel_uniqueid.values()):
+            if channel._last_access > limit:
+                # The rest of the channels have been used more recently
+                break
+
+            if channel.in_call:
+                continue
+
+            try:
+                await channel.flush()
+            except Exception:
+                channel.log.exception(f"[{channel.channel_uniqueid}] Error writing the channel")
+                continue
+            cls._evict(channel, reason="idle")
+
+    @classmethod
+    async def sweep_cache(cls) -> None:
+        """It expires the idle channels every `sweep_interval` seconds, until it is cancelled"""
+        while True:
+            await asyncio.sleep(cls.cache_sweep_interval)
+            try:
+                await cls.expire_idle()
+            except Exception:
+                cls.log.exception("Error expiring idle channels")
+
+    @classmethod
+    def get_cache_stats(cls) -> Dict[str, int | float]:
+        return {
+            **cls.cache_stats,
+            "size": len(cls.by_channel_uniqueid),
+            "calls_running": cls.calls_running,
+            "max_size": cls.cache_max_size,
+            "idle_ttl": cls.cache_idle_ttl,
+            "store": cls.store.get_stats() if cls.store else None,
+        }
 
     async def clean_up(self) -> None:
-        del self.by_channel_uniqueid[self.channel_uniqueid]
+        self.by_channel_uniqueid.pop(self.channel_uniqueid, None)
         self.variables = "{}"
         self.node_id = "start"
         self.state = None
@@ -73,10 +224,9 @@ class Channel(DBChannel):
             The channel object
 
         """
-        try:
-            return cls.by_channel_uniqueid[channel_uniqueid]
-        except KeyError:
-            pass
+        channel = cls._get_cached(channel_uniqueid)
+        if channel is not None:
+            return channel
 
         channel: Channel | None = cast(
             cls, await super().get_by_channel_uniqueid(channel_uniqueid)
@@ -93,6 +243,53 @@ class Channel(DBChannel):
             channel._add_to_cache()
             return channel
 
+    @classmethod
+    def _get_cached(cls, channel_uniqueid: ChannelUniqueID) -> "Channel" | None:
+        try:
+            channel = cls.by_channel_uniqueid[channel_uniqueid]
+        except KeyError:
+            return None
+
+        channel._last_access = monotonic()
+        cls.by_channel_uniqueid.move_to_end(channel_uniqueid)
+        return channel
+
+    @classmethod
+    async def start_call(
+        cls, channel_uniqueid: ChannelUniqueID, variables: Dict[str, Any]
+    ) -> "Channel":
+        """It gets or creates the channel of a call that starts, with the given route variables
+
+        A channel that is not cached is read, or inserted with the variables, in a single
+        statement. The variables are also set in a channel that already existed, e.g. when
+        the dialplan runs a flow again for the same uniqueid.
+
+        Parameters
+        ----------
+        channel_uniqueid : ChannelUniqueID
+            The channel_uniqueid.
+        variables : Dict[str, Any]
+            Variables of the route scope, by their name.
+
+        Returns
+        -------
+            The channel object
+
+        """
+
+        channel = cls._get_cached(channel_uniqueid)
+        if channel is None:
+            seeded = json.dumps({"route": variables})
+            channel = cast(cls, await super().get_or_create(channel_uniqueid, seeded))
+            channel.in_call = True
+            channel._add_to_cache()
+            if channel.variables == seeded:
+                return channel
+
+        channel.in_call = True
+        await channel.set_variables(variables)
+        return channel
+
     async def get_variable(self, variable_id: str) -> Any | None:
         """This function returns the value of a variable with the given ID
 
@@ -124,41 +321,24 @@ class Channel(DBChannel):
             self.log.error(f"[{self.channel_uniqueid}] [VAR][GET] {scope.value}.{key} => {e}")
             return
 
-    async def set_variable(self, variable_id: str, value: Any) -> None:
-        """
-        The function sets a variable with a given ID and value, updates the variables dictionary.
-
-        Parameters
-        ----------
-        variable_id : str
-            The `variable_id` parameter is a string that represents
-            the unique identifier of the variable you want to set.
-        value : Any
-            The `value` parameter in the `set_variable` function is the value
-            that you want to assign to the variable identified by `variable_id`.
-            It can be of any data type (e.g., string, integer, boolean, etc.).
-
-        Returns
-        -------
-            None
-
-        """
+    def _assign_variable(self, variable_id: str, value: Any) -> ScopeHandler | None:
+        """It sets a variable in memory, returns the scope to write or None if it was not set"""
 
         if not variable_id:
-            return
+            return None
 
         scope, key = Util.get_scope_and_key(variable_id)
         if not key:
             self.log.error(
                 f"[{self.channel_uniqueid}] [VAR][SET] Invalid variable id (empty key): {variable_id!r}"
             )
-            return
+            return None
 
         try:
             entry = Scope(channel=self).resolve(scope)
         except Exception as e:
             self.log.error(str(e))
-            return
+            return None
 
         variables = entry.get_scope_vars()
 
@@ -169,9 +349,33 @@ class Channel(DBChannel):
             )
         except Exception as e:
             self.log.error(f"[{self.channel_uniqueid}] [VAR][SET] {scope.value}.{key} => {e}")
-            return
+            return None
 
-        await entry.update()
+        return entry
+
+    async def set_variable(self, variable_id: str, value: Any) -> None:
+        """
+        The function sets a variable with a given ID and value, updates the variables dictionary.
+
+        Parameters
+        ----------
+        variable_id : str
+            The `variable_id` parameter is a string that represents
+            the unique identifier of the variable you want to set.
+        value : Any
+            The `value` parameter in the `set_variable` function is the value
+            that you want to assign to the variable identified by `variable_id`.
+            It can be of any data type (e.g., string, integer, boolean, etc.).
+
+        Returns
+        -------
+            None
+
+        """
+
+        entry = self._assign_variable(variable_id, value)
+        if entry is not None:
+            await entry.update()
 
     async def set_variables(self, variables: Dict) -> None:
         """It takes a dictionary of variable IDs and values, and sets the variables to the values
@@ -182,8 +386,11 @@ class Channel(DBChannel):
             A dictionary of variable names and values.
 
         """
-        for variable in variables:
-            await self.set_variable(variable_id=variable, value=variables[variable])
+        # Every scope is stored in the variables of the channel, so they are written once
+        entries = [self._assign_variable(variable, value) for variable, value in variables.items()]
+        entry = next((entry for entry in entries if entry is not None), None)
+        if entry is not None:
+            await entry.update()
 
     async def update_ivr(self, node_id: str | ChannelState, state: ChannelState = None) -> None:
         """Updates the IVR's node_id and state, and then updates the IVR's content
@@ -206,7 +413,13 @@ class Channel(DBChannel):
         )
         self.node_id = _node_id
         self.state = state
-        await self.update()
+        if self.durability is ChannelDurability.CALL and state not in (
+            ChannelState.END,
+            ChannelState.HANGUP,
+        ):
+            self.mark_dirty()
+        else:
+            await self.update()
         self._add_to_cache()
 
     async def del_variables(self, variables: List = []) -> None:
@@ -21,6 +21,34 @@ class Config(BaseFileConfig):
         copy("ivrflow.load_flow_from")
         copy("ivrflow.enable_asyncio_debug")
         copy("ivrflow.backup_limit")
+        copy("ivrflow.template_cache.enabled")
+        copy("ivrflow.template_cache.max_size")
+        copy("ivrflow.render_mode")
+        copy("ivrflow.jq_cache.max_size")
+        copy("ivrflow.channel_durability")
+        copy("ivrflow.channel_cache.max_size")
+        copy("ivrflow.channel_cache.idle_ttl")
+        copy("ivrflow.channel_cache.sweep_interval")
+        copy("ivrflow.channel_store.backend")
+        copy("ivrflow.channel_store.snapshot")
+        copy("ivrflow.channel_partitions.interval_days")
+        copy("ivrflow.channel_partitions.premake")
+        copy("ivrflow.channel_partitions.retention_days")
+        copy("ivrflow.channel_partitions.archive")
+        copy("ivrflow.channel_partitions.maintenance_interval")
+        copy("ivrflow.token_cache.default_ttl")
+        copy("ivrflow.token_cache.refresh_margin")
+        copy("ivrflow.token_cache.max_size")
+        copy("ivrflow.profiling.enabled")
+        copy("ivrflow.profiling.sample_rate")
+        copy("ivrflow.hangup_detection.enabled")
+        copy("ivrflow.agi_environment.enabled")
+        copy("ivrflow.hot_reload.enabled")
+        copy("ivrflow.hot_reload.interval")
+        copy("ivrflow.workers.count")
+        copy("ivrflow.workers.restart_delay")
+        copy("agi.hostname")
+        copy("agi.port")
 
         # Logging
         copy_dict("logging")
@@ -41,6 +69,14 @@ class Config(BaseFileConfig):
         copy("ami.reconnect_delay")
 
         copy_dict("ami.originate_command")
+        copy("ami.bulk_originate.concurrency")
+        copy("ami.bulk_originate.calls_per_second")
+        copy("ami.bulk_originate.event_timeout")
+        copy("ami.bulk_originate.max_jobs")
+        copy("ami.events.enabled")
+        copy("ami.events.subscribe")
+        copy("ami.events.variables")
+        copy("ami.events.channel_ttl")
 
         shared_secret = self["server.unshared_secret"]
         if shared_secret is None or shared_secret == "generate":
@@ -1,6 +1,7 @@
 from mautrix.util.async_db import Database
 
 from .channel import Channel
+from .channel_partitions import ChannelPartitions
 from .flow import Flow
 from .migrations import upgrade_table
 from .module import Module
@@ -8,8 +9,8 @@ from .module_backup import ModuleBackup
 
 
 def init(db: Database) -> None:
-    for table in (Channel, Flow, Module, ModuleBackup):
+    for table in (Channel, ChannelPartitions, Flow, Module, ModuleBackup):
         table.db = db
 
 
-__all__ = ["upgrade_table", "Channel", "Flow", "Module", "ModuleBackup"]
+__all__ = ["upgrade_table", "Channel", "ChannelPartitions", "Flow", "Module", "ModuleBackup"]
@@ -1,15 +1,17 @@
 from __future__ import annotations
 
 import json
+from datetime import datetime
 from enum import Enum
-from queue import LifoQueue
-from typing import TYPE_CHECKING, ClassVar
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, ClassVar, Dict, List
 
-from asyncpg import Record
 from attr import dataclass, ib
 from mautrix.util.async_db import Database
 
+from ..profiler import Profiler
 from ..types import ChannelUniqueID
+from .channel_store import ChannelStore
 
 fake_db = Database.create("") if TYPE_CHECKING else None
 
@@ -20,18 +22,74 @@ class ChannelState(Enum):
     HANGUP = "hangup"
 
 
+class ChannelDurability(Enum):
+    """When the changes of a channel are written to the database.
+
+    - VARIABLE: every variable change is written as soon as it is made.
+    - NODE: variable changes are buffered and written with the node transition.
+    - CALL: changes are buffered and written when the call ends or hangs up.
+    """
+
+    VARIABLE = "variable"
+    NODE = "node"
+    CALL = "call"
+
+
+class CallStack:
+    """Subroutine nodes the flow has to return to, the last one is on top.
+
+    It is parsed once from the stack column of the channel and written back as a JSON array
+    with the rest of the channel.
+    """
+
+    __slots__ = ("nodes",)
+
+    max_depth: ClassVar[int] = 255
+
+    def __init__(self, nodes: List[str] | None = None) -> None:
+        self.nodes: List[str] = nodes or []
+
+    @classmethod
+    def loads(cls, value: str | None, channel_uniqueid: ChannelUniqueID) -> CallStack:
+        nodes = json.loads(value) if value else []
+        # Rows written before the stack was an array keep it under the uniqueid
+        if isinstance(nodes, dict):
+            nodes = nodes.get(channel_uniqueid) or []
+        return cls(nodes)
+
+    def dumps(self) -> str:
+        return json.dumps(self.nodes)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def top(self) -> str | None:
+        return self.nodes[-1] if self.nodes else None
+
+    def push(self, node_id: str) -> None:
+        if len(self.nodes) >= self.max_depth:
+            raise ValueError(f"The call stack reached its limit of {self.max_depth} nodes")
+        self.nodes.append(node_id)
+
+    def pop(self) -> str | None:
+        return self.nodes.pop() if self.nodes else None
+
+
 @dataclass
 class Channel:
     db: ClassVar[Database] = fake_db
+    store: ClassVar[ChannelStore] = None
+    durability: ClassVar[ChannelDurability] = ChannelDurability.VARIABLE
+    write_stats: ClassVar[Dict[str, int]] = {"writes": 0, "writes_saved": 0}
 
     id: int
     channel_uniqueid: ChannelUniqueID
     variables: str
     node_id: str
     state: ChannelState | str | None = ib(default=None)
-    stack: str = ib(default="{}")
-
-    _columns = "channel_uniqueid, variables, node_id, state, stack"
+    stack: str = ib(default="[]")
+    # The partition key of the row, set when the channel is read from the store
+    created_at: datetime | None = ib(default=None)
 
     @property
     def values(self) -> tuple:
@@ -44,18 +102,13 @@ class Channel:
         )
 
     @property
-    def _stack(self) -> LifoQueue | None:
-        stack: LifoQueue = LifoQueue(maxsize=255)
-        if self.stack:
-            try:
-                stack_dict = json.loads(self.stack)
-                stack.queue = stack_dict[self.channel_uniqueid] if stack_dict else []
-            except KeyError:
-                stack.queue = []
-        return stack
+    def call_stack(self) -> CallStack:
+        if not hasattr(self, "_call_stack_cache"):
+            self._call_stack_cache = CallStack.loads(self.stack, self.channel_uniqueid)
+        return self._call_stack_cache
 
     @classmethod
-    def _from_row(cls, row: Record) -> Channel | None:
+    def _from_row(cls, row: Dict[str, Any]) -> Channel | None:
         data = {**row}
         try:
             state = ChannelState(data.pop("state"))
@@ -66,14 +119,30 @@ class Channel:
 
     @classmethod
     async def get_by_channel_uniqueid(cls, channel_uniqueid: ChannelUniqueID) -> Channel | None:
-        q = f"SELECT id, {cls._columns} FROM channel WHERE channel_uniqueid=$1"
-        row = await cls.db.fetchrow(q, channel_uniqueid)
+        row = await cls.store.fetch(channel_uniqueid)
 
         return cls._from_row(row) if row else None
 
+    @classmethod
+    async def get_or_create(cls, channel_uniqueid: ChannelUniqueID, variables: str) -> Channel:
+        """It returns the channel, inserting it with the given variables if it does not exist"""
+        values = (channel_uniqueid, variables, "start", None, "[]")
+        return cls._from_row(await cls._write(cls.store.get_or_create, values))
+
     async def insert(self) -> str:
-        q = f"INSERT INTO channel ({self._columns}) VALUES ($1, $2, $3, $4, $5)"
-        await self.db.execute(q, *self.values)
+        await self._write(self.store.insert, self.values)
+
+    @staticmethod
+    async def _write(operation: Callable[..., Awaitable[Any]], *args) -> Any:
+        profile = Profiler.current()
+        if profile is None:
+            return await operation(*args)
+
+        start = perf_counter()
+        try:
+            return await operation(*args)
+        finally:
+            profile.add("db", perf_counter() - start)
 
     @property
     def _variables(self) -> dict:
@@ -85,15 +154,45 @@ class Channel:
         if hasattr(self, "_vars_cache"):
             self.variables = json.dumps(self._vars_cache)
 
+    def flush_stack(self):
+        if hasattr(self, "_call_stack_cache"):
+            self.stack = self._call_stack_cache.dumps()
+
+    @property
+    def dirty(self) -> bool:
+        return getattr(self, "_dirty", False)
+
+    def mark_dirty(self) -> None:
+        """Records a change that will be written by the next `update` or `flush`"""
+        if self.dirty:
+            self.write_stats["writes_saved"] += 1
+        self._dirty = True
+
     async def update(self) -> None:
+        if self.dirty:
+            # The buffered changes are written along with this update
+            self.write_stats["writes_saved"] += 1
+        await self._update()
+
+    async def _update(self) -> None:
         self.flush_vars()
-        q = (
-            "UPDATE channel SET variables = $2, node_id = $3, state = $4, stack=$5 "
-            "WHERE channel_uniqueid = $1"
-        )
-        await self.db.execute(q, *self.values)
+        self.flush_stack()
+        await self._write(self.store.update, self.values, self.created_at)
+        self._dirty = False
+        self.write_stats["writes"] += 1
 
     async def update_variables(self) -> None:
+        if self.durability is not ChannelDurability.VARIABLE:
+            self.mark_dirty()
+            return
+
         self.flush_vars()
-        q = "UPDATE channel SET variables = $2 WHERE channel_uniqueid = $1"
-        await self.db.execute(q, self.channel_uniqueid, self.variables)
+        await self._write(
+            self.store.update_variables, self.channel_uniqueid, self.variables, self.created_at
+        )
+        self.write_stats["writes"] += 1
+
+    async def flush(self) -> None:
+        """Writes the buffered changes of the channel, if there are any"""
+        if self.dirty:
+            await self._update()
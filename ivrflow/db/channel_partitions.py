@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import re
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+from typing import TYPE_CHECKING, Any, ClassVar, Dict, List
+
+from mautrix.util.async_db import Database
+from mautrix.util.logging import TraceLogger
+
+fake_db = Database.create("") if TYPE_CHECKING else None
+
+log: TraceLogger = getLogger("ivrflow.channel_partitions")
+
+
+class ChannelPartitions:
+    """Partitions of the channel table, by the creation time of its rows.
+
+    Each partition covers `interval_days` days and the maintenance creates the partitions
+    of the next `premake` intervals ahead of time. When `retention_days` is set, the
+    partitions whose rows are all older than it are dropped, or detached and renamed
+    `archive_<partition>` when `archive` is set, along with the channel_key rows of their
+    channels. Dropping a partition removes its rows at once, without the dead rows a DELETE
+    leaves to vacuum. The rows created when no partition covers them are kept in the default
+    partition.
+    """
+
+    db: ClassVar[Database] = fake_db
+    interval_days: int = 1
+    premake: int = 7
+    retention_days: int = 0
+    archive: bool = False
+    maintenance_interval: float = 3600
+    stats: Dict[str, Any] = {"created": 0, "dropped": 0, "archived": 0, "errors": 0}
+
+    _bound = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+    @classmethod
+    def init_cls(cls, config: Dict) -> None:
+        cls.interval_days = config["ivrflow.channel_partitions.interval_days"]
+        cls.premake = config["ivrflow.channel_partitions.premake"]
+        cls.retention_days = config["ivrflow.channel_partitions.retention_days"]
+        cls.archive = config["ivrflow.channel_partitions.archive"]
+        cls.maintenance_interval = config["ivrflow.channel_partitions.maintenance_interval"]
+
+    @classmethod
+    def _parse_bound(cls, value: str) -> datetime | None:
+        # MINVALUE, or a quoted timestamp in the time zone of the database session
+        if not value.startswith("'"):
+            return None
+
+        return datetime.fromisoformat(value.strip("'"))
+
+    @classmethod
+    async def get_partitions(cls) -> List[Dict[str, Any]]:
+        """It returns the partitions of the channel table sorted by name
+
+        Returns
+        -------
+            The name, start, end and estimated rows of each partition, the start and end
+            of the default partition are `None`.
+
+        """
+
+        q = (
+            "SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound, "
+            "c.reltuples::bigint AS rows FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'channel'::regclass ORDER BY c.relname"
+        )
+        partitions = []
+        for row in await cls.db.fetch(q):
+            match = cls._bound.search(row["bound"])
+            partitions.append(
+                {
+                    "name": row["name"],
+                    "start": cls._parse_bound(match.group(1)) if match else None,
+                    "end": cls._parse_bound(match.group(2)) if match else None,
+                    "default": match is None,
+                    "rows": max(row["rows"], 0),
+                }
+            )
+
+        return partitions
+
+    @classmethod
+    async def run(cls) -> None:
+        while True:
+            try:
+                await cls.maintain()
+            except Exception:
+                cls.stats["errors"] += 1
+                log.exception("Error in the maintenance of the channel partitions")
+
+            await asyncio.sleep(cls.maintenance_interval)
+
+    @classmethod
+    async def maintain(cls) -> None:
+        """It creates the next partitions and purges the ones older than the retention"""
+
+        partitions = await cls.get_partitions()
+        now = datetime.now(timezone.utc)
+        await cls._create_partitions(partitions, now)
+        if cls.retention_days > 0:
+            await cls._purge_partitions(partitions, now)
+
+    @classmethod
+    async def _create_partitions(cls, partitions: List[Dict[str, Any]], now: datetime) -> None:
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        ends = [partition["end"] for partition in partitions if partition["end"] is not None]
+        names = {partition["name"] for partition in partitions}
+        # After a long stop the rows of the missing days are in the default partition
+        start = max([today, *ends]).astimezone(timezone.utc)
+        interval = timedelta(days=cls.interval_days)
+
+        while start < today + interval * cls.premake:
+            end = start + interval
+            name = f"channel_p{start:%Y%m%d}"
+            if name in names:
+                start = end
+                continue
+
+            try:
+                await cls.db.execute(
+                    f'CREATE TABLE "{name}" PARTITION OF channel '
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                )
+            except Exception:
+                # The default partition has rows of this range
+                cls.stats["errors"] += 1
+                log.exception(f"Error creating the channel partition {name}")
+            else:
+                cls.stats["created"] += 1
+                log.info(f"Channel partition {name} created")
+
+            start = end
+
+    @classmethod
+    async def _purge_partitions(cls, partitions: List[Dict[str, Any]], now: datetime) -> None:
+        limit = now - timedelta(days=cls.retention_days)
+        for partition in partitions:
+            if partition["default"] or partition["end"] > limit:
+                continue
+
+            name = partition["name"]
+            async with cls.db.acquire() as conn, conn.transaction():
+                if cls.archive:
+                    await conn.execute(f'ALTER TABLE channel DETACH PARTITION "{name}"')
+                    await conn.execute(f'ALTER TABLE "{name}" RENAME TO "archive_{name}"')
+                else:
+                    await conn.execute(f'DROP TABLE "{name}"')
+                await conn.execute(
+                    "DELETE FROM channel_key WHERE created_at < $1", partition["end"]
+                )
+
+            cls.stats["archived" if cls.archive else "dropped"] += 1
+            log.info(
+                f"Channel partition {name} {'archived' if cls.archive else 'dropped'}, "
+                f"about {partition['rows']} rows older than {cls.retention_days} days"
+            )
+
+    @classmethod
+    async def explain_lookup(cls) -> Dict[str, Any]:
+        """It returns the plan of the lookup of the most recent channel by its channel_uniqueid
+
+        The lookup reads the created_at of the channel from channel_key, so Postgres prunes
+        the partitions when the query runs and only the index of the partition of the
+        channel is read, whatever the number of partitions kept by the retention.
+        """
+
+        uniqueid = await cls.db.fetchval(
+            "SELECT channel_uniqueid FROM channel_key ORDER BY created_at DESC LIMIT 1"
+        )
+        q = (
+            "EXPLAIN (ANALYZE, FORMAT JSON) SELECT id FROM channel WHERE channel_uniqueid = $1 "
+            "AND created_at = (SELECT created_at FROM channel_key WHERE channel_uniqueid = $1)"
+        )
+        result = await cls.db.fetchval(q, uniqueid or "explain")
+        plan = (json.loads(result) if isinstance(result, str) else result)[0]["Plan"]
+
+        scans: Dict[str, int] = {}
+        partitions = []
+        nodes = [plan]
+        while nodes:
+            node = nodes.pop()
+            # The partitions pruned when the query runs are never executed
+            if node["Node Type"].endswith("Scan") and node.get("Actual Loops"):
+                scans[node["Node Type"]] = scans.get(node["Node Type"], 0) + 1
+                if node.get("Relation Name", "channel_key") != "channel_key":
+                    partitions.append(node["Relation Name"])
+            nodes.extend(node.get("Plans", []))
+
+        return {
+            "scans": scans,
+            "partitions_read": partitions,
+            "uses_index": "Seq Scan" not in scans,
+            "plan": plan,
+        }
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        return {
+            **cls.stats,
+            "interval_days": cls.interval_days,
+            "premake": cls.premake,
+            "retention_days": cls.retention_days,
+            "archive": cls.archive,
+        }
@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from itertools import count
+from logging import getLogger
+from typing import Any, Dict, Type
+
+from mautrix.util.async_db import Database
+from mautrix.util.logging import TraceLogger
+
+from ..types import ChannelUniqueID
+
+log: TraceLogger = getLogger("ivrflow.channel_store")
+
+# Values of a channel row, in the order of `ChannelStore.columns`
+ChannelValues = tuple
+
+
+class ChannelStore(ABC):
+    """Where the rows of the channels are kept.
+
+    The values passed to the writes are `Channel.values`: channel_uniqueid, variables,
+    node_id, state and stack. The rows also have the id and created_at of the channel, its
+    created_at is passed back to the updates, so they only reach the partition of the row.
+    """
+
+    backend: str
+    columns = "channel_uniqueid, variables, node_id, state, stack"
+
+    @abstractmethod
+    async def fetch(self, channel_uniqueid: ChannelUniqueID) -> Dict[str, Any] | None:
+        """It returns the row of the channel, or None if there is none"""
+
+    @abstractmethod
+    async def insert(self, values: ChannelValues) -> None:
+        """It adds the row of a new channel"""
+
+    @abstractmethod
+    async def get_or_create(self, values: ChannelValues) -> Dict[str, Any]:
+        """It returns the row of the channel, inserting it with the given values if it is new"""
+
+    @abstractmethod
+    async def update(self, values: ChannelValues, created_at: datetime | None) -> None:
+        """It writes every value of the channel"""
+
+    @abstractmethod
+    async def update_variables(
+        self, channel_uniqueid: ChannelUniqueID, variables: str, created_at: datetime | None
+    ) -> None:
+        """It writes the variables of the channel"""
+
+    async def release(self, values: ChannelValues) -> None:
+        """It is called with the final values of a channel when its flow finishes"""
+
+    def forget(self, channel_uniqueid: ChannelUniqueID) -> None:
+        """It is called when a channel is removed from the channel cache"""
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend}
+
+    @staticmethod
+    def create(backend: str, db: Database, snapshot: bool = False) -> ChannelStore:
+        """It builds the store of the given backend
+
+        Parameters
+        ----------
+        backend : str
+            `postgres` or `memory`.
+        db : Database
+            The database of the channel table.
+        snapshot : bool
+            If True, the memory store writes each channel to the channel table when its
+            flow finishes.
+
+        Returns
+        -------
+            The channel store.
+
+        """
+
+        try:
+            store = STORES[backend]
+        except KeyError:
+            raise ValueError(f"Unknown channel store backend: {backend}")
+
+        return store.build(db, snapshot)
+
+    @classmethod
+    @abstractmethod
+    def build(cls, db: Database, snapshot: bool) -> ChannelStore:
+        """It builds the store with the options of `create`"""
+
+
+class PostgresChannelStore(ChannelStore):
+    """The channel table, every write is a database round trip.
+
+    Each channel has a row in channel_key, whose primary key keeps one channel per
+    channel_uniqueid and whose created_at is the one of the channel row. The reads go
+    through it and the updates filter by created_at, so Postgres only reads the partition
+    of the channel instead of probing the index of every partition.
+    """
+
+    backend = "postgres"
+    # The key is inserted first, so a channel_uniqueid that already exists inserts nothing
+    insert_key = (
+        "INSERT INTO channel_key (channel_uniqueid) VALUES ($1) "
+        "ON CONFLICT (channel_uniqueid) DO NOTHING RETURNING created_at"
+    )
+
+    def __init__(self, db: Database) -> None:
+        self.db = db
+
+    @classmethod
+    def build(cls, db: Database, snapshot: bool) -> PostgresChannelStore:
+        # Every write already reaches the channel table
+        return cls(db)
+
+    async def fetch(self, channel_uniqueid: ChannelUniqueID) -> Dict[str, Any] | None:
+        q = (
+            f"SELECT id, {self.columns}, created_at FROM channel "
+            "WHERE channel_uniqueid = $1 AND created_at = "
+            "(SELECT created_at FROM channel_key WHERE channel_uniqueid = $1)"
+        )
+        row = await self.db.fetchrow(q, channel_uniqueid)
+        return {**row} if row else None
+
+    async def insert(self, values: ChannelValues) -> None:
+        q = (
+            f"WITH key AS ({self.insert_key}) "
+            f"INSERT INTO channel ({self.columns}, created_at) "
+            "SELECT $1, $2, $3, $4, $5, created_at FROM key"
+        )
+        await self.db.execute(q, *values)
+
+    async def get_or_create(self, values: ChannelValues) -> Dict[str, Any]:
+        # A single round trip, the channel is only inserted along with a new key, and the
+        # primary key of channel_key makes concurrent calls with the same uniqueid wait
+        q = (
+            f"WITH key AS ({self.insert_key}), "
+            f"inserted AS (INSERT INTO channel ({self.columns}, created_at) "
+            f"SELECT $1, $2, $3, $4, $5, created_at FROM key RETURNING id, {self.columns}, created_at) "
+            "SELECT * FROM inserted UNION ALL "
+            f"SELECT id, {self.columns}, created_at FROM channel "
+            "WHERE channel_uniqueid = $1 AND NOT EXISTS (SELECT 1 FROM key) AND created_at = "
+            "(SELECT created_at FROM channel_key WHERE channel_uniqueid = $1)"
+        )
+        row = await self.db.fetchrow(q, *values)
+        if row is not None:
+            return {**row}
+
+        # The key was inserted by a concurrent call, whose row is not visible to the snapshot
+        # taken when this statement started, it is read with a new one
+        return await self.fetch(values[0])
+
+    async def update(self, values: ChannelValues, created_at: datetime | None) -> None:
+        q = (
+            "UPDATE channel SET variables = $2, node_id = $3, state = $4, stack=$5 "
+            "WHERE channel_uniqueid = $1 AND created_at = $6"
+        )
+        await self.db.execute(q, *values, created_at)
+
+    async def update_variables(
+        self, channel_uniqueid: ChannelUniqueID, variables: str, created_at: datetime | None
+    ) -> None:
+        q = "UPDATE channel SET variables = $2 WHERE channel_uniqueid = $1 AND created_at = $3"
+        await self.db.execute(q, channel_uniqueid, variables, created_at)
+
+    async def upsert(self, values: ChannelValues) -> None:
+        # The key row is locked until the end of the statement, so the writes of a channel are
+        # serialized. The xmax of a row inserted by ON CONFLICT DO UPDATE is 0.
+        q = (
+            "WITH key AS (INSERT INTO channel_key (channel_uniqueid) VALUES ($1) "
+            "ON CONFLICT (channel_uniqueid) DO UPDATE SET channel_uniqueid = $1 "
+            "RETURNING created_at, xmax = 0 AS inserted), "
+            "updated AS (UPDATE channel c SET variables = $2, node_id = $3, state = $4, "
+            "stack = $5 FROM key WHERE c.channel_uniqueid = $1 "
+            "AND c.created_at = key.created_at AND NOT key.inserted RETURNING c.id), "
+            f"inserted AS (INSERT INTO channel ({self.columns}, created_at) "
+            "SELECT $1, $2, $3, $4, $5, created_at FROM key WHERE key.inserted RETURNING id) "
+            "SELECT (SELECT count(*) FROM updated) + (SELECT count(*) FROM inserted)"
+        )
+        # A row inserted by a concurrent upsert is not visible to the snapshot of the
+        # statement that waited for it, the update is made again with a new snapshot
+        for _ in range(2):
+            if await self.db.fetchval(q, *values):
+                return
+
+        log.warning(f"[{values[0]}] The channel has a key but no row to update")
+
+
+class MemoryChannelStore(ChannelStore):
+    """Rows kept in the process, for flows whose state is only needed while the call lasts.
+
+    A row is dropped when its channel leaves the channel cache. With a snapshot store, the
+    final values of each channel are written to it when the flow finishes.
+    """
+
+    backend = "memory"
+
+    def __init__(self, snapshot_store: PostgresChannelStore | None = None) -> None:
+        self.rows: Dict[ChannelUniqueID, Dict[str, Any]] = {}
+        self.snapshot_store = snapshot_store
+        self.stats: Dict[str, int] = {"snapshots": 0, "snapshot_errors": 0}
+        self._ids = count(1)
+
+    @classmethod
+    def build(cls, db: Database, snapshot: bool) -> MemoryChannelStore:
+        return cls(snapshot_store=PostgresChannelStore(db) if snapshot else None)
+
+    def _set_row(self, values: ChannelValues) -> None:
+        channel_uniqueid, variables, node_id, state, stack = values
+        row = self.rows.get(channel_uniqueid)
+        if row is None:
+            row = self.rows[channel_uniqueid] = {
+                "id": next(self._ids),
+                "channel_uniqueid": channel_uniqueid,
+                "created_at": datetime.now(timezone.utc),
+            }
+        row.update(variables=variables, node_id=node_id, state=state, stack=stack)
+
+    async def fetch(self, channel_uniqueid: ChannelUniqueID) -> Dict[str, Any] | None:
+        row = self.rows.get(channel_uniqueid)
+        return dict(row) if row else None
+
+    async def insert(self, values: ChannelValues) -> None:
+        self._set_row(values)
+
+    async def get_or_create(self, values: ChannelValues) -> Dict[str, Any]:
+        if values[0] not in self.rows:
+            self._set_row(values)
+        return dict(self.rows[values[0]])
+
+    async def update(self, values: ChannelValues, created_at: datetime | None) -> None:
+        # A channel that left the cache while its call was running is added again
+        self._set_row(values)
+
+    async def update_variables(
+        self, channel_uniqueid: ChannelUniqueID, variables: str, created_at: datetime | None
+    ) -> None:
+        row = self.rows.get(channel_uniqueid)
+        if row is not None:
+            row["variables"] = variables
+
+    async def release(self, values: ChannelValues) -> None:
+        if self.snapshot_store is None:
+            return
+
+        try:
+            await self.snapshot_store.upsert(values)
+            self.stats["snapshots"] += 1
+        except Exception:
+            self.stats["snapshot_errors"] += 1
+            log.exception(f"[{values[0]}] Error writing the snapshot of the channel")
+
+    def forget(self, channel_uniqueid: ChannelUniqueID) -> None:
+        self.rows.pop(channel_uniqueid, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **super().get_stats(),
+            **self.stats,
+            "rows": len(self.rows),
+            "snapshot": self.snapshot_store is not None,
+        }
+
+
+STORES: Dict[str, Type[ChannelStore]] = {
+    store.backend: store for store in (PostgresChannelStore, MemoryChannelStore)
+}
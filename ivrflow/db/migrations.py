@@ -1,3 +1,5 @@
+from datetime import datetime, timedelta, timezone
+
 from asyncpg import Connection
 from mautrix.util.async_db import UpgradeTable
 
@@ -92,3 +94,94 @@ async def upgrade_v6(conn: Connection) -> None:
 
     # Create index on module_backup table
     await conn.execute("CREATE INDEX idx_module_backup_flow_id ON module_backup (flow_id)")
+
+
+@upgrade_table.register(description="Partition the channel table by creation time")
+async def upgrade_v7(conn: Connection) -> None:
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    tomorrow = today + timedelta(days=1)
+
+    # The current table becomes the partition of the rows created before this revision, so
+    # its rows are not copied. It is kept unless ivrflow.channel_partitions.retention_days is
+    # set, then it is purged like any other partition, retention_days after this upgrade
+    await conn.execute("ALTER TABLE channel RENAME TO channel_legacy")
+    await conn.execute(
+        "ALTER TABLE channel_legacy ADD COLUMN created_at TIMESTAMP WITH TIME ZONE "
+        "NOT NULL DEFAULT '-infinity'"
+    )
+    # The primary key of a partition must include the partition key, and the new table
+    # takes the name of the old one
+    await conn.execute(
+        "ALTER TABLE channel_legacy DROP CONSTRAINT channel_pkey, "
+        "ADD CONSTRAINT channel_legacy_pkey PRIMARY KEY (id, created_at)"
+    )
+    # With the bound of the partition already checked, the attach does not scan the table
+    await conn.execute(
+        "ALTER TABLE channel_legacy ADD CONSTRAINT channel_legacy_created_at "
+        f"CHECK (created_at < '{today.isoformat()}')"
+    )
+
+    await conn.execute(
+        """CREATE TABLE channel (
+            id                  INTEGER NOT NULL DEFAULT nextval('channel_id_seq'),
+            channel_uniqueid    TEXT NOT NULL,
+            variables           JSON,
+            node_id             TEXT,
+            state               TEXT,
+            stack               JSONB NOT NULL DEFAULT '{}'::jsonb,
+            created_at          TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)"""
+    )
+
+    # The sequence must not be dropped along with the legacy partition
+    await conn.execute("ALTER SEQUENCE channel_id_seq OWNED BY channel.id")
+
+    # A unique constraint of a partitioned table must include created_at, the lookups by
+    # channel_uniqueid use the index of each partition
+    await conn.execute("CREATE INDEX idx_channel_channel_uniqueid ON channel (channel_uniqueid)")
+
+    await conn.execute(
+        "ALTER TABLE channel ATTACH PARTITION channel_legacy "
+        f"FOR VALUES FROM (MINVALUE) TO ('{today.isoformat()}')"
+    )
+    await conn.execute("ALTER TABLE channel_legacy DROP CONSTRAINT channel_legacy_created_at")
+    await conn.execute(
+        f"CREATE TABLE channel_p{today:%Y%m%d} PARTITION OF channel "
+        f"FOR VALUES FROM ('{today.isoformat()}') TO ('{tomorrow.isoformat()}')"
+    )
+
+    # The rows created when no partition covers them, the next partitions are created by
+    # ChannelPartitions
+    await conn.execute("CREATE TABLE channel_default PARTITION OF channel DEFAULT")
+
+
+@upgrade_table.register(description="Store the call stack of the channels as a JSON array")
+async def upgrade_v8(conn: Connection) -> None:
+    # The stack was an object with the stack of the channel under its uniqueid. The empty
+    # objects of the old default are read as empty stacks, only the real stacks are rewritten
+    await conn.execute(
+        "UPDATE channel SET stack = COALESCE(stack -> channel_uniqueid, '[]'::jsonb) "
+        "WHERE jsonb_typeof(stack) = 'object' AND stack <> '{}'::jsonb"
+    )
+    await conn.execute("ALTER TABLE channel ALTER COLUMN stack SET DEFAULT '[]'::jsonb")
+
+
+@upgrade_table.register(description="Add the channel_key table, one row per channel_uniqueid")
+async def upgrade_v9(conn: Connection) -> None:
+    # The partitioned channel table can not have a unique constraint on channel_uniqueid, its
+    # uniqueness is kept by this table, which also holds the partition key of each channel
+    await conn.execute(
+        """CREATE TABLE channel_key (
+            channel_uniqueid    TEXT PRIMARY KEY,
+            created_at          TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        )"""
+    )
+    await conn.execute("CREATE INDEX idx_channel_key_created_at ON channel_key (created_at)")
+
+    # Only the keys are copied, the most recent row of a duplicated uniqueid is kept
+    await conn.execute(
+        "INSERT INTO channel_key (channel_uniqueid, created_at) "
+        "SELECT DISTINCT ON (channel_uniqueid) channel_uniqueid, created_at FROM channel "
+        "ORDER BY channel_uniqueid, created_at DESC, id DESC"
+    )
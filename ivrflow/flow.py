@@ -1,16 +1,21 @@
 from __future__ import annotations
 
 import logging
-from typing import Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, Union
 
+from attr import dataclass
 from mautrix.util.logging import TraceLogger
 
 from .channel import Channel
+from .flow_cache import FlowCache, FlowCacheEntry
+from .flow_compiler import CompiledFlow
 from .flow_utils import FlowUtils
 from .middlewares import ASRMiddleware, HTTPMiddleware, LLMMiddleware, TTSMiddleware
 from .models import Flow as FlowModel
+from .models.flow import NODE_MODELS
 from .nodes import (
     Answer,
+    Base,
     DatabaseDel,
     DatabaseGet,
     DatabasePut,
@@ -65,13 +70,30 @@ class Flow:
 
     def __init__(self) -> None:
         self.data: FlowModel = None
+        self.version: int | None = None
+        self.compiled: CompiledFlow | None = None
         self.nodes: List[Node] = []
         self.nodes_by_id: Dict[str, Node] = {}
+        self.runtimes_by_id: Dict[str, Node] = {}
 
     async def load_flow(self, flow_name: str):
-        self.data = await FlowModel.load_flow(flow_name=flow_name)
+        entry: FlowCacheEntry | None = await FlowCache.get(flow_name)
+        if entry is None:
+            raise ValueError(f"Flow [{flow_name}] could not be loaded")
+
+        # A call keeps the middlewares of the flow utils its flow version was built with,
+        # even if flow_utils.yaml is reloaded while it runs
+        if entry.flow_utils is None:
+            entry.flow_utils = self.flow_utils
+        self.flow_utils = entry.flow_utils
+
+        self.data = entry.data
+        self.version = entry.version
+        self.compiled = entry.compiled
         self.nodes = self.data.nodes or []
-        self.nodes_by_id: Dict[str, Dict] = {}
+        # The index is shared by every call running this version of the flow
+        self.nodes_by_id = entry.nodes_by_id
+        self.runtimes_by_id = entry.runtimes_by_id
 
     @property
     def flow_variables(self) -> Dict:
@@ -109,43 +131,24 @@ class Flow:
                 self._add_node_to_cache(node)
                 return node
 
-    def middleware(self, middleware_id: str, channel: Channel) -> HTTPMiddleware:
+    def middleware(self, middleware_id: str, channel: Channel | None = None) -> HTTPMiddleware:
         middleware_model = self.flow_utils.get_middleware_by_id(middleware_id=middleware_id)
 
         if not middleware_model:
             return
 
         try:
-            middleware_type = MiddlewareType(middleware_model.type)
-        except ValueError:
+            middleware_class, content_arg = MIDDLEWARE_FACTORIES[middleware_model.type]
+        except KeyError:
             self.log.error(f"Middleware type {middleware_model.type} is not supported.")
             return
 
-        if middleware_type in (MiddlewareType.jwt, MiddlewareType.basic):
-            middleware_initialized = HTTPMiddleware(
-                http_middleware_content=middleware_model,
-                channel=channel,
-                default_variables=self.flow_variables,
-            )
-        elif middleware_type == MiddlewareType.tts:
-            middleware_initialized = TTSMiddleware(
-                tts_middleware_content=middleware_model,
-                channel=channel,
-                default_variables=self.flow_variables,
-            )
-        elif middleware_type == MiddlewareType.asr:
-            middleware_initialized = ASRMiddleware(
-                asr_middleware_content=middleware_model,
-                channel=channel,
-                default_variables=self.flow_variables,
-            )
-        elif middleware_type == MiddlewareType.llm:
-            middleware_initialized = LLMMiddleware(
-                llm_middleware_content=middleware_model,
-                channel=channel,
-                default_variables=self.flow_variables,
-            )
-
+        middleware_initialized = middleware_class(
+            **{content_arg: middleware_model},
+            channel=channel,
+            default_variables=self.flow_variables,
+        )
+        middleware_initialized.compiled_flow = self.flow_utils.compiled
         return middleware_initialized
 
     def node(self, channel: Channel) -> Optional[Node]:
@@ -155,141 +158,121 @@ class Flow:
             return
 
         try:
-            node_type = NodeType(node_data.type)
-        except ValueError:
-            self.log.error(f"Node type {node_data.type} is not supported.")
-            return
+            return self.runtimes_by_id[node_data.id]
+        except KeyError:
+            pass
 
-        if node_type == NodeType.playback:
-            node_initialized = Playback(
-                playback_content=node_data, default_variables=self.flow_variables, channel=channel
-            )
-            if node_data.middleware:
-                middleware_id = list(node_data.middleware.keys())[0]
-                middleware = self.middleware(middleware_id, channel=channel)
-                node_initialized.middleware = middleware
-        elif node_type == NodeType.switch:
-            node_initialized = Switch(
-                switch_content=node_data, default_variables=self.flow_variables, channel=channel
-            )
-        elif node_type == NodeType.http_request:
-            node_initialized = HTTPRequest(
-                http_request_content=node_data,
-                default_variables=self.flow_variables,
-                channel=channel,
-            )
-            if node_data.middleware:
-                middleware = self.middleware(node_data.middleware, channel=channel)
-                node_initialized.middleware = middleware
-        elif node_type == NodeType.get_data:
-            node_initialized = GetData(
-                get_data_content=node_data, channel=channel, default_variables=self.flow_variables
-            )
-            if node_data.middlewares:
-                middlewares = []
-                for key, _ in node_data.middlewares.items():
-                    middlewares.append(self.middleware(key, channel=channel))
-                node_initialized.middlewares = middlewares
-        elif node_type == NodeType.set_variable:
-            node_initialized = SetVariable(
-                set_variable_content=node_data,
-                default_variables=self.flow_variables,
-                channel=channel,
-            )
-        elif node_type == NodeType.record:
-            node_initialized = Record(
-                record_content=node_data, default_variables=self.flow_variables, channel=channel
-            )
-        elif node_type == NodeType.hangup:
-            node_initialized = Hangup(
-                hangup_content=node_data,
-                default_variables=self.flow_variables,
-                channel=channel,
-            )
-        elif node_type == NodeType.set_music:
-            node_initialized = SetMusic(
-                set_music_content=node_data,
-                default_variables=self.flow_variables,
-                channel=channel,
-            )
-        elif node_type == NodeType.verbose:
-            node_initialized = Verbose(
-                verbose_content=node_data, default_variables=self.flow_variables, channel=channel
-            )
-        elif node_type == NodeType.set_callerid:
-            node_initialized = SetCallerID(
-                set_callerid_content=node_data,
-                default_variables=self.flow_variables,
-                channel=channel,
-            )
-        elif node_type == NodeType.exec_app:
-            node_initialized = ExecApp(
-                exec_app_content=node_data,
-                default_variables=self.flow_variables,
-                channel=channel,
-            )
-        elif node_type == NodeType.database_get:
-            node_initialized = DatabaseGet(
-                database_get_content=node_data,
-                default_variables=self.flow_variables,
-                channel=channel,
-            )
-        elif node_type == NodeType.get_full_variable:
-            node_initialized = GetFullVariable(
-                get_full_variable_content=node_data,
-                default_variables=self.flow_variables,
-                channel=channel,
-            )
-
-        elif node_type == NodeType.database_del:
-            node_initialized = DatabaseDel(
-                database_del_content=node_data,
-                default_variables=self.flow_variables,
-                channel=channel,
-            )
-        elif node_type == NodeType.email:
-            node_initialized = Email(
-                email_content=node_data,
-                default_variables=self.flow_variables,
-                channel=channel,
-            )
-        elif node_type == NodeType.database_put:
-            node_initialized = DatabasePut(
-                database_put_content=node_data,
-                default_variables=self.flow_variables,
-                channel=channel,
-            )
-        elif node_type == NodeType.answer:
-            node_initialized = Answer(
-                answer_content=node_data,
-                default_variables=self.flow_variables,
-                channel=channel,
-            )
-        elif node_type == NodeType.goto_on_exit:
-            node_initialized = GotoOnExit(
-                goto_on_exit_content=node_data,
-                default_variables=self.flow_variables,
-                channel=channel,
-            )
-        elif node_type == NodeType.subroutine:
-            node_initialized = Subroutine(
-                subroutine_node_data=node_data,
-                default_variables=self.flow_variables,
-                channel=channel,
-            )
-        elif node_type == NodeType.no_op:
-            node_initialized = NoOp(
-                no_op_content=node_data,
-                default_variables=self.flow_variables,
-                channel=channel,
-            )
-        elif node_type == NodeType.set_vars:
-            node_initialized = SetVars(
-                default_variables=self.flow_variables,
-                set_vars_content=node_data,
-                channel=channel,
-            )
-        else:
+        try:
+            factory = NODE_FACTORIES[node_data.type]
+        except KeyError:
+            self.log.error(f"Node type {node_data.type} is not supported.")
             return
 
+        # The runtime is shared by the calls running this version of the flow, each call
+        # finds its channel in its AGI context
+        node_initialized = factory.build(flow=self, node_data=node_data, channel=None)
+        node_initialized.compiled_flow = self.compiled
+        self.runtimes_by_id[node_data.id] = node_initialized
         return node_initialized
+
+
+def _wire_playback_middleware(flow: Flow, node_data: Any, node: Playback, channel: Channel):
+    if node_data.middleware:
+        middleware_id = list(node_data.middleware.keys())[0]
+        node.middleware = flow.middleware(middleware_id, channel=channel)
+
+
+def _wire_http_request_middleware(flow: Flow, node_data: Any, node: HTTPRequest, channel: Channel):
+    if node_data.middleware:
+        node.middleware = flow.middleware(node_data.middleware, channel=channel)
+
+
+def _wire_get_data_middlewares(flow: Flow, node_data: Any, node: GetData, channel: Channel):
+    if node_data.middlewares:
+        node.middlewares = [flow.middleware(key, channel=channel) for key in node_data.middlewares]
+
+
+@dataclass
+class NodeFactory:
+    """How the runtime of a node type is built from its dataclass.
+
+    `content_arg` is the name of the argument that receives the dataclass in the constructor
+    of the runtime, and `wire_middlewares` sets the middlewares the node uses, if any.
+    """
+
+    runtime: Type[Base]
+    content_arg: str
+    wire_middlewares: Callable[[Flow, Any, Node, Channel], None] | None = None
+
+    def build(self, flow: Flow, node_data: Any, channel: Channel | None = None) -> Node:
+        node = self.runtime(
+            **{self.content_arg: node_data},
+            channel=channel,
+            default_variables=flow.flow_variables,
+        )
+        if self.wire_middlewares is not None:
+            self.wire_middlewares(flow, node_data, node, channel)
+        return node
+
+
+NODE_FACTORIES: Dict[str, NodeFactory] = {
+    NodeType.playback.value: NodeFactory(Playback, "playback_content", _wire_playback_middleware),
+    NodeType.switch.value: NodeFactory(Switch, "switch_content"),
+    NodeType.http_request.value: NodeFactory(
+        HTTPRequest, "http_request_content", _wire_http_request_middleware
+    ),
+    NodeType.get_data.value: NodeFactory(GetData, "get_data_content", _wire_get_data_middlewares),
+    NodeType.set_variable.value: NodeFactory(SetVariable, "set_variable_content"),
+    NodeType.record.value: NodeFactory(Record, "record_content"),
+    NodeType.hangup.value: NodeFactory(Hangup, "hangup_content"),
+    NodeType.set_music.value: NodeFactory(SetMusic, "set_music_content"),
+    NodeType.verbose.value: NodeFactory(Verbose, "verbose_content"),
+    NodeType.set_callerid.value: NodeFactory(SetCallerID, "set_callerid_content"),
+    NodeType.exec_app.value: NodeFactory(ExecApp, "exec_app_content"),
+    NodeType.database_get.value: NodeFactory(DatabaseGet, "database_get_content"),
+    NodeType.get_full_variable.value: NodeFactory(GetFullVariable, "get_full_variable_content"),
+    NodeType.database_del.value: NodeFactory(DatabaseDel, "database_del_content"),
+    NodeType.email.value: NodeFactory(Email, "email_content"),
+    NodeType.database_put.value: NodeFactory(DatabasePut, "database_put_content"),
+    NodeType.answer.value: NodeFactory(Answer, "answer_content"),
+    NodeType.goto_on_exit.value: NodeFactory(GotoOnExit, "goto_on_exit_content"),
+    NodeType.subroutine.value: NodeFactory(Subroutine, "subroutine_node_data"),
+    NodeType.no_op.value: NodeFactory(NoOp, "no_op_content"),
+    NodeType.set_vars.value: NodeFactory(SetVars, "set_vars_content"),
+}
+
+MIDDLEWARE_FACTORIES: Dict[str, Tuple[Type[Base], str]] = {
+    MiddlewareType.jwt.value: (HTTPMiddleware, "http_middleware_content"),
+    MiddlewareType.basic.value: (HTTPMiddleware, "http_middleware_content"),
+    MiddlewareType.tts.value: (TTSMiddleware, "tts_middleware_content"),
+    MiddlewareType.asr.value: (ASRMiddleware, "asr_middleware_content"),
+    MiddlewareType.llm.value: (LLMMiddleware, "llm_middleware_content"),
+}
+
+
+def register_node_type(
+    node_type: str,
+    model: Type,
+    runtime: Type[Base],
+    content_arg: str,
+    wire_middlewares: Callable[[Flow, Any, Node, Channel], None] | None = None,
+) -> None:
+    """It adds a node type, or replaces an existing one
+
+    Parameters
+    ----------
+    node_type : str
+        The value of the `type` field of the node in the flow.
+    model : Type
+        The dataclass the node is parsed into.
+    runtime : Type[Base]
+        The class that runs the node.
+    content_arg : str
+        The name of the argument of the runtime constructor that receives the dataclass.
+    wire_middlewares : Callable, optional
+        A function that sets the middlewares of the runtime.
+
+    """
+
+    NODE_MODELS[node_type] = model
+    NODE_FACTORIES[node_type] = NodeFactory(runtime, content_arg, wire_middlewares)
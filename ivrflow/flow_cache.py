@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field, replace
+from itertools import count
+from time import time
+from typing import Any, Dict
+
+from mautrix.util.logging import TraceLogger
+
+from .config import config
+from .flow_compiler import CompiledFlow
+from .models import Flow as FlowModel
+from .types import NodeType
+from .utils import JQCache, Util
+from .workers import Workers
+
+log: TraceLogger = logging.getLogger("ivrflow.flow_cache")
+
+
+@dataclass
+class FlowCacheEntry:
+    """A parsed flow shared by every call that runs it.
+
+    Entries are not modified after they are built, apart from the node runtimes that are
+    added as calls reach each node and the flow utils they are built with, set by the first
+    call; a reload creates a new entry with a higher version, so a call that already holds an
+    entry keeps running on it.
+    """
+
+    name: str
+    version: int
+    data: FlowModel
+    nodes_by_id: Dict[str, Any] = field(default_factory=dict)
+    compiled: CompiledFlow = field(default_factory=CompiledFlow)
+    # Node runtimes, built the first time a call reaches each node
+    runtimes_by_id: Dict[str, Any] = field(default_factory=dict)
+    # The FlowUtils whose middlewares are wired into the runtimes
+    flow_utils: Any = None
+    mtime: int | None = None
+    flow_id: int | None = None
+    loaded_at: float = field(default_factory=time)
+
+
+class FlowCache:
+    """Process-wide cache of parsed flows keyed by flow name.
+
+    In `yaml` mode an entry is reloaded when the modification time of its file changes,
+    by the call that finds it changed, or by `FlowWatcher` when hot reload is enabled.
+    In `database` mode entries are invalidated by the management API when a flow or one of
+    its modules is written.
+    """
+
+    entries_by_name: Dict[str, FlowCacheEntry] = {}
+    stats: Dict[str, int] = {"hits": 0, "misses": 0, "reloads": 0, "invalidations": 0}
+
+    _locks: Dict[str, asyncio.Lock] = {}
+    _versions = count(1)
+
+    @classmethod
+    def _get_lock(cls, flow_name: str) -> asyncio.Lock:
+        try:
+            return cls._locks[flow_name]
+        except KeyError:
+            lock = cls._locks[flow_name] = asyncio.Lock()
+            return lock
+
+    @staticmethod
+    def _get_mtime(flow_name: str) -> int | None:
+        try:
+            return os.stat(FlowModel.yaml_path(flow_name)).st_mtime_ns
+        except OSError:
+            return None
+
+    @classmethod
+    def _is_fresh(cls, entry: FlowCacheEntry) -> bool:
+        # The watcher reloads the changed files, the calls do not need to check them
+        if config["ivrflow.load_flow_from"] != "yaml" or config["ivrflow.hot_reload.enabled"]:
+            return True
+
+        return entry.mtime == cls._get_mtime(entry.name)
+
+    @classmethod
+    async def get(cls, flow_name: str) -> FlowCacheEntry | None:
+        """It returns the cached flow, loading or reloading it when needed
+
+        Parameters
+        ----------
+        flow_name : str
+            The name of the flow.
+
+        Returns
+        -------
+            The cache entry of the flow, or `None` if the flow could not be loaded.
+
+        """
+
+        entry = cls.entries_by_name.get(flow_name)
+        if entry is not None and cls._is_fresh(entry):
+            cls.stats["hits"] += 1
+            return entry
+
+        async with cls._get_lock(flow_name):
+            # Another call may have loaded the flow while this one was waiting for the lock
+            current = cls.entries_by_name.get(flow_name)
+            if current is not None and current is not entry and cls._is_fresh(current):
+                cls.stats["hits"] += 1
+                return current
+
+            if current is None:
+                cls.stats["misses"] += 1
+            else:
+                cls.stats["reloads"] += 1
+
+            return await cls._load(flow_name)
+
+    @classmethod
+    async def _load(cls, flow_name: str) -> FlowCacheEntry | None:
+        start = time()
+        mtime = cls._get_mtime(flow_name) if config["ivrflow.load_flow_from"] == "yaml" else None
+        data = await FlowModel.load_flow(flow_name=flow_name)
+
+        if data is None:
+            cls.entries_by_name.pop(flow_name, None)
+            return None
+
+        entry = FlowCacheEntry(
+            name=flow_name,
+            version=next(cls._versions),
+            data=data,
+            nodes_by_id={node.id: node for node in data.nodes or [] if node is not None},
+            compiled=CompiledFlow.compile_objects(data.nodes),
+            mtime=mtime,
+            flow_id=data.flow_id,
+        )
+        JQCache.precompile(cls._get_jq_filters(data))
+        cls.entries_by_name[flow_name] = entry
+        log.info(
+            f"Flow [{flow_name}] cached with version {entry.version} "
+            f"in {round(time() - start, 4)} seconds"
+        )
+        return entry
+
+    @classmethod
+    async def reload(cls, flow_name: str) -> FlowCacheEntry | None:
+        """It loads again a flow, the calls already running keep the entry they hold
+
+        Parameters
+        ----------
+        flow_name : str
+            The name of the flow.
+
+        Returns
+        -------
+            The new cache entry of the flow, or `None` if the flow no longer exists.
+
+        """
+
+        async with cls._get_lock(flow_name):
+            cls.stats["reloads"] += 1
+            return await cls._load(flow_name)
+
+    @staticmethod
+    def _get_jq_filters(data: FlowModel) -> list[str]:
+        filters = []
+        for node in data.nodes or []:
+            if node is not None and node.type == NodeType.http_request.value:
+                filters.extend(Util.get_jq_filters(node.variables))
+
+        return filters
+
+    @classmethod
+    def invalidate(cls, flow_name: str | None = None) -> None:
+        """It removes a flow from the cache, or every flow if no name is given
+
+        Parameters
+        ----------
+        flow_name : str, optional
+            The name of the flow to remove.
+
+        """
+
+        if flow_name is None:
+            cls.stats["invalidations"] += len(cls.entries_by_name)
+            cls.entries_by_name.clear()
+            return
+
+        if cls.entries_by_name.pop(flow_name, None) is not None:
+            cls.stats["invalidations"] += 1
+            log.debug(f"Flow [{flow_name}] removed from the cache")
+
+    @classmethod
+    def renew(cls) -> None:
+        """It replaces every entry with a new version of the same flow without node runtimes
+
+        The new calls build the runtimes again, e.g. with the middlewares of a reloaded
+        flow_utils.yaml, while the calls already running keep the previous entry.
+        """
+
+        for name, entry in list(cls.entries_by_name.items()):
+            cls.entries_by_name[name] = replace(
+                entry, version=next(cls._versions), runtimes_by_id={}, flow_utils=None
+            )
+
+    @classmethod
+    def invalidate_by_flow_id(cls, flow_id: int, broadcast: bool = True) -> None:
+        """It removes from the cache the flows loaded from the database with the given ID
+
+        Parameters
+        ----------
+        flow_id : int
+            The database ID of the flow.
+        broadcast : bool, optional
+            Whether to remove it from the caches of the other workers too.
+
+        """
+
+        if broadcast:
+            Workers.broadcast("invalidate_flow", flow_id=flow_id)
+
+        for entry in list(cls.entries_by_name.values()):
+            if entry.flow_id == flow_id:
+                cls.invalidate(entry.name)
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        return {
+            **cls.stats,
+            "flows": {
+                name: {"version": entry.version, "nodes": len(entry.nodes_by_id)}
+                for name, entry in cls.entries_by_name.items()
+            },
+        }
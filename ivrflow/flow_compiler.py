@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import copy
+from enum import Enum
+from logging import Logger, getLogger
+from typing import Any, Dict, Iterable, List, Tuple
+
+import attr
+from jinja2 import meta
+
+from .jinja.env import jinja_env
+from .jinja.template_cache import TemplateCache
+from .utils import Util
+
+log: Logger = getLogger("ivrflow.flow_compiler")
+
+
+class PlanKind(Enum):
+    LITERAL = "literal"
+    TEMPLATE = "template"
+    INVALID = "invalid"
+    DICT = "dict"
+    LIST = "list"
+    MODEL = "model"
+
+
+class RenderPlan:
+    """Precompiled form of a raw value of a flow.
+
+    Literal leaves are evaluated once when the flow is compiled, templates are compiled once,
+    and containers are rebuilt on each render with their literal leaves reused as they are.
+    """
+
+    __slots__ = ("kind", "value", "source", "items", "dynamic", "renderable")
+
+    def __init__(
+        self,
+        kind: PlanKind,
+        value: Any = None,
+        source: str | None = None,
+        items: List[Tuple[Any, RenderPlan]] | None = None,
+    ) -> None:
+        self.kind = kind
+        self.value = value
+        self.source = source
+        self.items = items
+        if items is not None:
+            self.dynamic = any(plan.dynamic for _, plan in items)
+            # Nested models are only walked to reach their fields, they are never rendered
+            self.renderable = kind is not PlanKind.MODEL and all(p.renderable for _, p in items)
+        else:
+            self.dynamic = kind in (PlanKind.TEMPLATE, PlanKind.INVALID)
+            self.renderable = True
+
+    @classmethod
+    def compile(cls, data: Any) -> RenderPlan:
+        """It builds the render plan of a raw value
+
+        Parameters
+        ----------
+        data : Any
+            The raw value, as it is defined in the flow.
+
+        Returns
+        -------
+            The render plan of the value.
+
+        """
+
+        if isinstance(data, dict):
+            return cls(PlanKind.DICT, items=[(k, cls.compile(v)) for k, v in data.items()])
+        elif isinstance(data, list):
+            return cls(PlanKind.LIST, items=[(i, cls.compile(v)) for i, v in enumerate(data)])
+        elif isinstance(data, str):
+            if not TemplateCache.is_template(data):
+                return cls(PlanKind.LITERAL, value=Util.evaluate_literal(data), source=data)
+
+            try:
+                template = TemplateCache.get_template(data, native=Util.native_render)
+                return cls(PlanKind.TEMPLATE, value=template, source=data)
+            except Exception as e:
+                # Keep the error at render time, where it is logged as it always was
+                log.warning(f"Template {data!r} could not be compiled: {e}")
+                return cls(PlanKind.INVALID, source=data)
+        else:
+            return cls(PlanKind.LITERAL, value=data)
+
+    def render(self, variables: Dict) -> Any:
+        """It renders the value with the given variables
+
+        Parameters
+        ----------
+        variables : Dict
+            The variables to be used in the rendering.
+
+        Returns
+        -------
+            The rendered value, equal to what `Util.render_data` returns for the raw value.
+
+        """
+
+        kind = self.kind
+        if kind is PlanKind.LITERAL:
+            value = self.value
+            # Containers produced by the literal evaluation are not shared between renders
+            return copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+        elif kind is PlanKind.TEMPLATE:
+            return Util.render_template(self.value, variables)
+        elif kind is PlanKind.DICT:
+            return {key: plan.render(variables) for key, plan in self.items}
+        elif kind is PlanKind.LIST:
+            return [plan.render(variables) for _, plan in self.items]
+        else:
+            return Util.render_template(self.source, variables)
+
+    def fields(self, path: str = "") -> Iterable[Tuple[str, RenderPlan]]:
+        """It yields the path and plan of each leaf of the value"""
+
+        if self.items is None:
+            yield path, self
+            return
+
+        for key, plan in self.items:
+            if self.kind is PlanKind.LIST:
+                yield from plan.fields(f"{path}[{key}]")
+            else:
+                yield from plan.fields(f"{path}.{key}" if path else str(key))
+
+    def describe(self) -> Dict[str, Any]:
+        """It returns a serializable description of the plan of a leaf"""
+
+        description = {"dynamic": self.dynamic, "kind": self.kind.value}
+        if self.kind is PlanKind.TEMPLATE:
+            description["variables"] = sorted(
+                meta.find_undeclared_variables(jinja_env.parse(self.source))
+            )
+        return description
+
+
+class CompiledFlow:
+    """Render plans of every node of a flow, indexed by the raw values they belong to.
+
+    The raw values are looked up by identity, so nodes keep passing `self.content.<field>`
+    to `render_data` and get the precompiled plan of that exact value.
+    """
+
+    def __init__(self) -> None:
+        self.plans_by_id: Dict[int, Tuple[Any, RenderPlan]] = {}
+        self.fields_by_node: Dict[str, Dict[str, RenderPlan]] = {}
+
+    @classmethod
+    def compile_objects(cls, objects: Iterable[Any]) -> CompiledFlow:
+        """It compiles a list of nodes or middlewares
+
+        Parameters
+        ----------
+        objects : Iterable[Any]
+            The models to compile, as loaded from the flow.
+
+        Returns
+        -------
+            The compiled flow.
+
+        """
+
+        compiled = cls()
+        for obj in objects or []:
+            if obj is None or not attr.has(type(obj)):
+                continue
+
+            fields: Dict[str, RenderPlan] = {}
+            for field in attr.fields(type(obj)):
+                if field.name in ("id", "type"):
+                    continue
+                field_plan = compiled._register(getattr(obj, field.name))
+                for path, plan in field_plan.fields(field.name):
+                    fields[path] = plan
+
+            compiled.fields_by_node[obj.id] = fields
+
+        return compiled
+
+    def _register(self, data: Any) -> RenderPlan:
+        if attr.has(type(data)):
+            items = [
+                (f.name, self._register(getattr(data, f.name))) for f in attr.fields(type(data))
+            ]
+            return RenderPlan(PlanKind.MODEL, items=items)
+        elif isinstance(data, dict):
+            plan = RenderPlan(
+                PlanKind.DICT, items=[(k, self._register(v)) for k, v in data.items()]
+            )
+        elif isinstance(data, list):
+            plan = RenderPlan(
+                PlanKind.LIST, items=[(i, self._register(v)) for i, v in enumerate(data)]
+            )
+        else:
+            plan = RenderPlan.compile(data)
+
+        if plan.renderable and isinstance(data, (dict, list, str)):
+            self.plans_by_id[id(data)] = (data, plan)
+
+        return plan
+
+    def get_plan(self, data: Any) -> RenderPlan | None:
+        """It returns the plan of a raw value of the flow, if it was compiled"""
+
+        try:
+            obj, plan = self.plans_by_id[id(data)]
+        except KeyError:
+            return None
+
+        return plan if obj is data else None
+
+    def describe(self) -> Dict[str, Dict[str, Any]]:
+        """It returns, for each node, the fields that are rendered on each call"""
+
+        return {
+            node_id: {
+                "dynamic": {p: plan.describe() for p, plan in fields.items() if plan.dynamic},
+                "static": [p for p, plan in fields.items() if not plan.dynamic],
+            }
+            for node_id, fields in self.fields_by_node.items()
+        }
@@ -5,21 +5,34 @@ from typing import Dict
 
 from mautrix.util.logging import TraceLogger
 
+from .flow_compiler import CompiledFlow
 from .middlewares.http import HTTPMiddleware
 from .models import FlowUtils as FlowUtilsModel
 from .models.middlewares.email import EmailServer
 from .models.middlewares.http import HTTPMiddleware as HTTPMiddlewareModel
+from .types import MiddlewareType
+from .utils import JQCache, Util
 
 log: TraceLogger = logging.getLogger("ivrflow.flow_utils")
 
 
 class FlowUtils:
-    # Cache dicts
-    middlewares_by_id: Dict[str, HTTPMiddlewareModel] = {}
-    email_servers_by_id: Dict[str, EmailServer] = {}
-
     def __init__(self) -> None:
+        # Cache dicts, kept by each instance so a reloaded flow_utils.yaml starts empty
+        self.middlewares_by_id: Dict[str, HTTPMiddlewareModel] = {}
+        self.email_servers_by_id: Dict[str, EmailServer] = {}
         self.data: FlowUtilsModel = FlowUtilsModel.load_flow_utils()
+        self.compiled: CompiledFlow = CompiledFlow.compile_objects(
+            self.data.middlewares if self.data else []
+        )
+        self.precompile_jq_filters()
+
+    def precompile_jq_filters(self) -> None:
+        """It compiles the jq filters of the llm middlewares ahead of time"""
+
+        for middleware in self.data.middlewares if self.data else []:
+            if middleware is not None and middleware.type == MiddlewareType.llm.value:
+                JQCache.precompile(Util.get_jq_filters(middleware.variables))
 
     def _add_middleware_to_cache(self, middleware_model: HTTPMiddlewareModel) -> None:
         self.middlewares_by_id[middleware_model.id] = middleware_model
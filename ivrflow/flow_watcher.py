@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, List
+
+from mautrix.util.logging import TraceLogger
+
+from . import metrics
+from .config import config
+from .flow_cache import FlowCache
+from .flow_utils import FlowUtils
+from .models import FlowUtils as FlowUtilsModel
+
+log: TraceLogger = logging.getLogger("ivrflow.flow_watcher")
+
+
+class FlowWatcher:
+    """Reloads the flows and flow_utils.yaml when their files change, without a restart.
+
+    The modification time of the cached flows and of flow_utils.yaml is polled every
+    `ivrflow.hot_reload.interval` seconds. A changed flow is compiled into a new cache entry
+    that the new calls take, the calls already running keep the entry they loaded. A file
+    that fails to load is logged and its previous version keeps being served until it
+    changes again.
+    """
+
+    enabled: bool = False
+    interval: float = 2
+    flow_utils_mtime: int | None = None
+    # Modification times of the files whose last reload failed
+    failed_mtimes: Dict[str, int | None] = {}
+    # Called with the new FlowUtils after flow_utils.yaml is reloaded
+    listeners: List[Callable[[FlowUtils], Any]] = []
+    stats: Dict[str, Any] = {
+        "reloads": 0,
+        "errors": 0,
+        "last_duration": 0.0,
+        "total_duration": 0.0,
+        "last_error": None,
+    }
+
+    @classmethod
+    def init_cls(cls, config: Dict) -> None:
+        cls.enabled = config["ivrflow.hot_reload.enabled"]
+        cls.interval = config["ivrflow.hot_reload.interval"]
+        cls.flow_utils_mtime = cls._get_mtime(FlowUtilsModel.yaml_path())
+
+    @classmethod
+    def add_listener(cls, listener: Callable[[FlowUtils], Any]) -> None:
+        cls.listeners.append(listener)
+
+    @staticmethod
+    def _get_mtime(path: str) -> int | None:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    @classmethod
+    async def run(cls) -> None:
+        log.info(f"Watching the flow files every {cls.interval} seconds")
+        while True:
+            await asyncio.sleep(cls.interval)
+            try:
+                await cls.check()
+            except Exception:
+                log.exception("Error checking the flow files")
+
+    @classmethod
+    async def check(cls) -> None:
+        """It reloads the flows and flow_utils.yaml whose files changed since the last check"""
+
+        mtime = cls._get_mtime(FlowUtilsModel.yaml_path())
+        if mtime != cls.flow_utils_mtime:
+            cls.flow_utils_mtime = mtime
+            await cls._reload("flow_utils", "flow_utils.yaml", cls.reload_flow_utils)
+
+        if config["ivrflow.load_flow_from"] != "yaml":
+            return
+
+        for entry in list(FlowCache.entries_by_name.values()):
+            mtime = FlowCache._get_mtime(entry.name)
+            if mtime == entry.mtime or cls.failed_mtimes.get(entry.name, -1) == mtime:
+                continue
+
+            if await cls._reload("flow", entry.name, lambda: FlowCache.reload(entry.name)):
+                cls.failed_mtimes.pop(entry.name, None)
+            else:
+                cls.failed_mtimes[entry.name] = mtime
+
+    @classmethod
+    async def reload_flow_utils(cls) -> None:
+        flow_utils = FlowUtils()
+        for listener in cls.listeners:
+            listener(flow_utils)
+
+        # The nodes are built again with the new middlewares, the calls already running keep
+        # their flow entry and the middlewares wired into it
+        FlowCache.renew()
+
+    @classmethod
+    async def _reload(cls, kind: str, name: str, reload: Callable[[], Awaitable]) -> bool:
+        started = perf_counter()
+        try:
+            await reload()
+        except Exception as e:
+            cls.stats["errors"] += 1
+            cls.stats["last_error"] = f"{name}: {e}"
+            metrics.hot_reloads.labels(kind, "error").inc()
+            log.exception(f"Error reloading [{name}], its previous version is kept")
+            return False
+
+        duration = perf_counter() - started
+        cls.stats["reloads"] += 1
+        cls.stats["last_duration"] = duration
+        cls.stats["total_duration"] += duration
+        metrics.hot_reloads.labels(kind, "ok").inc()
+        metrics.hot_reload_duration.labels(kind).observe(duration)
+        log.info(f"[{name}] reloaded in {round(duration, 4)} seconds")
+        return True
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        return {**cls.stats, "enabled": cls.enabled, "failed": list(cls.failed_mtimes)}
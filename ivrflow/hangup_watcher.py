@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+from logging import getLogger
+from time import perf_counter
+from typing import Any, Dict
+
+from aioagi.ami.message import AMIMessage
+from aioagi.exceptions import AGIHangup
+from mautrix.util.logging import TraceLogger
+
+from . import metrics
+from .ami_events import AMIEvents
+from .types import ChannelUniqueID
+
+log: TraceLogger = getLogger("ivrflow.hangup_watcher")
+
+
+class EarlyHangup(AGIHangup):
+    """The caller hung up while a node was running, the node was cancelled"""
+
+
+class HangupWatcher:
+    """Cancels the node running for a call as soon as the caller hangs up.
+
+    The hangup is taken from the `HANGUP` line that Asterisk sends on the AGI connection, or
+    from the AMI Hangup event of the channel when AMI events are enabled. The node is
+    cancelled and `EarlyHangup` is raised, so the flow follows the `hook.on_hangup.node_id`
+    path like with any other hangup. Nodes that run after the hangup, in the on_hangup path,
+    are not watched.
+
+    The time saved by a cancelled node is the time it was expected to keep running after the
+    hangup, from the mean duration of its runs that were not cancelled.
+    """
+
+    enabled: bool = False
+    stats: Dict[str, Any] = {"hangups": 0, "cancelled_nodes": 0, "saved_seconds": 0.0}
+    # Moving average of the duration of the runs of each node that finished, by flow and node id
+    durations: Dict[str, float] = {}
+
+    __slots__ = ("uniqueid", "protocol", "flow_name", "hangup_source", "hangup_at", "node_task")
+
+    def __init__(self, uniqueid: ChannelUniqueID, protocol: Any, flow_name: str) -> None:
+        self.uniqueid = uniqueid
+        self.protocol = protocol
+        self.flow_name = flow_name
+        self.hangup_source: str | None = None
+        self.hangup_at: float | None = None
+        self.node_task: asyncio.Future | None = None
+
+    @classmethod
+    def init_cls(cls, config: Dict) -> None:
+        cls.enabled = config["ivrflow.hangup_detection.enabled"]
+
+    @classmethod
+    def watch(
+        cls, uniqueid: ChannelUniqueID, protocol: Any, flow_name: str
+    ) -> HangupWatcher | None:
+        """It starts watching the hangup of a call, if hangup detection is enabled"""
+        if not cls.enabled:
+            return None
+
+        watcher = cls(uniqueid, protocol, flow_name)
+        # The AGI server of tests and benchmarks may not notify the hangups
+        callbacks = getattr(protocol, "hangup_callbacks", None)
+        if callbacks is not None:
+            callbacks.append(watcher.on_agi_hangup)
+        AMIEvents.subscribe(uniqueid, watcher.on_ami_event)
+        return watcher
+
+    def stop(self) -> None:
+        AMIEvents.unsubscribe(self.uniqueid, self.on_ami_event)
+        callbacks = getattr(self.protocol, "hangup_callbacks", None)
+        if callbacks and self.on_agi_hangup in callbacks:
+            callbacks.remove(self.on_agi_hangup)
+
+    def on_agi_hangup(self) -> None:
+        self.hangup("agi")
+
+    def on_ami_event(self, event: AMIMessage) -> None:
+        if event.get("Event") == "Hangup":
+            self.hangup("ami")
+
+    def hangup(self, source: str) -> None:
+        if self.hangup_source:
+            return
+
+        self.hangup_source = source
+        self.stats["hangups"] += 1
+        if self.node_task and not self.node_task.done():
+            log.info(f"[{self.uniqueid}] Hangup detected by {source}, cancelling the running node")
+            self.hangup_at = perf_counter()
+            self.node_task.cancel()
+
+    async def run(self, node) -> None:
+        """It runs a node, it raises `EarlyHangup` if the caller hangs up before it finishes"""
+        if self.hangup_source:
+            raise EarlyHangup()
+
+        key = f"{self.flow_name}/{node.id}"
+        started = perf_counter()
+        self.node_task = task = asyncio.ensure_future(node.run())
+        try:
+            await task
+        except asyncio.CancelledError:
+            # The call itself is being cancelled, not only the node
+            if self.hangup_at is None or asyncio.current_task().cancelling():
+                raise
+        except Exception:
+            # A node waiting for an AGI command gets the cancellation as AGIConnectHangup
+            if self.hangup_at is None:
+                raise
+        finally:
+            self.node_task = None
+
+        if self.hangup_at is None:
+            duration = perf_counter() - started
+            mean = self.durations.get(key)
+            self.durations[key] = duration if mean is None else mean + (duration - mean) / 10
+            return
+
+        expected = self.durations.get(key, 0.0)
+        saved = max(started + expected - self.hangup_at, 0.0)
+        self.stats["cancelled_nodes"] += 1
+        self.stats["saved_seconds"] += saved
+        metrics.hangup_cancelled_nodes.labels(node.type).inc()
+        metrics.hangup_saved_seconds.labels(node.type).inc(saved)
+        log.warning(
+            f"[{self.uniqueid}] Node {node.id} cancelled after "
+            f"{round(self.hangup_at - started, 3)} s by a hangup detected by {self.hangup_source}"
+        )
+        raise EarlyHangup()
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        return {**cls.stats, "enabled": cls.enabled}
@@ -9,6 +9,7 @@ from aiohttp import ClientSession, TraceRequestEndParams, TraceRequestStartParam
 from mautrix.util.logging import TraceLogger
 
 from .channel import Channel
+from .middlewares.token_cache import TokenCache
 
 if TYPE_CHECKING:
     from .middlewares import HTTPMiddleware
@@ -54,15 +55,18 @@ async def start_auth_middleware(
         channel: Channel = await Channel.get_by_channel_uniqueid(
             channel_uniqueid=context_params.get("channel_uniqueid")
         )
-        channel_variables: Dict = middleware.auth.get("variables", {})
-        token_key: str = list(channel_variables.keys())[0]
-
-        if not await channel.get_variable(token_key):
-            await middleware.auth_request()
-
-        params.headers.update(
-            {"Authorization": f"{middleware.token_type} {await channel.get_variable(token_key)}"}
-        )
+        token_key: str = middleware.token_key
+
+        if middleware.per_channel:
+            if not await channel.get_variable(token_key):
+                await middleware.auth_request()
+            token = await channel.get_variable(token_key)
+        else:
+            token = await TokenCache.get_token(middleware, channel, token_key)
+
+        # Kept to know which token was rejected if the response is a 401
+        trace_config_ctx.token = token
+        params.headers.update({"Authorization": f"{middleware.token_type} {token}"})
     elif middleware.type == "basic":
         log.info(f"middleware: {middleware.id} type: {middleware.type} executing ...")
         auth_str = f"{middleware.basic_auth['login']}:{middleware.basic_auth['password']}".encode(
@@ -109,4 +113,16 @@ async def end_auth_middleware(
 
         if middleware.type == "jwt":
             log.info("Token expired, refreshing token ...")
-            await middleware.auth_request()
+            if middleware.per_channel:
+                await middleware.auth_request()
+                return
+
+            channel: Channel = await Channel.get_by_channel_uniqueid(
+                channel_uniqueid=context_params.get("channel_uniqueid")
+            )
+            await TokenCache.refresh(
+                middleware,
+                channel,
+                middleware.token_key,
+                stale_token=getattr(trace_config_ctx, "token", None),
+            )
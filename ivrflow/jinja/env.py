@@ -1,21 +1,25 @@
 from jinja2 import BaseLoader, Environment
+from jinja2.nativetypes import NativeEnvironment
 from jinja2_ansible_filters import AnsibleCoreFiltersExtension
 
 from .filters import register_filters
 from .globals import register_globals
 from .tests import register_tests
 
-jinja_env = Environment(
-    autoescape=True,
-    loader=BaseLoader,
-    extensions=[
-        AnsibleCoreFiltersExtension,
-        "jinja2.ext.debug",
-        "jinja2.ext.do",
-        "jinja2.ext.loopcontrols",
-    ],
-)
+EXTENSIONS = [
+    AnsibleCoreFiltersExtension,
+    "jinja2.ext.debug",
+    "jinja2.ext.do",
+    "jinja2.ext.loopcontrols",
+]
 
-register_globals(jinja_env)
-register_filters(jinja_env)
-register_tests(jinja_env)
+jinja_env = Environment(autoescape=True, loader=BaseLoader, extensions=EXTENSIONS)
+
+# Used by the `native` render mode, templates return python values instead of strings.
+# Autoescape is disabled because the values are not html, and nothing has to unescape them.
+native_jinja_env = NativeEnvironment(autoescape=False, loader=BaseLoader, extensions=EXTENSIONS)
+
+for env in (jinja_env, native_jinja_env):
+    register_globals(env)
+    register_filters(env)
+    register_tests(env)
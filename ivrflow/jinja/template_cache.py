@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+from logging import Logger, getLogger
+from typing import Dict
+
+from jinja2 import Template
+from jinja2.utils import LRUCache
+
+from .env import jinja_env, native_jinja_env
+
+log: Logger = getLogger("ivrflow.jinja.template_cache")
+
+# Any of these markers makes jinja treat a string as a template. Carriage returns are
+# included because jinja normalizes line endings, so those strings are left to it.
+TEMPLATE_DELIMITERS = ("{{", "{%", "{#", "\r")
+
+
+class TemplateCache:
+    """LRU cache of compiled jinja templates keyed by their source string."""
+
+    enabled: bool = True
+    max_size: int = 4096
+    stats: Dict[str, int] = {"hits": 0, "misses": 0, "bypassed": 0, "literals": 0}
+
+    _templates: LRUCache = LRUCache(max_size)
+    _native_templates: LRUCache = LRUCache(max_size)
+
+    @classmethod
+    def init_cls(cls, config: Dict) -> None:
+        cls.enabled = config["ivrflow.template_cache.enabled"]
+        cls.max_size = config["ivrflow.template_cache.max_size"]
+        cls._templates = LRUCache(cls.max_size)
+        cls._native_templates = LRUCache(cls.max_size)
+        log.debug(f"Template cache enabled: {cls.enabled} max_size: {cls.max_size}")
+
+    @staticmethod
+    def is_template(source: str) -> bool:
+        """It checks if a string contains jinja delimiters
+
+        Parameters
+        ----------
+        source : str
+            The string to check.
+
+        Returns
+        -------
+            True if the string has to be rendered by jinja, False if it is a literal.
+
+        """
+
+        return any(delimiter in source for delimiter in TEMPLATE_DELIMITERS)
+
+    @staticmethod
+    def render_literal(source: str) -> str:
+        """It returns what jinja would render for a string without delimiters
+
+        Parameters
+        ----------
+        source : str
+            A string for which `is_template` is False.
+
+        Returns
+        -------
+            The string without its trailing newline, as jinja removes it by default.
+
+        """
+
+        return source[:-1] if source.endswith("\n") else source
+
+    @classmethod
+    def get_template(cls, source: str, native: bool = False) -> Template:
+        """It returns the compiled template of a source string, compiling it only once
+
+        Parameters
+        ----------
+        source : str
+            The template source.
+        native : bool
+            If True, the template is compiled with the native types environment.
+
+        Returns
+        -------
+            The compiled jinja template.
+
+        """
+
+        env = native_jinja_env if native else jinja_env
+        if not cls.enabled:
+            cls.stats["bypassed"] += 1
+            return env.from_string(source)
+
+        templates = cls._native_templates if native else cls._templates
+        template: Template | None = templates.get(source)
+        if template is not None:
+            cls.stats["hits"] += 1
+            return template
+
+        cls.stats["misses"] += 1
+        template = env.from_string(source)
+        templates[source] = template
+        return template
+
+    @classmethod
+    def clear(cls) -> None:
+        cls._templates.clear()
+        cls._native_templates.clear()
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, int | bool]:
+        return {
+            **cls.stats,
+            "enabled": cls.enabled,
+            "size": len(cls._templates) + len(cls._native_templates),
+            "max_size": cls.max_size,
+        }
@@ -0,0 +1,353 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from logging import getLogger
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from mautrix.util.logging import TraceLogger
+
+log: TraceLogger = getLogger("ivrflow.metrics")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], *extra: str) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(label for label in extra if label)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    """Base of the metrics of the text exposition format.
+
+    The children of a metric are bound to their label values once, with `labels`, and kept;
+    code in the hot path keeps the child and only updates its value.
+    """
+
+    kind: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames: Tuple[str, ...] = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    @abstractmethod
+    def _new_child(self) -> object:
+        """It builds the value of a new label set"""
+
+    def labels(self, *values: str):
+        try:
+            return self._children[values]
+        except KeyError:
+            pass
+
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+
+        key = tuple(str(value) for value in values)
+        try:
+            return self._children[key]
+        except KeyError:
+            child = self._children[key] = self._new_child()
+            return child
+
+    def samples(self, extra: str = "") -> Iterable[Tuple[str, str, float]]:
+        for values, child in list(self._children.items()):
+            yield self.name, _format_labels(self.labelnames, values, extra), child.value
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def sample_lines(self, extra: str = "") -> List[str]:
+        """The lines of the samples, `extra` is a label added to every sample"""
+        return [
+            f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples(extra)
+        ]
+
+    def expose(self) -> List[str]:
+        return self.header() + self.sample_lines()
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+
+class GaugeFunction(Metric):
+    """Gauge whose samples are read from a function when the metrics are exposed.
+
+    The function returns the value of each label set, as a dict keyed by the tuple of label
+    values, or a single number when the gauge has no labels.
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        function: Callable[[], Dict[Tuple[str, ...], float] | float] | None = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set_function(self, function: Callable[[], Dict[Tuple[str, ...], float] | float]):
+        self.function = function
+
+    def _new_child(self) -> object:
+        raise TypeError(f"{self.name} reads its samples from a function, it has no children")
+
+    def samples(self, extra: str = "") -> Iterable[Tuple[str, str, float]]:
+        if self.function is None:
+            return
+
+        try:
+            result = self.function()
+        except Exception as e:
+            log.debug(f"Metric {self.name} could not be read: {e}")
+            return
+
+        if not isinstance(result, dict):
+            yield self.name, _format_labels((), (), extra), result
+            return
+
+        for values, value in result.items():
+            yield self.name, _format_labels(self.labelnames, values, extra), value
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "buckets", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(buckets)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.bounds)
+
+    def samples(self, extra: str = "") -> Iterable[Tuple[str, str, float]]:
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), child.buckets):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket", _format_labels(
+                    self.labelnames, values, extra, le
+                ), cumulative
+            labels = _format_labels(self.labelnames, values, extra)
+            yield f"{self.name}_sum", labels, child.sum
+            yield f"{self.name}_count", labels, child.count
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def sample_lines(self, extra: str = "") -> Dict[str, List[str]]:
+        """The sample lines of every metric, by metric name"""
+        return {name: metric.sample_lines(extra) for name, metric in self.metrics.items()}
+
+    def expose(self, sample_lines: Iterable[Dict[str, List[str]]] | None = None) -> str:
+        """It exposes the metrics in the text format
+
+        Parameters
+        ----------
+        sample_lines : Iterable[Dict[str, List[str]]] | None
+            The sample lines of several processes, from `sample_lines`, which are exposed
+            together under the header of each metric. The samples of this process are exposed
+            when it is not given.
+
+        Returns
+        -------
+            The metrics in the text exposition format.
+
+        """
+        sample_lines = [self.sample_lines()] if sample_lines is None else list(sample_lines)
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.extend(metric.header())
+            for process_lines in sample_lines:
+                lines.extend(process_lines.get(name, ()))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+active_calls: Gauge = registry.register(
+    Gauge("ivrflow_active_calls", "Calls whose flow is being executed")
+)
+calls_started: Counter = registry.register(
+    Counter("ivrflow_calls_started_total", "Calls received by the AGI server")
+)
+calls_finished: Counter = registry.register(
+    Counter("ivrflow_calls_finished_total", "Calls whose flow has finished", ("reason",))
+)
+node_duration: Histogram = registry.register(
+    Histogram("ivrflow_node_duration_seconds", "Execution time of the nodes", ("type",))
+)
+http_request_duration: Histogram = registry.register(
+    Histogram(
+        "ivrflow_http_request_duration_seconds",
+        "Time of the requests of http_request nodes, by middleware and status",
+        ("middleware", "status"),
+    )
+)
+middleware_request_duration: Histogram = registry.register(
+    Histogram(
+        "ivrflow_middleware_request_duration_seconds",
+        "Time of the requests made by the middlewares, by middleware and status",
+        ("middleware", "status"),
+    )
+)
+ami_events: Counter = registry.register(
+    Counter("ivrflow_ami_events_total", "AMI events received, by event", ("event",))
+)
+hangup_cancelled_nodes: Counter = registry.register(
+    Counter(
+        "ivrflow_hangup_cancelled_nodes_total",
+        "Nodes cancelled because the caller hung up while they were running",
+        ("type",),
+    )
+)
+hangup_saved_seconds: Counter = registry.register(
+    Counter(
+        "ivrflow_hangup_saved_seconds_total",
+        "Time the nodes cancelled by a hangup were expected to keep running after it",
+        ("type",),
+    )
+)
+hot_reloads: Counter = registry.register(
+    Counter(
+        "ivrflow_hot_reloads_total",
+        "Reloads of the flows and flow_utils.yaml after their files changed, by result",
+        ("kind", "result"),
+    )
+)
+hot_reload_duration: Histogram = registry.register(
+    Histogram(
+        "ivrflow_hot_reload_duration_seconds",
+        "Time to load and compile a changed flow or flow_utils.yaml",
+        ("kind",),
+    )
+)
+db_pool_connections: GaugeFunction = registry.register(
+    GaugeFunction("ivrflow_db_pool_connections", "Connections of the database pool", ("state",))
+)
+ami_connected: GaugeFunction = registry.register(
+    GaugeFunction("ivrflow_ami_connected", "1 if the AMI connection is authenticated")
+)
+cache_hit_ratio: GaugeFunction = registry.register(
+    GaugeFunction("ivrflow_cache_hit_ratio", "Hits over lookups of each cache", ("cache",))
+)
+cache_size: GaugeFunction = registry.register(
+    GaugeFunction("ivrflow_cache_size", "Entries kept in each cache", ("cache",))
+)
+
+# Children used on every call, bound once
+ACTIVE_CALLS = active_calls.labels()
+CALLS_STARTED = calls_started.labels()
+CALLS_FINISHED = {
+    reason: calls_finished.labels(reason)
+    for reason in (
+        "completed",
+        "invalid_node",
+        "hangup_node_not_allowed",
+        "hangup_detected",
+        "on_hangup_node_not_found",
+        "unexpected_error",
+    )
+}
+
+
+def observe_middleware_request(middleware_id: str, status: int | str, start: float) -> None:
+    """It records the time of a request made by a middleware, started at `start`"""
+    middleware_request_duration.labels(middleware_id, str(status)).observe(perf_counter() - start)
+
+
+async def on_request_start(session: Any, trace_config_ctx: SimpleNamespace, params: Any) -> None:
+    # Only the requests of http_request nodes carry a request context
+    if trace_config_ctx.trace_request_ctx is not None:
+        trace_config_ctx.metrics_start = perf_counter()
+
+
+async def on_request_end(session: Any, trace_config_ctx: SimpleNamespace, params: Any) -> None:
+    start = getattr(trace_config_ctx, "metrics_start", None)
+    if start is None:
+        return
+
+    middleware = trace_config_ctx.trace_request_ctx.get("middleware")
+    status = str(params.response.status) if hasattr(params, "response") else "error"
+    http_request_duration.labels(middleware.id if middleware else "none", status).observe(
+        perf_counter() - start
+    )
+
+
+async def on_request_exception(
+    session: Any, trace_config_ctx: SimpleNamespace, params: Any
+) -> None:
+    await on_request_end(session, trace_config_ctx, params)
@@ -1,4 +1,5 @@
 from .asr import ASRMiddleware
 from .http import HTTPMiddleware
 from .llm import LLMMiddleware
+from .token_cache import TokenCache
 from .tts import TTSMiddleware
@@ -1,11 +1,12 @@
 from asyncio import gather
-from time import time
+from time import perf_counter, time
 from typing import Dict, Tuple
 
 from aiohttp import ClientTimeout, ContentTypeError, FormData
 from sqids import Sqids
 
 from ..channel import Channel
+from ..metrics import observe_middleware_request
 from ..models import ASRMiddleware as ASRMiddlewareModel
 from ..nodes import Base
 
@@ -13,6 +14,8 @@ sqids = Sqids()
 
 
 class ASRMiddleware(Base):
+    __slots__ = ()
+
     def __init__(
         self,
         asr_middleware_content: ASRMiddlewareModel,
@@ -116,6 +119,7 @@ class ASRMiddleware(Base):
         if self.json:
             request_body["json"] = self.json
 
+        start = perf_counter()
         try:
             timeout = ClientTimeout(total=self.config["ivrflow.timeouts.middlewares"])
             response = await self.session.request(
@@ -125,9 +129,12 @@ class ASRMiddleware(Base):
                 **request_body,
             )
         except Exception as e:
+            observe_middleware_request(self.id, "error", start)
             self.log.exception(f"[{self.channel.channel_uniqueid}] Error in middleware: {e}")
             return
 
+        observe_middleware_request(self.id, response.status, start)
+
         variables = {}
 
         if self.cookies:
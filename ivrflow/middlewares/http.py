@@ -1,15 +1,21 @@
-from typing import Dict, Tuple
+from __future__ import annotations
+
+from time import perf_counter
+from typing import Any, Dict, Tuple
 
 from aiohttp import ClientTimeout, ContentTypeError
 from mautrix.util.config import RecursiveDict
 from ruamel.yaml.comments import CommentedMap
 
 from ..channel import Channel
+from ..metrics import observe_middleware_request
 from ..models import HTTPMiddleware as HTTPMiddlewareModel
 from ..nodes import Base
 
 
 class HTTPMiddleware(Base):
+    __slots__ = ()
+
     def __init__(
         self,
         http_middleware_content: HTTPMiddlewareModel,
@@ -45,6 +51,14 @@ class HTTPMiddleware(Base):
     def attempts(self) -> int:
         return int(self.auth.get("attempts", 2))
 
+    @property
+    def per_channel(self) -> bool:
+        return bool(self.auth.get("per_channel", False))
+
+    @property
+    def token_key(self) -> str:
+        return list(self.auth.get("variables", {}).keys())[0]
+
     @property
     def middleware_variables(self) -> Dict:
         return self.render_data(self.auth.get("variables", {}))
@@ -91,6 +105,26 @@ class HTTPMiddleware(Base):
 
         """
 
+        result = await self.request_auth_variables()
+        if result is None:
+            return
+
+        status, text, variables, _ = result
+        if variables:
+            await self.channel.set_variables(variables=variables)
+
+        return status, text
+
+    async def request_auth_variables(self) -> Tuple[int, str, Dict, Any] | None:
+        """Make the auth request and get the variables defined in the middleware
+
+        Returns
+        -------
+            The status code, the response text, the variables and the response data,
+            or None if the request failed.
+
+        """
+
         request_body = {}
 
         if self.query_params:
@@ -105,15 +139,19 @@ class HTTPMiddleware(Base):
         if self.json:
             request_body["json"] = self.json
 
+        start = perf_counter()
         try:
             timeout = ClientTimeout(total=self.config["ivrflow.timeouts.middlewares"])
             response = await self.session.request(
                 self.method, self.token_url, timeout=timeout, **request_body
             )
         except Exception as e:
+            observe_middleware_request(self.id, "error", start)
             self.log.exception(f"[{self.channel.channel_uniqueid}] Error in middleware: {e}")
             return
 
+        observe_middleware_request(self.id, response.status, start)
+
         variables = {}
 
         if self.cookies:
@@ -151,7 +189,4 @@ class HTTPMiddleware(Base):
 
                     break
 
-        if variables:
-            await self.channel.set_variables(variables=variables)
-
-        return response.status, await response.text()
+        return response.status, await response.text(), variables, response_data
@@ -1,14 +1,18 @@
+from time import perf_counter
 from typing import Dict, Tuple
 
 from aiohttp import ClientTimeout, ContentTypeError
 
 from ..channel import Channel
+from ..metrics import observe_middleware_request
 from ..models import LLMMiddleware as LLMMiddlewareModel
 from ..nodes import Base
 from ..utils import Util
 
 
 class LLMMiddleware(Base):
+    __slots__ = ()
+
     def __init__(
         self,
         llm_middleware_content: LLMMiddlewareModel,
@@ -66,15 +70,19 @@ class LLMMiddleware(Base):
         if _json := self.json:
             request_body["json"] = _json | extended_json
 
+        start = perf_counter()
         try:
             timeout = ClientTimeout(total=self.config["ivrflow.timeouts.middlewares"])
             response = await self.session.request(
                 self.method, self.url, timeout=timeout, **request_body
             )
         except Exception as e:
+            observe_middleware_request(self.id, "error", start)
             self.log.exception(f"[{self.channel.channel_uniqueid}] Error in middleware: {e}")
             return
 
+        observe_middleware_request(self.id, response.status, start)
+
         variables = {}
 
         if _cookies := self.cookies:
@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+from logging import getLogger
+from time import time
+from typing import TYPE_CHECKING, Any, Dict
+
+from attr import dataclass, ib
+from mautrix.util.logging import TraceLogger
+
+from ..channel import Channel
+
+if TYPE_CHECKING:
+    from .http import HTTPMiddleware
+
+log: TraceLogger = getLogger("ivrflow.middleware.token_cache")
+
+
+@dataclass
+class CachedToken:
+    token: Any
+    # Every variable obtained by the auth request, they are loaded into each channel
+    variables: Dict[str, Any]
+    expires_at: float = ib(default=0)
+
+    @property
+    def is_valid(self) -> bool:
+        return bool(self.token) and self.expires_at > time()
+
+
+class TokenCache:
+    """Process-wide cache of the tokens obtained by `jwt` middlewares.
+
+    Tokens are keyed by the middleware id and its rendered auth request, so every call that
+    sends the same auth request shares one token. Only one auth request per key is made at a
+    time, the other calls wait for its result.
+
+    The cache keeps up to `max_size` tokens, the expired ones are dropped when a token is
+    stored and then the least recently used ones, along with the lock of their key.
+    """
+
+    default_ttl: float = 300
+    refresh_margin: float = 30
+    max_size: int = 1000
+    # Ordered from the least to the most recently used token
+    tokens_by_key: OrderedDict[str, CachedToken] = OrderedDict()
+    stats: Dict[str, int] = {"hits": 0, "misses": 0, "refreshes": 0, "errors": 0}
+
+    _locks: Dict[str, asyncio.Lock] = {}
+
+    @classmethod
+    def init_cls(cls, config: Dict) -> None:
+        cls.default_ttl = config["ivrflow.token_cache.default_ttl"]
+        cls.refresh_margin = config["ivrflow.token_cache.refresh_margin"]
+        cls.max_size = config["ivrflow.token_cache.max_size"]
+
+    @classmethod
+    def _get_lock(cls, key: str) -> asyncio.Lock:
+        try:
+            return cls._locks[key]
+        except KeyError:
+            lock = cls._locks[key] = asyncio.Lock()
+            return lock
+
+    @classmethod
+    def _drop(cls, key: str) -> None:
+        cls.tokens_by_key.pop(key, None)
+        # A lock that is held is removed by the call that holds it
+        lock = cls._locks.get(key)
+        if lock is not None and not lock.locked():
+            del cls._locks[key]
+
+    @classmethod
+    def _store(cls, key: str, cached: CachedToken) -> None:
+        cls.tokens_by_key[key] = cached
+        cls.tokens_by_key.move_to_end(key)
+
+        now = time()
+        for expired in [k for k, token in cls.tokens_by_key.items() if token.expires_at <= now]:
+            cls._drop(expired)
+
+        while len(cls.tokens_by_key) > cls.max_size:
+            cls._drop(next(iter(cls.tokens_by_key)))
+
+    @staticmethod
+    def get_key(middleware: HTTPMiddleware) -> str:
+        """It builds the cache key of a middleware from its rendered auth request"""
+        request = [
+            middleware.method,
+            middleware.token_url,
+            middleware.headers,
+            middleware.query_params,
+            middleware.data,
+            middleware.json,
+        ]
+        digest = hashlib.sha256(
+            json.dumps(request, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        return f"{middleware.id}:{digest}"
+
+    @staticmethod
+    def _get_jwt_exp(token: Any) -> float | None:
+        if not isinstance(token, str) or token.count(".") != 2:
+            return None
+
+        payload = token.split(".")[1]
+        try:
+            claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+            return float(claims["exp"])
+        except Exception:
+            return None
+
+    @classmethod
+    def _get_expires_at(cls, token: Any, response_data: Any) -> float:
+        now = time()
+        expires_at = None
+
+        if isinstance(response_data, dict) and response_data.get("expires_in"):
+            try:
+                expires_at = now + float(response_data["expires_in"])
+            except (TypeError, ValueError):
+                pass
+
+        if expires_at is None:
+            expires_at = cls._get_jwt_exp(token)
+
+        if expires_at is None:
+            expires_at = now + cls.default_ttl
+
+        return expires_at - cls.refresh_margin
+
+    @classmethod
+    async def _request_token(
+        cls, middleware: HTTPMiddleware, key: str, token_key: str
+    ) -> CachedToken | None:
+        result = await middleware.request_auth_variables()
+        if result is None:
+            cls.stats["errors"] += 1
+            return None
+
+        _, _, variables, response_data = result
+        token = variables.get(token_key)
+        if not token:
+            cls.stats["errors"] += 1
+            log.warning(f"middleware: {middleware.id} auth request did not return a token")
+            cls.tokens_by_key.pop(key, None)
+            return None
+
+        cached = CachedToken(
+            token=token,
+            variables=variables,
+            expires_at=cls._get_expires_at(token, response_data),
+        )
+        cls._store(key, cached)
+        log.debug(
+            f"middleware: {middleware.id} token cached for "
+            f"{round(cached.expires_at - time())} seconds"
+        )
+        return cached
+
+    @staticmethod
+    async def _load_variables(channel: Channel, cached: CachedToken) -> None:
+        # The variables are only written when they are not already in the channel
+        variables = {
+            variable: value
+            for variable, value in cached.variables.items()
+            if await channel.get_variable(variable) != value
+        }
+        if variables:
+            await channel.set_variables(variables=variables)
+
+    @classmethod
+    async def get_token(cls, middleware: HTTPMiddleware, channel: Channel, token_key: str) -> Any:
+        """It returns the shared token of a middleware, requesting it only when it is missing
+        or about to expire
+
+        Parameters
+        ----------
+        middleware : HTTPMiddleware
+            The jwt middleware.
+        channel : Channel
+            The channel of the call that makes the request, the variables of the auth
+            request are loaded into it.
+        token_key : str
+            The variable that holds the token.
+
+        Returns
+        -------
+            The token, or None if it could not be obtained.
+
+        """
+
+        key = cls.get_key(middleware)
+        cached = cls.tokens_by_key.get(key)
+        if cached is None or not cached.is_valid:
+            async with cls._get_lock(key):
+                # Another call may have obtained the token while this one was waiting
+                cached = cls.tokens_by_key.get(key)
+                if cached is None or not cached.is_valid:
+                    cls.stats["misses"] += 1
+                    cached = await cls._request_token(middleware, key, token_key)
+                else:
+                    cls.stats["hits"] += 1
+        else:
+            cls.stats["hits"] += 1
+            cls.tokens_by_key.move_to_end(key)
+
+        if key not in cls.tokens_by_key:
+            # The auth request failed, or its token was dropped as soon as it was stored
+            cls._drop(key)
+
+        if cached is None:
+            return None
+
+        await cls._load_variables(channel, cached)
+        return cached.token
+
+    @classmethod
+    async def refresh(
+        cls, middleware: HTTPMiddleware, channel: Channel, token_key: str, stale_token: Any
+    ) -> Any:
+        """It replaces a token that was rejected, unless another call already replaced it
+
+        Parameters
+        ----------
+        middleware : HTTPMiddleware
+            The jwt middleware.
+        channel : Channel
+            The channel of the call whose request was rejected.
+        token_key : str
+            The variable that holds the token.
+        stale_token : Any
+            The token that was rejected.
+
+        Returns
+        -------
+            The new token, or None if it could not be obtained.
+
+        """
+
+        key = cls.get_key(middleware)
+        async with cls._get_lock(key):
+            cached = cls.tokens_by_key.get(key)
+            if cached is None or cached.token == stale_token or not cached.is_valid:
+                cls.stats["refreshes"] += 1
+                cls.tokens_by_key.pop(key, None)
+                cached = await cls._request_token(middleware, key, token_key)
+
+        if key not in cls.tokens_by_key:
+            # The auth request failed, or its token was dropped as soon as it was stored
+            cls._drop(key)
+
+        if cached is None:
+            return None
+
+        await cls._load_variables(channel, cached)
+        return cached.token
+
+    @classmethod
+    def invalidate(cls, middleware_id: str | None = None) -> None:
+        """It removes the tokens of a middleware, or every token if no id is given"""
+        if middleware_id is None:
+            for key in list(cls.tokens_by_key):
+                cls._drop(key)
+            return
+
+        for key in [k for k in cls.tokens_by_key if k.split(":", 1)[0] == middleware_id]:
+            cls._drop(key)
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        now = time()
+        return {
+            **cls.stats,
+            "max_size": cls.max_size,
+            "locks": len(cls._locks),
+            "tokens": {
+                key: {"expires_in": round(cached.expires_at - now)}
+                for key, cached in cls.tokens_by_key.items()
+            },
+        }
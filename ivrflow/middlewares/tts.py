@@ -1,3 +1,4 @@
+from time import perf_counter
 from typing import Dict, Tuple
 
 from aiohttp import ClientTimeout, ContentTypeError, FormData
@@ -5,11 +6,14 @@ from mautrix.util.config import RecursiveDict
 from ruamel.yaml.comments import CommentedMap
 
 from ..channel import Channel
+from ..metrics import observe_middleware_request
 from ..models import TTSMiddleware as TTSMiddlewareModel
 from ..nodes import Base
 
 
 class TTSMiddleware(Base):
+    __slots__ = ()
+
     def __init__(
         self,
         tts_middleware_content: TTSMiddlewareModel,
@@ -63,15 +67,19 @@ class TTSMiddleware(Base):
 
         request_body["data"] = data
 
+        start = perf_counter()
         try:
             timeout = ClientTimeout(total=self.config["ivrflow.timeouts.middlewares"])
             response = await self.session.request(
                 self.method, self.url, timeout=timeout, **request_body
             )
         except Exception as e:
+            observe_middleware_request(self.id, "error", start)
             self.log.exception(f"[{self.channel.channel_uniqueid}] Error in middleware: {e}")
             return
 
+        observe_middleware_request(self.id, response.status, start)
+
         variables = {}
 
         if self.cookies:
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from logging import Logger, getLogger
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Type, Union
 
 import yaml
 from attr import dataclass, ib
@@ -61,17 +61,47 @@ Node = Union[
 
 log: Logger = getLogger("ivrflow.models.flow")
 
+# Dataclass of each node type, new node types are added with `ivrflow.flow.register_node_type`
+NODE_MODELS: Dict[str, Type[Node]] = {
+    NodeType.playback.value: Playback,
+    NodeType.switch.value: Switch,
+    NodeType.http_request.value: HTTPRequest,
+    NodeType.get_data.value: GetData,
+    NodeType.set_variable.value: SetVariable,
+    NodeType.record.value: Record,
+    NodeType.hangup.value: Hangup,
+    NodeType.set_music.value: SetMusic,
+    NodeType.verbose.value: Verbose,
+    NodeType.set_callerid.value: SetCallerID,
+    NodeType.exec_app.value: ExecApp,
+    NodeType.database_get.value: DatabaseGet,
+    NodeType.get_full_variable.value: GetFullVariable,
+    NodeType.database_del.value: DatabaseDel,
+    NodeType.email.value: Email,
+    NodeType.database_put.value: DatabasePut,
+    NodeType.answer.value: Answer,
+    NodeType.goto_on_exit.value: GotoOnExit,
+    NodeType.subroutine.value: Subroutine,
+    NodeType.no_op.value: NoOp,
+    NodeType.set_vars.value: SetVars,
+}
+
 
 @dataclass
 class Flow(SerializableAttrs):
     flow_variables: Dict[str, Any] = ib(default={})
     nodes: List[Playback, Switch] = ib(factory=list)
+    flow_id: int = ib(default=None)
+
+    @staticmethod
+    def yaml_path(flow_name: str) -> str:
+        return f"/data/flows/{flow_name}.yaml"
 
     @classmethod
     def load_from_yaml(cls, flow_name: str) -> "Flow":
         log.info(f"Loading flow [{flow_name}] from yaml")
         try:
-            path = f"/data/flows/{flow_name}.yaml"
+            path = cls.yaml_path(flow_name)
             with open(path, "r") as file:
                 flow: Dict = yaml.safe_load(file)
             return cls.from_dict(flow.get("flow_variables", {}), flow.get("nodes", []))
@@ -85,7 +115,7 @@ class Flow(SerializableAttrs):
         modules = await DBModule.all(flow_id=flow.id)
         nodes = [node for module in modules for node in module.get("nodes", [])]
 
-        return cls.from_dict(flow.flow_vars, nodes)
+        return cls.from_dict(flow.flow_vars, nodes, flow_id=flow.id)
 
     @classmethod
     async def load_flow(cls, flow_name: str) -> "Flow":
@@ -97,42 +127,19 @@ class Flow(SerializableAttrs):
         return flow
 
     @classmethod
-    def from_dict(cls, flow_vars: dict, nodes: list[dict]) -> "Flow":
+    def from_dict(cls, flow_vars: dict, nodes: list[dict], flow_id: int = None) -> "Flow":
         return cls(
             flow_variables=flow_vars,
             nodes=[cls.initialize_node_dataclass(node) for node in nodes],
+            flow_id=flow_id,
         )
 
     @classmethod
     def initialize_node_dataclass(cls, node: Dict) -> Node:
         try:
-            node_type = NodeType(node.get("type"))
-        except ValueError:
+            node_class = NODE_MODELS[node.get("type")]
+        except (KeyError, TypeError):
             log.warning(f"Node type {node.get('type')} not found")
             return
 
-        node_class: dict[NodeType, Node] = {
-            NodeType.playback: Playback,
-            NodeType.switch: Switch,
-            NodeType.http_request: HTTPRequest,
-            NodeType.get_data: GetData,
-            NodeType.set_variable: SetVariable,
-            NodeType.record: Record,
-            NodeType.hangup: Hangup,
-            NodeType.set_music: SetMusic,
-            NodeType.verbose: Verbose,
-            NodeType.set_callerid: SetCallerID,
-            NodeType.exec_app: ExecApp,
-            NodeType.database_get: DatabaseGet,
-            NodeType.get_full_variable: GetFullVariable,
-            NodeType.database_del: DatabaseDel,
-            NodeType.email: Email,
-            NodeType.database_put: DatabasePut,
-            NodeType.answer: Answer,
-            NodeType.goto_on_exit: GotoOnExit,
-            NodeType.subroutine: Subroutine,
-            NodeType.no_op: NoOp,
-            NodeType.set_vars: SetVars,
-        }
-
-        return node_class[node_type].from_dict(node)
+        return node_class.from_dict(node)
@@ -19,10 +19,14 @@ class FlowUtils(SerializableAttrs):
     middlewares: List[HTTPMiddleware] = ib(default=[])
     email_servers: List[EmailServer] = ib(default=[])
 
+    @staticmethod
+    def yaml_path() -> str:
+        return "/data/flow_utils.yaml"
+
     @classmethod
     def load_flow_utils(cls) -> "FlowUtils":
         try:
-            path = f"/data/flow_utils.yaml"
+            path = cls.yaml_path()
             with open(path, "r") as file:
                 flow_utils: Dict = yaml.safe_load(file)
             return cls.from_dict(flow_utils)
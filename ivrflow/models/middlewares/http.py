@@ -21,6 +21,7 @@ class Auth(SerializableAttrs):
     variables: Dict[str, Any] = ib(default=None)
     token_path: str = ib(default=None)
     basic_auth: Dict[str, Any] = ib(default=None)
+    per_channel: bool = ib(default=False)
 
 
 @dataclass
@@ -37,6 +38,10 @@ class HTTPMiddleware(FlowObject):
     You can have more than one middleware on your flow, each one is specific by URL,
     it only applies for the requests that start by the URL define in the middleware.
 
+    The token of a `jwt` middleware is shared by every call that sends the same auth request
+    until it expires (`expires_in` in the response or the `exp` claim of the token).
+    Set `per_channel: true` in `auth` to request a token for each call instead.
+
     content:
 
     ```
@@ -6,6 +6,8 @@ from .base import Base
 
 
 class Answer(Base):
+    __slots__ = ()
+
     def __init__(
         self, default_variables: Dict, answer_content: AnswerModel, channel: Channel
     ) -> None:
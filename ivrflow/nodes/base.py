@@ -5,24 +5,33 @@ from contextlib import asynccontextmanager
 from contextvars import ContextVar
 from dataclasses import dataclass
 from logging import Logger, getLogger
-from typing import Any, Dict, List
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Dict, List
 
 from aiohttp import ClientSession
 
 from ..channel import Channel
 from ..config import Config
 from ..db.channel import ChannelState
+from ..profiler import Profiler
 from ..utils import Util
 
+if TYPE_CHECKING:
+    from ..flow_compiler import CompiledFlow
+
 
 @dataclass
 class AGIContext:
     asterisk_conn: Any
     http_session: Any
+    # The channel of the call, bound once it has been loaded
+    channel: Channel | None = None
 
 
 _agi_ctx_var: ContextVar[AGIContext | None] = ContextVar("ivrflow_agi_ctx", default=None)
 
+node_log: Logger = getLogger("ivrflow.node")
+
 
 def convert_to_int(item: Any) -> Dict | List | int:
     if isinstance(item, dict):
@@ -48,15 +57,36 @@ def safe_data_convertion(item: Any, _bool: bool = True, _int: bool = True) -> An
 
 
 class Base:
-    log: Logger = getLogger("ivrflow.node")
+    """Runtime of a node or a middleware.
+
+    Runtimes are built once per flow version and shared by every call running it, so they
+    keep no state of the call: the channel, the asterisk connection and the http session are
+    read from the AGI context of the call being served.
+    """
+
+    __slots__ = ("default_variables", "content", "log", "compiled_flow", "_channel")
 
     config: Config
-    content: object
-    channel: Channel
 
-    def __init__(self, default_variables: Dict, channel: Channel) -> None:
+    def __init__(self, default_variables: Dict, channel: Channel | None = None) -> None:
         self.default_variables = default_variables
-        self.channel = channel
+        self.log: Logger = node_log
+        # Render plans of the flow this node belongs to, set when the node is built
+        self.compiled_flow: CompiledFlow | None = None
+        # A channel given here pins the runtime to it instead of the channel of the context
+        self._channel = channel
+
+    @property
+    def channel(self) -> Channel | None:
+        if self._channel is not None:
+            return self._channel
+
+        ctx = _agi_ctx_var.get()
+        return ctx.channel if ctx else None
+
+    @channel.setter
+    def channel(self, channel: Channel | None) -> None:
+        self._channel = channel
 
     @property
     def asterisk_conn(self) -> ClientSession | None:
@@ -98,6 +128,21 @@ class Base:
 
         """
 
+        profile = Profiler.current()
+        if profile is None:
+            return self._render_data(data)
+
+        start = perf_counter()
+        try:
+            return self._render_data(data)
+        finally:
+            profile.add("render", perf_counter() - start)
+
+    def _render_data(self, data: dict | list | str) -> dict | list | str:
+        plan = self.compiled_flow.get_plan(data) if self.compiled_flow else None
+        if plan is not None:
+            return plan.render(self.default_variables | self.channel._variables)
+
         return Util.render_data(
             data=data,
             default_variables=self.default_variables,
@@ -119,11 +164,11 @@ class Base:
         # If the o_connection is None or empty, get the o_connection from the stack
         if o_connection is None or o_connection in ["finish", ""]:
             # If the stack is not empty, get the last node from the stack
-            if not self.channel._stack.empty() and self.type != "subroutine":
+            if self.channel.call_stack and self.type != "subroutine":
                 self.log.debug(
-                    f"[{self.channel.channel_uniqueid}] Getting o_connection from channel stack: {self.channel._stack.queue}"
+                    f"[{self.channel.channel_uniqueid}] Getting o_connection from channel stack: {self.channel.call_stack.nodes}"
                 )
-                o_connection = self.channel._stack.get(timeout=3)
+                o_connection = self.channel.call_stack.top()
 
         if o_connection:
             self.log.info(
@@ -147,12 +192,20 @@ class Base:
         validate = cases if cases is not None else o_connection
 
         if channel_state is ChannelState.HANGUP:
-            state = channel_state
+            # The on_hangup path ends like the main one, when its last node has no next node
+            state = channel_state if o_connection else ChannelState.END
         elif not validate:
             state = ChannelState.END
 
         await self.channel.update_ivr(node_id=o_connection, state=state)
 
+    @staticmethod
+    def bind_channel(channel: Channel) -> None:
+        """It sets the channel of the call served by the current AGI context"""
+        ctx = _agi_ctx_var.get()
+        if ctx is not None:
+            ctx.channel = channel
+
     @classmethod
     @asynccontextmanager
     async def agi_ctx(cls, *, asterisk_conn: Any, http_session: Any):
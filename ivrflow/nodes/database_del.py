@@ -6,6 +6,8 @@ from .base import Base
 
 
 class DatabaseDel(Base):
+    __slots__ = ()
+
     def __init__(
         self, default_variables: Dict, database_del_content: DatabaseDelModel, channel: Channel
     ) -> None:
@@ -6,6 +6,8 @@ from .base import Base
 
 
 class DatabaseGet(Base):
+    __slots__ = ()
+
     def __init__(
         self, default_variables: Dict, database_get_content: DatabaseGetModel, channel: Channel
     ) -> None:
@@ -23,6 +25,7 @@ class DatabaseGet(Base):
 
     async def run(self):
         self.log.info(f"[{self.channel.channel_uniqueid}] Entering database_get node {self.id}")
+        variables_to_set = {}
         for variable, entry in self.variables.items():
             family, key = [x.strip("/") for x in entry.rsplit("/", 1)]
             db_result = await self.asterisk_conn.agi.database_get(family, key)
@@ -31,10 +34,11 @@ class DatabaseGet(Base):
                 self.log.info(
                     f"[{self.channel.channel_uniqueid}] Getting {variable}: {value} from {entry} database entry"
                 )
-                await self.channel.set_variable(variable, value)
+                variables_to_set[variable] = value
             else:
                 self.log.debug(
                     f"[{self.channel.channel_uniqueid}] No value found for variable {variable} in database entry {entry}"
                 )
 
+        await self.channel.set_variables(variables_to_set)
         await self._update_node(o_connection=self.o_connection)
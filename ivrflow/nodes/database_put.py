@@ -6,6 +6,8 @@ from .base import Base
 
 
 class DatabasePut(Base):
+    __slots__ = ()
+
     def __init__(
         self, default_variables: Dict, database_put_content: DatabasePutModel, channel: Channel
     ) -> None:
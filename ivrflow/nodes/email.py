@@ -9,7 +9,7 @@ from .base import Base
 
 
 class Email(Base):
-    email_client: EmailClient = None
+    __slots__ = ()
 
     def __init__(
         self, default_variables: Dict, email_content: EmailModel, channel: Channel
@@ -52,8 +52,8 @@ class Email(Base):
 
     async def run(self):
         self.log.info(f"[{self.channel.channel_uniqueid}] Entering email node {self.id}")
-        if not self.email_client:
-            self.email_client = EmailClient.get_by_server_id(self.server_id)
+        # The server id can be rendered from the variables of the call
+        email_client = EmailClient.get_by_server_id(self.server_id)
 
         self.log.debug(
             f"[{self.channel.channel_uniqueid}] Sending email {self.subject or self.text} to {self.recipients}"
@@ -68,6 +68,6 @@ class Email(Base):
             encode_type=self.encode_type,
         )
 
-        asyncio.create_task(self.email_client.send_email(email=email))
+        asyncio.create_task(email_client.send_email(email=email))
 
         await self._update_node(o_connection=self.o_connection)
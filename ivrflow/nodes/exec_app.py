@@ -6,6 +6,8 @@ from .base import Base
 
 
 class ExecApp(Base):
+    __slots__ = ()
+
     def __init__(
         self, default_variables: Dict, exec_app_content: ExecAppModel, channel: Channel
     ) -> None:
@@ -1,4 +1,4 @@
-from typing import TYPE_CHECKING, Dict, Union
+from typing import TYPE_CHECKING, Dict, List, Union
 
 from ..channel import Channel
 from ..models import GetData as GetDataModel
@@ -10,11 +10,12 @@ if TYPE_CHECKING:
 
 
 class GetData(Switch):
-    middlewares: Union["TTSMiddleware", "ASRMiddleware", "LLMMiddleware"] = []
+    __slots__ = ("middlewares",)
 
     def __init__(self, get_data_content: GetDataModel, channel: Channel, default_variables: Dict):
         super().__init__(get_data_content, channel, default_variables)
         self.content: GetDataModel = get_data_content
+        self.middlewares: List[Union["TTSMiddleware", "ASRMiddleware", "LLMMiddleware"]] = []
 
     @property
     def file(self) -> str:
@@ -6,6 +6,8 @@ from .base import Base
 
 
 class GetFullVariable(Base):
+    __slots__ = ()
+
     def __init__(
         self,
         default_variables: Dict,
@@ -6,6 +6,8 @@ from .base import Base
 
 
 class Hangup(Base):
+    __slots__ = ()
+
     def __init__(
         self, default_variables: Dict, hangup_content: HangupModel, channel: Channel
     ) -> None:
@@ -14,9 +14,7 @@ if TYPE_CHECKING:
 
 
 class HTTPRequest(Switch):
-    HTTP_ATTEMPTS: Dict = {}
-
-    middleware: "HTTPMiddleware" = None
+    __slots__ = ("middleware",)
 
     def __init__(
         self, http_request_content: HTTPRequestModel, channel: Channel, default_variables: Dict
@@ -26,6 +24,7 @@ class HTTPRequest(Switch):
         )
         self.log = self.log.getChild(http_request_content.id)
         self.content: HTTPRequestModel = http_request_content
+        self.middleware: "HTTPMiddleware" | None = None
 
     @property
     def method(self) -> str:
@@ -104,7 +103,6 @@ class HTTPRequest(Switch):
         request_body = self.prepare_request()
 
         if self.middleware:
-            self.middleware.channel = self.channel
             request_params_ctx = self.context_params
             request_params_ctx.update({"middleware": self.middleware})
         else:
@@ -203,45 +201,35 @@ class HTTPRequest(Switch):
 
         """
 
+        call_state = self.channel.call_state
+
         if status in [200, 201]:
-            self.HTTP_ATTEMPTS.update(
-                {self.channel.channel_uniqueid: {"last_http_node": None, "attempts_count": 0}}
-            )
+            call_state.http_attempts = {"last_http_node": None, "attempts_count": 0}
             return
 
         if (
-            self.HTTP_ATTEMPTS.get(self.channel.channel_uniqueid)
-            and self.HTTP_ATTEMPTS[self.channel.channel_uniqueid]["last_http_node"] == self.id
-            and self.HTTP_ATTEMPTS[self.channel.channel_uniqueid]["attempts_count"]
-            >= self.middleware.attempts
+            call_state.http_attempts
+            and call_state.http_attempts["last_http_node"] == self.id
+            and call_state.http_attempts["attempts_count"] >= self.middleware.attempts
         ):
             self.log.debug(
                 f"[{self.channel.channel_uniqueid}] Attempts limit reached, o_connection set as `default`"
             )
-            self.HTTP_ATTEMPTS.update(
-                {self.channel.channel_uniqueid: {"last_http_node": None, "attempts_count": 0}}
-            )
+            call_state.http_attempts = {"last_http_node": None, "attempts_count": 0}
             await self.channel.update_ivr(await self.get_case_by_id("default"), None)
 
         if status == 401:
-            self.HTTP_ATTEMPTS.update(
-                {
-                    self.channel.channel_uniqueid: {
-                        "last_http_node": self.id,
-                        "attempts_count": (
-                            self.HTTP_ATTEMPTS.get(self.channel.channel_uniqueid, {}).get(
-                                "attempts_count"
-                            )
-                            + 1
-                            if self.HTTP_ATTEMPTS.get(self.channel.channel_uniqueid)
-                            else 1
-                        ),
-                    }
-                }
-            )
+            call_state.http_attempts = {
+                "last_http_node": self.id,
+                "attempts_count": (
+                    call_state.http_attempts.get("attempts_count") + 1
+                    if call_state.http_attempts
+                    else 1
+                ),
+            }
             self.log.debug(
                 f"[{self.channel.channel_uniqueid}] HTTP auth attempt "
-                f"{self.HTTP_ATTEMPTS[self.channel.channel_uniqueid]['attempts_count']}, "
+                f"{call_state.http_attempts['attempts_count']}, "
                 "trying again ..."
             )
 
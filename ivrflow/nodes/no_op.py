@@ -7,6 +7,7 @@ from .base import Base
 
 
 class NoOp(Base):
+    __slots__ = ()
 
     def __init__(
         self, default_variables: Dict, no_op_content: NoOpModel, channel: Channel
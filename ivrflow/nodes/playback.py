@@ -9,7 +9,7 @@ if TYPE_CHECKING:
 
 
 class Playback(Base):
-    middleware: "TTSMiddleware" = None
+    __slots__ = ("middleware",)
 
     def __init__(
         self, default_variables: Dict, playback_content: PlaybackModel, channel: Channel
@@ -17,6 +17,7 @@ class Playback(Base):
         super().__init__(default_variables, channel=channel)
         self.log = self.log.getChild(playback_content.id)
         self.content: PlaybackModel = playback_content
+        self.middleware: "TTSMiddleware" | None = None
 
     @property
     def file(self) -> str:
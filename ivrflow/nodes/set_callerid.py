@@ -6,6 +6,8 @@ from .base import Base
 
 
 class SetCallerID(Base):
+    __slots__ = ()
+
     def __init__(
         self, default_variables: Dict, set_callerid_content: SetCallerIDModel, channel: Channel
     ) -> None:
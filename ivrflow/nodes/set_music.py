@@ -6,6 +6,8 @@ from .base import Base
 
 
 class SetMusic(Base):
+    __slots__ = ()
+
     def __init__(
         self, default_variables: Dict, set_music_content: SetMusicModel, channel: Channel
     ) -> None:
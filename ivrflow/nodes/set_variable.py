@@ -6,6 +6,8 @@ from .base import Base
 
 
 class SetVariable(Base):
+    __slots__ = ()
+
     def __init__(
         self, default_variables: Dict, set_variable_content: SetVariableModel, channel: Channel
     ) -> None:
@@ -6,6 +6,8 @@ from .base import Base
 
 
 class SetVars(Base):
+    __slots__ = ()
+
     def __init__(
         self, default_variables: Dict, set_vars_content: SetVarsModel, channel: Channel
     ) -> None:
@@ -1,5 +1,3 @@
-import json
-from queue import LifoQueue
 from typing import Dict
 
 from ..channel import Channel
@@ -11,6 +9,8 @@ from .base import Base
 class Subroutine(Base):
     """This class is used to handle the subroutine node."""
 
+    __slots__ = ()
+
     def __init__(
         self, subroutine_node_data: SubroutineModel, channel: Channel, default_variables: Dict
     ) -> None:
@@ -26,50 +26,33 @@ class Subroutine(Base):
         """This function runs the subroutine node."""
         self.log.info(f"[{self.channel.channel_uniqueid}] Entering subroutine node {self.id}")
 
-        # Get current stack data
-        lifo_stack: LifoQueue = self.channel._stack
-        stack: Dict = json.loads(self.channel.stack)
-        last_node = None
-
-        try:
-            go_sub = self.go_sub
-            if not go_sub:
-                self.log.warning(
-                    f"[{self.channel.channel_uniqueid}] The go_sub value in {self.id} not found. Please check the configuration"
-                )
-                return
+        call_stack = self.channel.call_stack
+        o_connection = self.render_data(self.content.o_connection)
 
-            # If the stack is empty, add the current node to the stack
-            if lifo_stack.empty():
-                self.log.info(
-                    f"[{self.channel.channel_uniqueid}] Add '{self.id}' node to empty LiFo Stack"
-                )
-                lifo_stack.put(self.id)
-            else:
-                # Get the last node from the stack
-                last_node = lifo_stack.get(timeout=3)  # seconds
+        # The subroutine of this node has finished, go to the next node
+        if call_stack.top() == self.id:
+            call_stack.pop()
+            self.log.debug(f"[{self.channel.channel_uniqueid}] Go to next node: '{o_connection}'")
+            await self._update_node(o_connection=o_connection)
+            return
 
-                # If this node is not the last node, add it to the stack
-                if last_node and last_node != self.id:
-                    self.log.info(
-                        f"[{self.channel.channel_uniqueid}] Add '{self.id}' node to LiFo Stack: {lifo_stack.queue}"
-                    )
-                    lifo_stack.put(self.id)
+        go_sub = self.go_sub
+        if not go_sub:
+            self.log.warning(
+                f"[{self.channel.channel_uniqueid}] The go_sub value in {self.id} not found. Please check the configuration"
+            )
+            return
 
-            # Update the stack in db
-            stack[self.channel.channel_uniqueid] = lifo_stack.queue
-            self.channel.stack = json.dumps(stack)
-            await self.channel.update()
+        try:
+            call_stack.push(self.id)
         except ValueError as e:
             self.log.warning(f"[{self.channel.channel_uniqueid}] Error: {e}")
-
-        # Update the menu
-        if not lifo_stack.empty() and last_node != self.id:
-            self.log.debug(f"[{self.channel.channel_uniqueid}] Go to subroutine: '{self.go_sub}'")
-            await self.channel.update_ivr(node_id=self.go_sub)
-
-        # If the stack is empty, o finished subroutine go to the next node
-        o_connection = self.render_data(self.content.o_connection)
-        if lifo_stack.empty() or last_node == self.id:
-            self.log.debug(f"[{self.channel.channel_uniqueid}] Go to next node: '{o_connection}'")
             await self._update_node(o_connection=o_connection)
+            return
+
+        self.log.info(
+            f"[{self.channel.channel_uniqueid}] Add '{self.id}' node to the call stack: {call_stack.nodes}"
+        )
+        # The stack is written along with the node transition
+        self.log.debug(f"[{self.channel.channel_uniqueid}] Go to subroutine: '{go_sub}'")
+        await self.channel.update_ivr(node_id=go_sub)
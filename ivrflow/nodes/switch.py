@@ -9,8 +9,7 @@ from .base import Base, safe_data_convertion
 
 
 class Switch(Base):
-    # Keeps track of the number of validation attempts made in a switch node by channel.
-    VALIDATION_ATTEMPTS_BY_CHANNEL: Dict[str, int] = {}
+    __slots__ = ()
 
     def __init__(
         self, switch_content: SwitchModel, channel: Channel, default_variables: Dict
@@ -122,11 +121,8 @@ class Switch(Base):
             )
 
             # Delete the validation attempts of the channel
-            if (
-                self.validation_attempts
-                and self.channel.channel_uniqueid in self.VALIDATION_ATTEMPTS_BY_CHANNEL
-            ):
-                del self.VALIDATION_ATTEMPTS_BY_CHANNEL[self.channel.channel_uniqueid]
+            if self.validation_attempts:
+                self.channel.call_state.validation_attempts = None
 
         if not case_o_connection:
             default_case, o_connection = await self.manage_case_exceptions()
@@ -160,11 +156,8 @@ class Switch(Base):
                 f"[{self.channel.channel_uniqueid}] The case [{case_o_connection}] has been obtained in the input node [{self.id}]"
             )
 
-            if (
-                self.validation_attempts
-                and self.channel.channel_uniqueid in self.VALIDATION_ATTEMPTS_BY_CHANNEL
-            ):
-                del self.VALIDATION_ATTEMPTS_BY_CHANNEL[self.channel.channel_uniqueid]
+            if self.validation_attempts:
+                self.channel.call_state.validation_attempts = None
 
         except KeyError:
             default_case, o_connection = await self.manage_case_exceptions()
@@ -215,13 +208,11 @@ class Switch(Base):
         """
         cases = await self.load_cases()
 
-        channel_validation_attempts = self.VALIDATION_ATTEMPTS_BY_CHANNEL.get(
-            self.channel.channel_uniqueid, 1
-        )
+        call_state = self.channel.call_state
+        channel_validation_attempts = call_state.validation_attempts or 1
 
         if self.validation_attempts and channel_validation_attempts >= self.validation_attempts:
-            if self.channel.channel_uniqueid in self.VALIDATION_ATTEMPTS_BY_CHANNEL:
-                del self.VALIDATION_ATTEMPTS_BY_CHANNEL[self.channel.channel_uniqueid]
+            call_state.validation_attempts = None
             case_to_be_used = "attempt_exceeded"
             self.log.critical(
                 f"[{self.channel.channel_uniqueid}] Validation attempts {channel_validation_attempts} of {self.validation_attempts} "
@@ -235,9 +226,7 @@ class Switch(Base):
                 f"[{self.channel.channel_uniqueid}] Validation Attempts {channel_validation_attempts} "
                 f"of {self.validation_attempts}"
             )
-            self.VALIDATION_ATTEMPTS_BY_CHANNEL[self.channel.channel_uniqueid] = (
-                channel_validation_attempts + 1
-            )
+            call_state.validation_attempts = channel_validation_attempts + 1
 
         # Getting the default case
         default_case = cases.get(case_to_be_used, {})
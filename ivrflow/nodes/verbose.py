@@ -6,6 +6,8 @@ from .base import Base
 
 
 class Verbose(Base):
+    __slots__ = ()
+
     def __init__(
         self, default_variables: Dict, verbose_content: VerboseModel, channel: Channel
     ) -> None:
@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import asyncio
+from collections import Counter, OrderedDict
+from logging import getLogger
+from time import time
+from typing import Any, Dict, List
+from uuid import uuid4
+
+from aioagi.ami.action import AMIAction
+from aioagi.ami.manager import AMIManager
+from aioagi.ami.message import AMIMessage
+from mautrix.util.logging import TraceLogger
+
+log: TraceLogger = getLogger("ivrflow.originate")
+
+# Reason of the OriginateResponse event
+REASONS = {
+    "0": "failed",
+    "1": "hangup",
+    "3": "no_answer",
+    "4": "answered",
+    "5": "busy",
+    "8": "congestion",
+}
+
+
+def build_originate_action(
+    config: Dict, phone: str, name: str | None, variables: Dict | None = None
+) -> AMIAction:
+    """It builds the Originate action of a call
+
+    Parameters
+    ----------
+    config : Dict
+        The config, the action is built with `ami.originate_command`.
+    phone : str
+        The phone number to call.
+    name : str | None
+        The name of the client.
+    variables : Dict | None
+        The variables of the call.
+
+    Returns
+    -------
+        The Originate action, with Async enabled.
+
+    """
+
+    channel = config["ami.originate_command.channel"]
+    variables = {
+        **(variables or {}),
+        "TELEFONO": phone,
+        "CLIENT_NAME": name,
+        "CAMPAIGN": config["ami.originate_command.campaign"],
+        "SUBCAMPAIGN": config["ami.originate_command.subcampaign"],
+    }
+
+    return AMIAction(
+        {
+            "Action": "Originate",
+            "Channel": f"{channel}/{phone}",
+            "Context": config["ami.originate_command.context"],
+            "Exten": phone,
+            "Priority": config["ami.originate_command.priority"],
+            "CallerID": phone,
+            "Timeout": str(config["ami.originate_command.timeout"]),
+            "Variable": [f"{key.upper()}={value}" for key, value in variables.items()],
+            "Async": "true",
+        }
+    )
+
+
+class OriginateItem:
+    """A destination of a bulk originate job"""
+
+    __slots__ = ("phone", "name", "variables", "status", "reason", "uniqueid", "updated_at")
+
+    def __init__(self, phone: str, name: str | None = None, variables: Dict | None = None):
+        self.phone = phone
+        self.name = name
+        self.variables = variables
+        self.status = "queued"
+        self.reason: str | None = None
+        self.uniqueid: str | None = None
+        self.updated_at = time()
+
+    def serialize(self) -> Dict[str, Any]:
+        return {
+            "phone": self.phone,
+            "name": self.name,
+            "status": self.status,
+            "reason": self.reason,
+            "uniqueid": self.uniqueid,
+            "updated_at": self.updated_at,
+        }
+
+
+class OriginateJob:
+    """A list of destinations originated by the dispatcher.
+
+    Destinations can be added while the job is running, it finishes when its input is
+    closed and every destination has a final status. A phone number is originated once per
+    job, repeated numbers are marked as `duplicate`.
+    """
+
+    def __init__(self, concurrency: int, calls_per_second: float) -> None:
+        self.id = uuid4().hex
+        self.concurrency = concurrency
+        self.calls_per_second = calls_per_second
+        self.items: List[OriginateItem] = []
+        self.counts: Counter[str] = Counter()
+        self.queue: asyncio.Queue[OriginateItem | None] = asyncio.Queue()
+        self.phones: set[str] = set()
+        self.input_closed = False
+        self.cancelled = False
+        self.created_at = time()
+        self.finished_at: float | None = None
+        self.task: asyncio.Task | None = None
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def add(self, destination: Dict) -> OriginateItem:
+        """It adds a destination to the job, invalid destinations are kept as `invalid`"""
+        phone = destination.get("phone") if isinstance(destination, dict) else None
+        if not phone:
+            item = OriginateItem(phone=None)
+            self._append(item, "invalid", "The phone is required")
+            return item
+
+        phone = str(phone)
+        item = OriginateItem(phone, destination.get("name"), destination.get("variables"))
+        if self.cancelled:
+            self._append(item, "cancelled")
+        elif phone in self.phones:
+            self._append(item, "duplicate")
+        else:
+            self.phones.add(phone)
+            self._append(item, "queued")
+            self.queue.put_nowait(item)
+
+        return item
+
+    def _append(self, item: OriginateItem, status: str, reason: str | None = None) -> None:
+        self.items.append(item)
+        item.status, item.reason = status, reason
+        self.counts[status] += 1
+
+    def set_status(self, item: OriginateItem, status: str, reason: str | None = None) -> None:
+        self.counts[item.status] -= 1
+        self.counts[status] += 1
+        item.status, item.reason, item.updated_at = status, reason, time()
+        self._check_finished()
+
+    def close_input(self) -> None:
+        """It marks that no more destinations will be added"""
+        self.input_closed = True
+        self.queue.put_nowait(None)
+        self._check_finished()
+
+    def cancel(self) -> None:
+        """It stops dispatching the job, the destinations already sent keep their call"""
+        self.cancelled = True
+        if self.task and not self.task.done():
+            self.task.cancel()
+
+        for item in self.items:
+            if item.status == "queued":
+                self.set_status(item, "cancelled")
+
+    def _check_finished(self) -> None:
+        if self.finished or not (self.input_closed or self.cancelled):
+            return
+
+        if not any(self.counts[status] for status in ("queued", "dialing")):
+            self.finished_at = time()
+            log.info(f"Originate job {self.id} finished: {dict(+self.counts)}")
+
+    def serialize(self, results: bool = False, offset: int = 0, limit: int = 100) -> Dict:
+        data = {
+            "id": self.id,
+            "concurrency": self.concurrency,
+            "calls_per_second": self.calls_per_second,
+            "total": len(self.items),
+            "counts": dict(+self.counts),
+            "input_closed": self.input_closed,
+            "cancelled": self.cancelled,
+            "finished": self.finished,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+        if results:
+            data["results"] = [item.serialize() for item in self.items[offset : offset + limit]]
+
+        return data
+
+
+class OriginateDispatcher:
+    """Originates the destinations of the bulk jobs through the AMI manager.
+
+    Each job has its own concurrency, the number of calls that have been sent and whose
+    `OriginateResponse` event has not arrived yet, and its own rate of calls per second.
+    The status of each call is taken from its `OriginateResponse` event, matched by the
+    ActionID of its Originate action.
+    """
+
+    config: Dict
+    manager: AMIManager | None = None
+    jobs: OrderedDict[str, OriginateJob] = OrderedDict()
+    pending: Dict[str, asyncio.Future] = {}
+
+    @classmethod
+    def init_cls(cls, config: Dict, ami_manager: AMIManager | None) -> None:
+        cls.config = config
+        cls.manager = ami_manager
+        if ami_manager:
+            ami_manager.register_event("OriginateResponse", cls.on_originate_response)
+
+    @classmethod
+    def on_originate_response(cls, _: AMIManager, event: AMIMessage) -> None:
+        future = cls.pending.get(event.get("ActionID"))
+        if future and not future.done():
+            future.set_result(event)
+
+    @classmethod
+    def create_job(
+        cls, concurrency: int | None = None, calls_per_second: float | None = None
+    ) -> OriginateJob:
+        """It creates a job and starts dispatching it
+
+        Parameters
+        ----------
+        concurrency : int | None
+            Calls of the job waiting for their OriginateResponse at the same time, the
+            `ami.bulk_originate.concurrency` config by default.
+        calls_per_second : float | None
+            Originate actions sent per second, the `ami.bulk_originate.calls_per_second`
+            config by default.
+
+        Returns
+        -------
+            The job, its destinations are added with `OriginateJob.add`.
+
+        """
+
+        if concurrency is None:
+            concurrency = cls.config["ami.bulk_originate.concurrency"]
+        if calls_per_second is None:
+            calls_per_second = cls.config["ami.bulk_originate.calls_per_second"]
+        if concurrency <= 0 or calls_per_second <= 0:
+            raise ValueError("The concurrency and calls per second must be greater than 0")
+
+        job = OriginateJob(concurrency=concurrency, calls_per_second=calls_per_second)
+        cls.jobs[job.id] = job
+        cls._prune_jobs()
+        job.task = asyncio.create_task(cls._dispatch(job))
+        log.info(
+            f"Originate job {job.id} created with concurrency {concurrency} "
+            f"and {calls_per_second} calls per second"
+        )
+        return job
+
+    @classmethod
+    def _prune_jobs(cls) -> None:
+        # The oldest finished jobs are dropped first, running jobs are always kept
+        excess = len(cls.jobs) - cls.config["ami.bulk_originate.max_jobs"]
+        finished = [job.id for job in cls.jobs.values() if job.finished]
+        for job_id in finished[: max(excess, 0)]:
+            del cls.jobs[job_id]
+
+    @classmethod
+    async def _dispatch(cls, job: OriginateJob) -> None:
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(job.concurrency)
+        interval = 1 / job.calls_per_second
+        next_call_at = loop.time()
+
+        while True:
+            item = await job.queue.get()
+            if item is None:
+                break
+
+            await slots.acquire()
+            delay = next_call_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_call_at = max(next_call_at, loop.time()) + interval
+
+            task = asyncio.create_task(cls._originate(job, item))
+            task.add_done_callback(lambda _: slots.release())
+
+    @classmethod
+    async def _originate(cls, job: OriginateJob, item: OriginateItem) -> None:
+        action = build_originate_action(cls.config, item.phone, item.name, item.variables)
+        event_future = asyncio.get_running_loop().create_future()
+        # Registered before sending, the event can arrive right after the response
+        cls.pending[action.id] = event_future
+        job.set_status(item, "dialing")
+
+        try:
+            response: AMIMessage = await asyncio.wait_for(
+                cls.manager.send_action(action), timeout=cls.config["ami.reconnect_delay"]
+            )
+            if response.get("Response") != "Success":
+                job.set_status(item, "error", response.get("Message"))
+                return
+
+            event: AMIMessage = await asyncio.wait_for(
+                event_future,
+                timeout=int(cls.config["ami.originate_command.timeout"]) / 1000
+                + cls.config["ami.bulk_originate.event_timeout"],
+            )
+            item.uniqueid = event.get("Uniqueid")
+            reason = REASONS.get(event.get("Reason"), event.get("Reason"))
+            if event.get("Response") == "Success":
+                job.set_status(item, "answered", reason)
+            else:
+                job.set_status(item, "failed", reason)
+        except asyncio.TimeoutError:
+            job.set_status(item, "error", "Originate timed out")
+        except Exception as e:
+            log.exception(f"Error originating {item.phone} of the job {job.id}")
+            job.set_status(item, "error", str(e))
+        finally:
+            cls.pending.pop(action.id, None)
+
+    @classmethod
+    def get_job(cls, job_id: str) -> OriginateJob | None:
+        return cls.jobs.get(job_id)
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        return {
+            "jobs": len(cls.jobs),
+            "running_jobs": sum(not job.finished for job in cls.jobs.values()),
+            "pending_events": len(cls.pending),
+        }
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import json
+from bisect import bisect_left
+from contextvars import ContextVar
+from logging import getLogger
+from random import random
+from time import perf_counter, time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Tuple
+
+from mautrix.util.logging import TraceLogger
+
+log: TraceLogger = getLogger("ivrflow.profiler")
+
+# Kinds of work that are timed inside a node
+KINDS = ("render", "db", "agi", "http")
+
+
+class NodeStep:
+    """Time spent by a call in one node, and in each kind of work inside it."""
+
+    __slots__ = ("node_id", "node_type", "started", "wall", "counts", "durations")
+
+    def __init__(self, node_id: str | None, node_type: str | None) -> None:
+        self.node_id = node_id
+        self.node_type = node_type
+        self.started = perf_counter()
+        self.wall = 0.0
+        self.counts = dict.fromkeys(KINDS, 0)
+        self.durations = dict.fromkeys(KINDS, 0.0)
+
+    def add(self, kind: str, duration: float) -> None:
+        self.counts[kind] += 1
+        self.durations[kind] += duration
+
+    def to_dict(self) -> Dict[str, Any]:
+        step = {"node_id": self.node_id, "type": self.node_type, "wall": round(self.wall, 6)}
+        for kind in KINDS:
+            if self.counts[kind]:
+                step[kind] = {"count": self.counts[kind], "time": round(self.durations[kind], 6)}
+        return step
+
+
+class CallProfile:
+    """Timeline of a call, with one step for each node it went through.
+
+    Work done outside of a node (loading the channel or writing it when the call ends) is
+    recorded in the `call` step.
+    """
+
+    __slots__ = ("uniqueid", "flow_name", "started_at", "call", "steps", "current")
+
+    def __init__(self, uniqueid: str, flow_name: str) -> None:
+        self.uniqueid = uniqueid
+        self.flow_name = flow_name
+        self.started_at = time()
+        self.call = NodeStep(None, None)
+        self.steps: List[NodeStep] = []
+        self.current: NodeStep | None = None
+
+    def start_node(self, node_id: str, node_type: str) -> None:
+        self.current = NodeStep(node_id, node_type)
+        self.steps.append(self.current)
+
+    def end_node(self) -> None:
+        if self.current is not None:
+            self.current.wall = perf_counter() - self.current.started
+            self.current = None
+
+    def add(self, kind: str, duration: float) -> None:
+        (self.current or self.call).add(kind, duration)
+
+    def to_dict(self, reason: str) -> Dict[str, Any]:
+        self.call.wall = perf_counter() - self.call.started
+        return {
+            "uniqueid": self.uniqueid,
+            "flow": self.flow_name,
+            "reason": reason,
+            "started_at": self.started_at,
+            "call": self.call.to_dict(),
+            "nodes": [step.to_dict() for step in self.steps],
+        }
+
+
+class NodeHistogram:
+    """Aggregated wall times of a node across the profiled calls."""
+
+    __slots__ = ("node_type", "count", "total", "buckets", "counts", "durations")
+
+    def __init__(self, node_type: str, buckets: Tuple[float, ...]) -> None:
+        self.node_type = node_type
+        self.count = 0
+        self.total = 0.0
+        # One counter for each upper bound and one for the values above the last one
+        self.buckets = [0] * (len(buckets) + 1)
+        self.counts = dict.fromkeys(KINDS, 0)
+        self.durations = dict.fromkeys(KINDS, 0.0)
+
+    def observe(self, step: NodeStep, bounds: Tuple[float, ...]) -> None:
+        self.count += 1
+        self.total += step.wall
+        self.buckets[bisect_left(bounds, step.wall)] += 1
+        for kind in KINDS:
+            self.counts[kind] += step.counts[kind]
+            self.durations[kind] += step.durations[kind]
+
+    def to_dict(self, bounds: Tuple[float, ...]) -> Dict[str, Any]:
+        return {
+            "type": self.node_type,
+            "count": self.count,
+            "avg": round(self.total / self.count, 6) if self.count else 0,
+            "buckets": {
+                **{str(bound): n for bound, n in zip(bounds, self.buckets)},
+                "+Inf": self.buckets[-1],
+            },
+            **{
+                kind: {"count": self.counts[kind], "time": round(self.durations[kind], 6)}
+                for kind in KINDS
+            },
+        }
+
+
+_profile_var: ContextVar[CallProfile | None] = ContextVar("ivrflow_profile", default=None)
+
+
+class Profiler:
+    """Opt-in profiling of calls.
+
+    When a call is profiled its `CallProfile` is kept in a context variable, so the hooks in
+    the nodes, the channel and the http client only do work for the calls being profiled.
+    """
+
+    enabled: bool = False
+    sample_rate: float = 1.0
+    bounds: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    histograms_by_node: Dict[str, NodeHistogram] = {}
+    stats: Dict[str, int] = {"profiled_calls": 0}
+
+    @classmethod
+    def init_cls(cls, config: Dict) -> None:
+        cls.enabled = config["ivrflow.profiling.enabled"]
+        cls.sample_rate = config["ivrflow.profiling.sample_rate"]
+
+    @staticmethod
+    def current() -> CallProfile | None:
+        return _profile_var.get()
+
+    @classmethod
+    def start(cls, uniqueid: str, flow_name: str) -> CallProfile | None:
+        """It starts the profile of a call, if profiling is enabled and the call is sampled"""
+        if not cls.enabled or random() >= cls.sample_rate:
+            return None
+
+        profile = CallProfile(uniqueid, flow_name)
+        _profile_var.set(profile)
+        return profile
+
+    @classmethod
+    def finish(cls, profile: CallProfile, reason: str) -> None:
+        """It logs the timeline of a call and adds its nodes to the histograms"""
+        _profile_var.set(None)
+        cls.stats["profiled_calls"] += 1
+
+        for step in profile.steps:
+            key = f"{profile.flow_name}/{step.node_id}"
+            try:
+                histogram = cls.histograms_by_node[key]
+            except KeyError:
+                histogram = cls.histograms_by_node[key] = NodeHistogram(step.node_type, cls.bounds)
+            histogram.observe(step, cls.bounds)
+
+        log.info(json.dumps(profile.to_dict(reason), default=str))
+
+    @staticmethod
+    def record(kind: str, duration: float) -> None:
+        profile = _profile_var.get()
+        if profile is not None:
+            profile.add(kind, duration)
+
+    @staticmethod
+    def wrap_agi(agi: Any) -> None:
+        """It times every AGI command sent through the given connection"""
+        run_command = agi.run_command
+
+        async def profiled_run_command(command, *args):
+            start = perf_counter()
+            try:
+                return await run_command(command, *args)
+            finally:
+                Profiler.record("agi", perf_counter() - start)
+
+        # Only this connection is wrapped, it belongs to the call being profiled
+        agi.run_command = profiled_run_command
+
+    @classmethod
+    def reset(cls) -> None:
+        cls.histograms_by_node.clear()
+        cls.stats["profiled_calls"] = 0
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        return {
+            **cls.stats,
+            "enabled": cls.enabled,
+            "sample_rate": cls.sample_rate,
+            "nodes": {
+                key: histogram.to_dict(cls.bounds)
+                for key, histogram in cls.histograms_by_node.items()
+            },
+        }
+
+
+async def on_request_start(session: Any, trace_config_ctx: SimpleNamespace, params: Any) -> None:
+    if _profile_var.get() is not None:
+        trace_config_ctx.profile_start = perf_counter()
+
+
+async def on_request_end(session: Any, trace_config_ctx: SimpleNamespace, params: Any) -> None:
+    start = getattr(trace_config_ctx, "profile_start", None)
+    if start is not None:
+        Profiler.record("http", perf_counter() - start)
+
+
+async def on_request_exception(
+    session: Any, trace_config_ctx: SimpleNamespace, params: Any
+) -> None:
+    await on_request_end(session, trace_config_ctx, params)
@@ -1 +1,2 @@
+from .jq_cache import JQCache
 from .util import Util
@@ -1,6 +1,14 @@
+import re
+
 from glom import Path
+from jinja2.utils import LRUCache
 from lark import Lark, Visitor
 
+# Paths made only of attributes and indexes, e.g. `customer.phones[0].number` or `items.0`
+SEGMENT = r"[a-zA-Z_][a-zA-Z0-9_]*|[0-9]+"
+SIMPLE_PATH_RE = re.compile(rf"(?:{SEGMENT})(?:\.(?:{SEGMENT})|\[(?:{SEGMENT})\])*")
+SEGMENT_RE = re.compile(SEGMENT)
+
 
 class JQ2Glom:
     grammar = r"""
@@ -25,8 +33,9 @@ class JQ2Glom:
     %ignore WS_INLINE
     """
 
-    def __init__(self):
+    def __init__(self, cache_size: int = 4096):
         self.parser = Lark(self.grammar, start="path")
+        self._paths_by_expr: LRUCache = LRUCache(cache_size)
 
     class _PathVisitor(Visitor):
         def __init__(self):
@@ -55,6 +64,37 @@ class JQ2Glom:
             A glom.Path object.
         """
 
+        path = self._paths_by_expr.get(expr)
+        if path is None:
+            path = self._fast_parse(expr)
+            if path is None:
+                path = self._parse(expr)
+            self._paths_by_expr[expr] = path
+
+        return path
+
+    @staticmethod
+    def _fast_parse(expr: str) -> Path | None:
+        """It converts a path without quoted keys or spaces, without using the grammar
+
+        Parameters
+        ----------
+        expr : str
+            The path expression to convert.
+
+        Returns
+        -------
+            A glom.Path object, or None if the expression has to be parsed with the grammar.
+        """
+
+        if not SIMPLE_PATH_RE.fullmatch(expr):
+            return None
+
+        return Path(*(int(s) if s.isdigit() else s for s in SEGMENT_RE.findall(expr)))
+
+    def _parse(self, expr: str) -> Path:
+        """It converts a path expression to a glom.Path using the grammar"""
+
         tree = self.parser.parse(expr)
         visitor = self._PathVisitor()
         visitor.visit_topdown(tree)
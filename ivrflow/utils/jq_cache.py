@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from logging import Logger, getLogger
+from typing import Any, Dict, Iterable
+
+import jq
+from jinja2.utils import LRUCache
+
+log: Logger = getLogger("ivrflow.jq_cache")
+
+
+class JQCache:
+    """LRU cache of compiled jq programs keyed by their filter.
+
+    Filters that fail to compile are cached too, with their error message, so an invalid
+    filter in a flow is not compiled again on every call.
+    """
+
+    max_size: int = 1024
+    stats: Dict[str, int] = {"hits": 0, "misses": 0, "errors": 0}
+
+    _programs: LRUCache = LRUCache(max_size)
+
+    @classmethod
+    def init_cls(cls, config: Dict) -> None:
+        cls.max_size = config["ivrflow.jq_cache.max_size"]
+        cls._programs = LRUCache(cls.max_size)
+
+    @classmethod
+    def get_program(cls, filter: str) -> Any:
+        """It returns the compiled jq program of a filter, compiling it only once
+
+        Parameters
+        ----------
+        filter : str
+            The jq filter.
+
+        Returns
+        -------
+            The compiled jq program.
+
+        Raises
+        ------
+        ValueError
+            If the filter is not valid; the error is the one raised when it was compiled.
+
+        """
+
+        if not isinstance(filter, str):
+            return jq.compile(filter)
+
+        program = cls._programs.get(filter)
+        if program is None:
+            cls.stats["misses"] += 1
+            try:
+                program = jq.compile(filter)
+            except Exception as e:
+                program = ValueError(str(e))
+            cls._programs[filter] = program
+        else:
+            cls.stats["hits"] += 1
+
+        if isinstance(program, Exception):
+            cls.stats["errors"] += 1
+            raise program.with_traceback(None)
+
+        return program
+
+    @classmethod
+    def precompile(cls, filters: Iterable[str]) -> None:
+        """It compiles a list of filters ahead of time, logging the invalid ones
+
+        Parameters
+        ----------
+        filters : Iterable[str]
+            The jq filters.
+
+        """
+
+        for filter in filters:
+            try:
+                cls.get_program(filter)
+            except Exception as e:
+                log.warning(f"Invalid jq filter {filter!r}: {e}")
+
+    @classmethod
+    def clear(cls) -> None:
+        cls._programs.clear()
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, int]:
+        return {**cls.stats, "size": len(cls._programs), "max_size": cls.max_size}
@@ -4,18 +4,29 @@ import html
 import traceback
 import uuid
 from logging import getLogger
+from typing import Any, Dict
 
-import jq
-from jinja2 import TemplateSyntaxError, UndefinedError
+from jinja2 import Template, TemplateSyntaxError, UndefinedError
+from jinja2.nativetypes import native_concat
 from mautrix.util.logging import TraceLogger
 
-from ..jinja.env import jinja_env
+from ..jinja.template_cache import TemplateCache
 from ..types import Scopes
+from .jq_cache import JQCache
 
 log: TraceLogger = getLogger("ivrflow.util")
 
 
 class Util:
+    # Render templates with jinja's native types environment instead of the legacy
+    # string rendering followed by `ast.literal_eval`
+    native_render: bool = False
+
+    @classmethod
+    def init_cls(cls, config: Dict) -> None:
+        cls.native_render = config["ivrflow.render_mode"] == "native"
+        log.debug(f"Render mode: {'native' if cls.native_render else 'legacy'}")
+
     @classmethod
     def render_data(
         cls,
@@ -44,55 +55,127 @@ class Util:
 
         """
         dict_variables = default_variables | all_variables
-        data_copy = copy.deepcopy(data)
-
-        if isinstance(data_copy, dict):
-            for key, value in data_copy.items():
-                data_copy[key] = cls.render_data(value, default_variables, all_variables)
-            return data_copy
-        elif isinstance(data_copy, list):
-            return [cls.render_data(item, default_variables, all_variables) for item in data_copy]
-        elif isinstance(data_copy, str):
-            try:
-                template = jinja_env.from_string(data_copy)
-                temp_rendered = template.render(dict_variables)
-            except TemplateSyntaxError as e:
-                log.warning(
-                    f"func_name: {e.name}, \nline: {e.lineno}, \nerror: {e.message}",
-                )
-                if return_errors:
-                    raise e
-                return None
-            except UndefinedError as e:
-                tb_list = traceback.extract_tb(e.__traceback__)
-                traceback_info = tb_list[-1]
-                func_name = traceback_info.name
-                line: int | None = traceback_info.lineno
-                log.warning(
-                    f"func_name: {func_name}, \nline: {line}, \nerror: {e}",
-                )
-                if return_errors:
-                    raise e
-                return None
-            except Exception as e:
-                log.warning(
-                    f"Error rendering data: {e}",
-                )
-                if return_errors:
-                    raise e
-                return None
-            try:
-                evaluated_body = temp_rendered
-                evaluated_body = html.unescape(evaluated_body.replace("'", '"'))
-                literal_eval_body = ast.literal_eval(evaluated_body)
-            except Exception as e:
-                pass
-            else:
-                if isinstance(literal_eval_body, (dict, list)):
-                    return literal_eval_body
-            return evaluated_body
+        return cls._render(data, dict_variables, return_errors)
+
+    @classmethod
+    def _render(
+        cls, data: dict | list | str, variables: dict, return_errors: bool = False
+    ) -> dict | list | str:
+        # Containers are rebuilt while they are walked, so the input is never modified
+        if isinstance(data, dict):
+            return {key: cls._render(value, variables) for key, value in data.items()}
+        elif isinstance(data, list):
+            return [cls._render(item, variables) for item in data]
+        elif isinstance(data, str):
+            if not TemplateCache.is_template(data):
+                # Literal strings are returned as they are, without going through jinja
+                TemplateCache.stats["literals"] += 1
+                return cls.evaluate_literal(data)
+
+            return cls.render_template(data, variables, return_errors)
+        else:
+            return copy.deepcopy(data)
+
+    @classmethod
+    def render_template(
+        cls, template: Template | str, variables: dict, return_errors: bool = False
+    ) -> dict | list | str | None:
+        """It renders a jinja template and evaluates the rendered string
+
+        Parameters
+        ----------
+        template : Template | str
+            The compiled template, or its source to get it from the template cache.
+        variables : dict
+            The variables to be used in the rendering.
+        return_errors : bool
+            If True, it will return the errors instead of ignoring them.
+
+        Returns
+        -------
+            A dictionary, list or string, or None if the template could not be rendered.
+            In the native render mode, any python value the template evaluates to.
+
+        """
+        try:
+            if isinstance(template, str):
+                template = TemplateCache.get_template(template, native=cls.native_render)
+            temp_rendered = template.render(variables)
+        except TemplateSyntaxError as e:
+            log.warning(
+                f"func_name: {e.name}, \nline: {e.lineno}, \nerror: {e.message}",
+            )
+            if return_errors:
+                raise e
+            return None
+        except UndefinedError as e:
+            tb_list = traceback.extract_tb(e.__traceback__)
+            traceback_info = tb_list[-1]
+            func_name = traceback_info.name
+            line: int | None = traceback_info.lineno
+            log.warning(
+                f"func_name: {func_name}, \nline: {line}, \nerror: {e}",
+            )
+            if return_errors:
+                raise e
+            return None
+        except Exception as e:
+            log.warning(
+                f"Error rendering data: {e}",
+            )
+            if return_errors:
+                raise e
+            return None
+
+        if cls.native_render:
+            return temp_rendered
+
+        return cls.evaluate_rendered(temp_rendered)
+
+    @classmethod
+    def evaluate_literal(cls, source: str) -> Any:
+        """It returns the value of a string without jinja delimiters in the current render mode
+
+        Parameters
+        ----------
+        source : str
+            The literal string.
+
+        Returns
+        -------
+            The same value jinja would return for the string.
+
+        """
+        rendered = TemplateCache.render_literal(source)
+        if cls.native_render:
+            return native_concat([rendered])
+
+        return cls.evaluate_rendered(rendered)
+
+    @staticmethod
+    def evaluate_rendered(rendered: str) -> dict | list | str:
+        """It converts a rendered string into a dictionary or list when it represents one
+
+        Parameters
+        ----------
+        rendered : str
+            The rendered string.
+
+        Returns
+        -------
+            A dictionary or list if the string can be evaluated as one, otherwise the string.
+
+        """
+        try:
+            evaluated_body = rendered
+            evaluated_body = html.unescape(evaluated_body.replace("'", '"'))
+            literal_eval_body = ast.literal_eval(evaluated_body)
+        except Exception as e:
+            pass
         else:
-            return data_copy
+            if isinstance(literal_eval_body, (dict, list)):
+                return literal_eval_body
+        return evaluated_body
 
     @staticmethod
     def jq_compile(filter: str, json_data: dict | list) -> dict:
@@ -113,7 +196,7 @@ class Util:
 
         try:
             status = 400
-            compiled = jq.compile(filter)
+            compiled = JQCache.get_program(filter)
             status = 421
             filtered_result = compiled.input(json_data).all()
         except Exception as error:
@@ -121,6 +204,32 @@ class Util:
 
         return {"result": filtered_result, "error": None, "status": 200}
 
+    @classmethod
+    def get_jq_filters(cls, variables: Dict[str, Any] | None) -> list[str]:
+        """It returns the jq filters of a variables mapping that can be compiled ahead of time
+
+        Parameters
+        ----------
+        variables : Dict[str, Any]
+            The `variables` of a node or middleware, a jq filter for each variable.
+
+        Returns
+        -------
+            The filters, as they are passed to `jq_compile`, that have no jinja templates.
+
+        """
+
+        filters = []
+        for value in (variables or {}).values():
+            if not isinstance(value, str) or TemplateCache.is_template(value):
+                continue
+
+            evaluated = cls.evaluate_literal(value)
+            if isinstance(evaluated, str):
+                filters.append(evaluated)
+
+        return filters
+
     @staticmethod
     def generate_uuid() -> str:
         """Generate a UUID for use in transactions.
@@ -1,6 +1,25 @@
-from .call import call
-from .channel import get_variables
+from .call import bulk_call, call, cancel_bulk_call, get_bulk_call
+from .channel import get_live_state, get_variables
 from .flow import create_or_update_flow, get_flow
-from .misc import get_id_email_servers, get_id_middlewares
+from .misc import (
+    get_ami_events_stats,
+    get_call_state_stats,
+    get_channel_cache_stats,
+    get_channel_partitions,
+    get_channel_write_stats,
+    get_flow_cache_stats,
+    get_flow_plan,
+    get_hangup_detection_stats,
+    get_hot_reload_stats,
+    get_id_email_servers,
+    get_id_middlewares,
+    get_jq_cache_stats,
+    get_metrics,
+    get_profile_stats,
+    get_template_cache_stats,
+    get_token_cache_stats,
+    get_workers_stats,
+    reset_profile_stats,
+)
 from .module import create_module, delete_module, get_module, get_module_list, update_module
 from .node import get_node
@@ -1,14 +1,16 @@
 import asyncio
+import json
 from logging import Logger, getLogger
 
-from aioagi.ami.action import AMIAction
 from aioagi.ami.manager import AMIManager
 from aioagi.ami.message import AMIMessage
 from aiohttp import web
 
+from ...originate import OriginateDispatcher, build_originate_action
 from ..base import get_config, routes
+from ..docs.call import bulk_call_doc, cancel_bulk_call_doc, get_bulk_call_doc
 from ..responses import resp
-from ..util import generate_uuid
+from ..util import docstring, generate_uuid
 
 log: Logger = getLogger("ivrflow.api.call")
 
@@ -28,30 +30,8 @@ async def call(request: web.Request) -> web.Response:
     name = data.get("name")
     variables = data.get("variables", {})
 
-    channel = config["ami.originate_command.channel"]
-    context = config["ami.originate_command.context"]
-    priority = config["ami.originate_command.priority"]
-    timeout = config["ami.originate_command.timeout"]
-
-    variables["TELEFONO"] = phone
-    variables["CLIENT_NAME"] = name
-    variables["CAMPAIGN"] = config["ami.originate_command.campaign"]
-    variables["SUBCAMPAIGN"] = config["ami.originate_command.subcampaign"]
-
     try:
-        action = AMIAction(
-            {
-                "Action": "Originate",
-                "Channel": f"{channel}/{phone}",
-                "Context": context,
-                "Exten": phone,
-                "Priority": priority,
-                "CallerID": phone,
-                "Timeout": str(timeout),
-                "Variable": [f"{key.upper()}={value}" for key, value in variables.items()],
-                "Async": "true",
-            }
-        )
+        action = build_originate_action(config, phone, name, variables)
 
         result: AMIMessage = await asyncio.wait_for(
             manager.send_action(action), timeout=config["ami.reconnect_delay"]
@@ -64,3 +44,104 @@ async def call(request: web.Request) -> web.Response:
     formatted_result = {k: v for k, v in result.items()}
     log.debug(f"({uuid}) -> Result: {formatted_result}")
     return resp.success_response(message="Originate successfully queued", uuid=uuid)
+
+
+@routes.post("/v1/call/bulk")
+@docstring(bulk_call_doc)
+async def bulk_call(request: web.Request) -> web.Response:
+    uuid = generate_uuid()
+    log.info(f"({uuid}) -> '{request.method}' '{request.path}' Bulk call")
+
+    if not request.config_dict.get("ami_manager"):
+        return resp.internal_error("AMI manager not found", uuid)
+
+    ndjson = request.content_type == "application/x-ndjson"
+    destinations = []
+    params = request.query
+    if not ndjson:
+        try:
+            data = await request.json()
+        except json.JSONDecodeError:
+            return resp.body_not_json(uuid)
+
+        # The body is the list of destinations, or an object with them and the job options
+        if isinstance(data, list):
+            destinations = data
+        elif isinstance(data, dict):
+            destinations = data.get("destinations")
+            params = {**params, **data}
+        else:
+            return resp.bad_request("The body must be a list or an object", uuid)
+
+        if not isinstance(destinations, list) or not destinations:
+            return resp.bad_request("destinations must be a non-empty list", uuid)
+
+    try:
+        concurrency = params.get("concurrency")
+        calls_per_second = params.get("calls_per_second")
+        concurrency = int(concurrency) if concurrency is not None else None
+        calls_per_second = float(calls_per_second) if calls_per_second is not None else None
+        job = OriginateDispatcher.create_job(concurrency, calls_per_second)
+    except ValueError as e:
+        return resp.bad_request(str(e), uuid)
+
+    try:
+        if ndjson:
+            # Each line is queued as soon as it is received
+            async for line in request.content:
+                if not line.strip():
+                    continue
+                try:
+                    job.add(json.loads(line))
+                except json.JSONDecodeError:
+                    job.add({})
+        else:
+            for destination in destinations:
+                job.add(destination)
+    except Exception as e:
+        job.cancel()
+        return resp.internal_error(e, uuid, log)
+    finally:
+        job.close_input()
+
+    return resp.created("Originate job created", uuid, data=job.serialize())
+
+
+@routes.get("/v1/call/bulk/{job_id}", allow_head=False)
+@docstring(get_bulk_call_doc)
+async def get_bulk_call(request: web.Request) -> web.Response:
+    uuid = generate_uuid()
+    log.info(f"({uuid}) -> '{request.method}' '{request.path}' Getting bulk call")
+
+    job = OriginateDispatcher.get_job(request.match_info["job_id"])
+    if not job:
+        return resp.not_found(f"Originate job '{request.match_info['job_id']}' not found", uuid)
+
+    try:
+        results = request.query.get("results", "false").lower() == "true"
+        offset = int(request.query.get("offset", 0))
+        limit = int(request.query.get("limit", 100))
+    except ValueError:
+        return resp.bad_request("offset and limit must be integers", uuid)
+
+    return resp.success_response(
+        data=job.serialize(results=results, offset=offset, limit=limit),
+        uuid=uuid,
+        log_msg=f"Returning originate job {job.id}",
+    )
+
+
+@routes.delete("/v1/call/bulk/{job_id}")
+@docstring(cancel_bulk_call_doc)
+async def cancel_bulk_call(request: web.Request) -> web.Response:
+    uuid = generate_uuid()
+    log.info(f"({uuid}) -> '{request.method}' '{request.path}' Cancelling bulk call")
+
+    job = OriginateDispatcher.get_job(request.match_info["job_id"])
+    if not job:
+        return resp.not_found(f"Originate job '{request.match_info['job_id']}' not found", uuid)
+
+    job.cancel()
+    return resp.success_response(
+        message="Originate job cancelled", uuid=uuid, data=job.serialize()
+    )
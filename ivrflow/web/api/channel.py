@@ -4,9 +4,10 @@ from logging import Logger, getLogger
 
 from aiohttp import web
 
+from ...ami_events import AMIEvents
 from ...db.channel import Channel
 from ..base import routes
-from ..docs.channel import get_variables_doc
+from ..docs.channel import get_live_state_doc, get_variables_doc
 from ..responses import resp
 from ..util import docstring, generate_uuid
 
@@ -45,3 +46,20 @@ async def get_variables(request: web.Request) -> web.Response:
         if response
         else resp.not_found("Scopes not found", uuid)
     )
+
+
+@routes.get("/v1/room/{uniqueid}/state", allow_head=False)
+@docstring(get_live_state_doc)
+async def get_live_state(request: web.Request) -> web.Response:
+    uuid = generate_uuid()
+    log.info(f"({uuid}) -> '{request.method}' '{request.path}' Getting live state")
+
+    uniqueid = request.match_info["uniqueid"]
+    if not AMIEvents.enabled:
+        return resp.not_found("AMI events are not enabled", uuid)
+
+    live_channel = AMIEvents.get_channel(uniqueid)
+    if not live_channel:
+        return resp.not_found(f"channel_uniqueid '{uniqueid}' not found", uuid)
+
+    return resp.success_response(data=live_channel.serialize(), uuid=uuid)
@@ -7,6 +7,7 @@ from typing import Dict
 from aiohttp import web
 
 from ...db.flow import Flow as DBFlow
+from ...flow_cache import FlowCache
 from ..base import routes
 from ..docs.flow import create_or_update_flow_doc, get_flow_doc
 from ..responses import resp
@@ -44,6 +45,7 @@ async def create_or_update_flow(request: web.Request) -> web.Response:
                 flow.flow_vars = flow_vars
 
             await flow.update()
+            FlowCache.invalidate_by_flow_id(flow.id)
         else:
             if not name:
                 return resp.bad_request("Parameter name is required", uuid)
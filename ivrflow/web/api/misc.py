@@ -8,13 +8,54 @@ import yaml
 from aiohttp import web
 from jinja2.exceptions import TemplateSyntaxError, UndefinedError
 
+from ...ami_events import AMIEvents
+from ...call_state import CallState
+from ...channel import Channel
+from ...db import ChannelPartitions
+from ...flow_cache import FlowCache
+from ...flow_compiler import RenderPlan
 from ...flow_utils import FlowUtils
+from ...flow_watcher import FlowWatcher
+from ...hangup_watcher import HangupWatcher
+from ...jinja.template_cache import TemplateCache
+from ...metrics import registry
+from ...middlewares import TokenCache
+from ...profiler import Profiler
+from ...utils import JQCache
 from ...utils.util import Util as Utils
+from ...workers import Workers
 from ..base import get_flow_utils, routes
 from ..responses import json_response
 
 log: Logger = getLogger("ivrflow.api.misc")
 
+# Stats kept by each worker, with several workers the API asks the rest for theirs
+Workers.report("metrics", lambda: registry.sample_lines(f'worker="{Workers.index}"'))
+Workers.report("flow_cache", FlowCache.get_stats)
+Workers.report("template_cache", TemplateCache.get_stats)
+Workers.report("jq_cache", JQCache.get_stats)
+Workers.report(
+    "channel_writes", lambda: {**Channel.write_stats, "durability": Channel.durability.value}
+)
+Workers.report("channel_cache", Channel.get_cache_stats)
+Workers.report("call_state", CallState.get_stats)
+Workers.report("token_cache", TokenCache.get_stats)
+Workers.report("profile", Profiler.get_stats)
+Workers.report("ami_events", AMIEvents.get_stats)
+Workers.report("hangup_detection", HangupWatcher.get_stats)
+Workers.report("workers", Workers.get_stats)
+Workers.report("hot_reload", FlowWatcher.get_stats)
+
+
+async def worker_stats(kind: str) -> web.Response:
+    """It responds the stats of the given kind, by worker index when there are several"""
+    if Workers.index is None:
+        data = Workers.reporters[kind]()
+    else:
+        data = {"workers": await Workers.gather(kind)}
+
+    return json_response(status=HTTPStatus.OK, data=data)
+
 
 @routes.get("/v1/mis/email_servers", allow_head=False)
 async def get_id_email_servers(request: web.Request) -> web.Response:
@@ -54,6 +95,204 @@ async def get_id_middlewares(request: web.Request) -> web.Response:
     return json_response(status=HTTPStatus.OK, data={"middlewares": middlewares})
 
 
+@routes.get("/v1/mis/flow_cache", allow_head=False)
+async def get_flow_cache_stats(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Get the statistics of the flow cache.
+    tags:
+        - Mis
+
+    responses:
+        '200':
+            description: Hits, misses, reloads and the cached version of each flow.
+    """
+
+    return await worker_stats("flow_cache")
+
+
+@routes.get("/v1/mis/flow_plan", allow_head=False)
+async def get_flow_plan(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Get the compiled plan of a flow.
+    description: >
+        For each node, the fields rendered with jinja on every call and the fields
+        that are constant.
+    tags:
+        - Mis
+    parameters:
+        - in: query
+          name: flow_name
+          schema:
+            type: string
+          required: true
+          description: The name of the flow.
+
+    responses:
+        '200':
+            description: The dynamic and static fields of each node.
+        '400':
+            description: The flow name is missing.
+        '404':
+            description: The flow could not be loaded.
+    """
+
+    flow_name = request.query.get("flow_name")
+    if not flow_name:
+        return json_response(status=HTTPStatus.BAD_REQUEST, message="flow_name is required")
+
+    try:
+        entry = await FlowCache.get(flow_name)
+    except Exception as e:
+        log.exception(e)
+        entry = None
+
+    if entry is None:
+        return json_response(
+            status=HTTPStatus.NOT_FOUND, message=f"Flow {flow_name} could not be loaded"
+        )
+
+    return json_response(
+        status=HTTPStatus.OK,
+        data={
+            "flow_name": flow_name,
+            "version": entry.version,
+            "nodes": entry.compiled.describe(),
+        },
+    )
+
+
+@routes.get("/v1/mis/template_cache", allow_head=False)
+async def get_template_cache_stats(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Get the statistics of the compiled jinja template cache.
+    tags:
+        - Mis
+
+    responses:
+        '200':
+            description: Hits, misses, literal strings skipped and size of the cache.
+    """
+
+    return await worker_stats("template_cache")
+
+
+@routes.get("/v1/mis/jq_cache", allow_head=False)
+async def get_jq_cache_stats(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Get the statistics of the compiled jq program cache.
+    tags:
+        - Mis
+
+    responses:
+        '200':
+            description: Hits, misses, invalid filter hits and size of the cache.
+    """
+
+    return await worker_stats("jq_cache")
+
+
+@routes.get("/v1/mis/channel_writes", allow_head=False)
+async def get_channel_write_stats(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Get the statistics of the channel writes.
+    tags:
+        - Mis
+
+    responses:
+        '200':
+            description: Writes made to the channel table and writes saved by buffering.
+    """
+
+    return await worker_stats("channel_writes")
+
+
+@routes.get("/v1/mis/channel_cache", allow_head=False)
+async def get_channel_cache_stats(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Get the statistics of the in-memory channel cache.
+    tags:
+        - Mis
+
+    responses:
+        '200':
+            description: Channels currently cached and channels evicted by reason.
+    """
+
+    return await worker_stats("channel_cache")
+
+
+@routes.get("/v1/mis/call_state", allow_head=False)
+async def get_call_state_stats(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Get the number of calls with retry counters kept in memory.
+    tags:
+        - Mis
+
+    responses:
+        '200':
+            description: Live call states and how many of them have pending attempts.
+    """
+
+    return await worker_stats("call_state")
+
+
+@routes.get("/v1/mis/token_cache", allow_head=False)
+async def get_token_cache_stats(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Get the statistics of the shared tokens of jwt middlewares.
+    tags:
+        - Mis
+
+    responses:
+        '200':
+            description: Hits, misses, refreshes and the time left of each cached token.
+    """
+
+    return await worker_stats("token_cache")
+
+
+@routes.get("/v1/mis/profile", allow_head=False)
+async def get_profile_stats(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Get the time histograms of each node of the profiled calls.
+    tags:
+        - Mis
+
+    responses:
+        '200':
+            description: Wall time buckets, renders, channel writes, AGI commands and http
+                requests of each node.
+    """
+
+    return await worker_stats("profile")
+
+
+@routes.delete("/v1/mis/profile")
+async def reset_profile_stats(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Reset the time histograms of the profiled calls.
+    tags:
+        - Mis
+
+    responses:
+        '200':
+            description: The histograms were reset.
+    """
+
+    Profiler.reset()
+    return json_response(status=HTTPStatus.OK, data={"detail": "Profile reset"})
+
+
 @routes.post("/v1/mis/check_template")
 async def check_template(request: web.Request) -> web.Response:
     """
@@ -78,6 +317,12 @@ async def check_template(request: web.Request) -> web.Response:
                             description: >
                                 The variables to be used in the template, in `yaml` or `json` format
                             example: "{'name': 'world'}"
+                        plan:
+                            type: boolean
+                            description: >
+                                If true, the response data also reports whether the template is
+                                dynamic and the variables it uses
+                            example: false
                     required:
                         - template
     responses:
@@ -102,6 +347,7 @@ async def check_template(request: web.Request) -> web.Response:
 
     template = data.get("template")
     variables = data.get("variables")
+    include_plan = Utils.convert_to_bool(data.get("plan", False))
 
     log.info(f"({trace_id}) -> Checking jinja template with data: {data}")
 
@@ -163,8 +409,132 @@ async def check_template(request: web.Request) -> web.Response:
             message=str(e),
         )
 
+    if include_plan is True:
+        rendered_data = {
+            "rendered": rendered_data,
+            "plan": RenderPlan.compile(template).describe(),
+        }
+
     return json_response(
         status=HTTPStatus.OK,
         message="Template rendered successfully",
         data=rendered_data,
     )
+
+
+@routes.get("/metrics", allow_head=False)
+async def get_metrics(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Get the metrics of the AGI server in the Prometheus text format.
+    tags:
+        - Mis
+
+    responses:
+        '200':
+            description: The metrics in the Prometheus text exposition format, with a
+                worker label on every sample when there are several workers.
+    """
+
+    if Workers.index is None:
+        body = registry.expose()
+    else:
+        # The samples of each worker, with its index in the worker label
+        body = registry.expose((await Workers.gather("metrics")).values())
+
+    return web.Response(
+        body=body,
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+@routes.get("/v1/mis/ami_events", allow_head=False)
+async def get_ami_events_stats(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Get the statistics of the AMI event subscription.
+    tags:
+        - Mis
+
+    responses:
+        '200':
+            description: Events received and dispatched, and the channels with live state.
+    """
+
+    return await worker_stats("ami_events")
+
+
+@routes.get("/v1/mis/hangup_detection", allow_head=False)
+async def get_hangup_detection_stats(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Get the statistics of the nodes cancelled by early hangups.
+    tags:
+        - Mis
+
+    responses:
+        '200':
+            description: Hangups detected, nodes cancelled and the time saved by cancelling them.
+    """
+
+    return await worker_stats("hangup_detection")
+
+
+@routes.get("/v1/mis/workers", allow_head=False)
+async def get_workers_stats(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Get the index of each worker and the messages sent between them.
+    tags:
+        - Mis
+
+    responses:
+        '200':
+            description: Worker index, number of workers and messages sent and received.
+    """
+
+    return await worker_stats("workers")
+
+
+@routes.get("/v1/mis/hot_reload", allow_head=False)
+async def get_hot_reload_stats(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Get the statistics of the flows and flow_utils.yaml reloaded after a change.
+    tags:
+        - Mis
+
+    responses:
+        '200':
+            description: Reloads, their duration, errors and the files whose reload failed.
+    """
+
+    return await worker_stats("hot_reload")
+
+
+@routes.get("/v1/mis/channel_partitions", allow_head=False)
+async def get_channel_partitions(request: web.Request) -> web.Response:
+    """
+    ---
+    summary: Get the partitions of the channel table and the plan of a channel lookup.
+    tags:
+        - Mis
+
+    responses:
+        '200':
+            description: Partitions with their range and estimated rows, the maintenance
+                statistics, and the scans of a lookup by channel_uniqueid.
+    """
+
+    partitions = await ChannelPartitions.get_partitions()
+    for partition in partitions:
+        for key in ("start", "end"):
+            if partition[key] is not None:
+                partition[key] = partition[key].isoformat()
+
+    data = {
+        **ChannelPartitions.get_stats(),
+        "partitions": partitions,
+        "lookup": await ChannelPartitions.explain_lookup(),
+    }
+    return json_response(status=HTTPStatus.OK, data=data)
@@ -8,6 +8,7 @@ from aiohttp import web
 from ...db.flow import Flow as DBFlow
 from ...db.module import Module as DBModule
 from ...db.module_backup import ModuleBackup
+from ...flow_cache import FlowCache
 from ..base import get_config, routes
 from ..docs.module import (
     create_module_doc,
@@ -125,6 +126,7 @@ async def create_module(request: web.Request) -> web.Response:
         )
 
         module_id = await new_module.insert()
+        FlowCache.invalidate_by_flow_id(flow_id)
     except Exception as e:
         return resp.internal_error(e, uuid, log)
 
@@ -208,6 +210,7 @@ async def update_module(request: web.Request) -> web.Response:
 
             log.debug(f"({uuid}) -> Updating module '{module.name}' in flow_id '{flow_id}'")
             await module.update()
+            FlowCache.invalidate_by_flow_id(flow_id)
 
         except Exception as e:
             return resp.internal_error(e, uuid, log)
@@ -238,6 +241,7 @@ async def delete_module(request: web.Request) -> web.Response:
 
         log.debug(f"({uuid}) -> Deleting module '{module.name}' in flow_id '{flow_id}'")
         await module.delete()
+        FlowCache.invalidate_by_flow_id(flow_id)
 
     except (KeyError, ValueError, TypeError):
         return resp.bad_request("Flow ID and module ID must be valid integers", uuid)
@@ -20,6 +20,12 @@ def set_config(config: Config, flow_utils: FlowUtils) -> None:
     _flow_utils = flow_utils
 
 
+def set_flow_utils(flow_utils: FlowUtils) -> None:
+    global _flow_utils
+
+    _flow_utils = flow_utils
+
+
 def get_config() -> Config:
     return _config
 
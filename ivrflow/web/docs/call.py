@@ -0,0 +1,99 @@
+from logging import Logger, getLogger
+
+log: Logger = getLogger("ivrflow.docs.call")
+
+bulk_call_doc = """
+    ---
+    summary: Originate a list of destinations.
+    description: |
+        The destinations are queued into a job that originates them with the given concurrency
+        and calls per second. The body is the list of destinations, a JSON object with the
+        `destinations` list and the job options, or an NDJSON stream (`application/x-ndjson`)
+        with one destination per line; the lines are queued and originated as they are
+        received. Each destination has a `phone`, and optionally a `name` and `variables`, like
+        the body of `/v1/call`. A phone is originated once per job.
+
+        The response, with the ID of the job, is sent when the whole body has been read. While
+        a long NDJSON stream is being uploaded its job can not be polled yet, the job ID is
+        logged when the job is created.
+    tags:
+        - Call
+
+    parameters:
+        - in: query
+          name: concurrency
+          schema:
+            type: integer
+          description: Calls waiting for their OriginateResponse at the same time.
+        - in: query
+          name: calls_per_second
+          schema:
+            type: number
+          description: Originate actions sent per second.
+
+    responses:
+        '201':
+            description: The job was created, it returns its progress.
+        '400':
+            description: Invalid destinations, concurrency or calls per second.
+        '500':
+            $ref: '#/components/responses/InternalServerError'
+"""
+
+get_bulk_call_doc = """
+    ---
+    summary: Get the progress of an originate job.
+    tags:
+        - Call
+
+    parameters:
+        - in: path
+          name: job_id
+          schema:
+            type: string
+          required: true
+          description: The ID of the job.
+        - in: query
+          name: results
+          schema:
+            type: boolean
+          description: If true, the status of each destination is returned.
+        - in: query
+          name: offset
+          schema:
+            type: integer
+          description: The first destination returned.
+        - in: query
+          name: limit
+          schema:
+            type: integer
+          description: The number of destinations returned, 100 by default.
+
+    responses:
+        '200':
+            description: The counts of each status and the results of the job.
+        '404':
+            description: The job was not found.
+"""
+
+cancel_bulk_call_doc = """
+    ---
+    summary: Cancel an originate job.
+    description: The queued destinations are cancelled, the calls already sent are kept.
+    tags:
+        - Call
+
+    parameters:
+        - in: path
+          name: job_id
+          schema:
+            type: string
+          required: true
+          description: The ID of the job.
+
+    responses:
+        '200':
+            description: The job was cancelled.
+        '404':
+            description: The job was not found.
+"""
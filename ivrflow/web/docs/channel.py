@@ -34,3 +34,25 @@ get_variables_doc = """
         '500':
             $ref: '#/components/responses/InternalServerError'
     """
+
+get_live_state_doc = """
+    ---
+    summary: Get the live state of a channel from the AMI events.
+    description: The channel is kept from its first event until its Hangup event.
+    tags:
+        - Channel
+
+    parameters:
+        - name: uniqueid
+          in: path
+          required: true
+          description: The uniqueid of the channel.
+          schema:
+            type: string
+
+    responses:
+        '200':
+            description: The state, caller ID, extension and tracked variables of the channel.
+        '404':
+            description: The channel has no live state or the AMI events are not enabled.
+    """
@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import selectors
+import signal
+import socket
+from logging import getLogger
+from time import monotonic
+from typing import Any, Callable, Dict, Tuple
+from uuid import uuid4
+
+from mautrix.util.logging import TraceLogger
+
+log: TraceLogger = getLogger("ivrflow.workers")
+
+
+class Workers:
+    """Worker processes that serve the AGI connections of the same port.
+
+    The master process forks `ivrflow.workers.count` workers and restarts each one when it
+    exits. Every worker binds the AGI port with SO_REUSEPORT, so the kernel spreads the new
+    connections among them. The worker 0 is the API worker, it also runs the management API
+    and the AMI connection.
+
+    Each worker has a control socket to the master, which relays the messages sent by a worker
+    to the rest of them, e.g. to drop a flow from their caches when the API writes it. The API
+    worker also asks the rest for their stats and metrics through it, with `gather`.
+    """
+
+    # None when ivrflow runs in a single process
+    index: int | None = None
+    count: int = 1
+    control: socket.socket | None = None
+    handlers: Dict[str, Callable[..., Any]] = {}
+    reporters: Dict[str, Callable[[], Any]] = {}
+    # Seconds the API worker waits for the reports of the rest of the workers
+    gather_timeout: float = 2
+    stats: Dict[str, int] = {"sent": 0, "received": 0, "gather_timeouts": 0}
+    _buffer: bytes = b""
+    # Reports being gathered, by request id, with the reports received so far
+    _gathering: Dict[str, Tuple[asyncio.Future, Dict[int, Any]]] = {}
+
+    @classmethod
+    def is_api_worker(cls) -> bool:
+        return cls.index in (None, 0)
+
+    @classmethod
+    def on(cls, kind: str, handler: Callable[..., Any]) -> None:
+        """It sets the handler of the messages of the given kind sent by the other workers"""
+        cls.handlers[kind] = handler
+
+    @classmethod
+    def report(cls, kind: str, reporter: Callable[[], Any]) -> None:
+        """It sets the function that returns the report of the given kind of this worker"""
+        cls.reporters[kind] = reporter
+
+    @classmethod
+    def broadcast(cls, kind: str, **data: Any) -> None:
+        """It sends a message to the other workers, it does nothing in a single process"""
+        if cls.control is None:
+            return
+
+        message = json.dumps({"kind": kind, "worker": cls.index, "data": data}, default=str)
+        message += "\n"
+        try:
+            cls.control.sendall(message.encode())
+            cls.stats["sent"] += 1
+        except OSError:
+            log.exception(f"Error sending the {kind} message to the other workers")
+
+    @classmethod
+    def listen(cls, loop: asyncio.AbstractEventLoop) -> None:
+        """It starts reading the messages of the other workers in the event loop"""
+        if cls.control is not None:
+            cls.on("gather", cls._send_report)
+            cls.on("report", cls._receive_report)
+            loop.add_reader(cls.control.fileno(), cls._read, loop)
+
+    @classmethod
+    async def gather(cls, kind: str) -> Dict[int, Any]:
+        """It returns the report of the given kind of every worker, by worker index
+
+        The workers that do not answer in `gather_timeout` seconds, e.g. while they are being
+        restarted, are left out. In a single process only its own report is returned.
+        """
+        reports = {cls.index: cls.reporters[kind]()}
+        if cls.control is None or cls.count == 1:
+            return reports
+
+        request_id = uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        cls._gathering[request_id] = future, reports
+        cls.broadcast("gather", request_id=request_id, report=kind)
+        try:
+            await asyncio.wait_for(future, cls.gather_timeout)
+        except asyncio.TimeoutError:
+            cls.stats["gather_timeouts"] += 1
+            log.warning(f"Only {len(reports)} of {cls.count} workers sent the {kind} report")
+        finally:
+            del cls._gathering[request_id]
+
+        return dict(sorted(reports.items()))
+
+    @classmethod
+    def _send_report(cls, request_id: str, report: str) -> None:
+        reporter = cls.reporters.get(report)
+        data = reporter() if reporter is not None else None
+        cls.broadcast("report", request_id=request_id, worker=cls.index, data=data)
+
+    @classmethod
+    def _receive_report(cls, request_id: str, worker: int, data: Any) -> None:
+        # The reports are relayed to every worker, only the one that asked for them waits
+        try:
+            future, reports = cls._gathering[request_id]
+        except KeyError:
+            return
+
+        reports[worker] = data
+        if len(reports) == cls.count and not future.done():
+            future.set_result(None)
+
+    @classmethod
+    def _read(cls, loop: asyncio.AbstractEventLoop) -> None:
+        data = cls.control.recv(65536)
+        if not data:
+            log.critical("The master process closed the control socket")
+            loop.remove_reader(cls.control.fileno())
+            return
+
+        *lines, cls._buffer = (cls._buffer + data).split(b"\n")
+        for line in lines:
+            message = json.loads(line)
+            cls.stats["received"] += 1
+            handler = cls.handlers.get(message["kind"])
+            if handler is None:
+                log.warning(f"No handler for the {message['kind']} message")
+                continue
+
+            try:
+                handler(**message["data"])
+            except Exception:
+                log.exception(f"Error handling the {message['kind']} message")
+
+    @classmethod
+    def supervise(cls, count: int, run_worker: Callable[[], None], restart_delay: float) -> None:
+        """It forks the workers and restarts them until the master receives SIGTERM or SIGINT
+
+        Parameters
+        ----------
+        count : int
+            The number of workers.
+        run_worker : Callable[[], None]
+            It runs a worker until it is stopped, `Workers.index` is set before calling it.
+        restart_delay : float
+            Seconds to wait before starting again a worker that exited.
+
+        """
+
+        sockets: Dict[int, socket.socket] = {}
+        pids: Dict[int, int] = {}
+        restarts: Dict[int, float] = {}
+        buffers: Dict[int, bytes] = {}
+        selector = selectors.DefaultSelector()
+        stopping = False
+
+        def spawn(index: int) -> None:
+            master_end, worker_end = socket.socketpair()
+            pid = os.fork()
+            if pid == 0:
+                master_end.close()
+                for other in sockets.values():
+                    other.close()
+                os._exit(cls._run_child(index, count, worker_end, run_worker))
+
+            worker_end.close()
+            sockets[index], pids[pid], buffers[index] = master_end, index, b""
+            selector.register(master_end, selectors.EVENT_READ, index)
+            log.info(f"Started worker {index} with pid {pid}")
+
+        def close(index: int) -> None:
+            # The socket of a worker is closed on EOF, before its process is reaped
+            control = sockets.pop(index, None)
+            if control is not None:
+                selector.unregister(control)
+                control.close()
+
+        def relay(index: int) -> None:
+            try:
+                data = sockets[index].recv(65536)
+            except OSError:
+                data = b""
+            if not data:
+                # The worker is exiting, its socket would be readable until it is reaped
+                close(index)
+                return
+
+            *lines, buffers[index] = (buffers[index] + data).split(b"\n")
+            for other, other_socket in sockets.items():
+                if other == index:
+                    continue
+                try:
+                    other_socket.sendall(b"".join(line + b"\n" for line in lines))
+                except OSError:
+                    log.warning(f"Could not relay a message to the worker {other}")
+
+        def stop(signum, _) -> None:
+            nonlocal stopping
+            if not stopping:
+                log.info(f"Received signal {signum}, stopping the workers...")
+            stopping = True
+            for pid in pids:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for index in range(count):
+            spawn(index)
+
+        while pids or (restarts and not stopping):
+            for key, _ in selector.select(timeout=0.5):
+                relay(key.data)
+
+            while pids:
+                try:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                except ChildProcessError:
+                    break
+                if pid == 0:
+                    break
+
+                index = pids.pop(pid, None)
+                if index is None:
+                    continue
+                close(index)
+                if stopping:
+                    log.info(f"Worker {index} stopped")
+                    continue
+
+                log.error(
+                    f"Worker {index} (pid {pid}) exited with code "
+                    f"{os.waitstatus_to_exitcode(status)}, restarting it in {restart_delay} s"
+                )
+                restarts[index] = monotonic() + restart_delay
+
+            for index, restart_at in list(restarts.items()):
+                if not stopping and restart_at <= monotonic():
+                    del restarts[index]
+                    spawn(index)
+
+        selector.close()
+        log.info("All workers stopped")
+
+    @classmethod
+    def _run_child(
+        cls,
+        index: int,
+        count: int,
+        control: socket.socket,
+        run_worker: Callable[[], None],
+    ) -> int:
+        # The signals are handled by the AGI runner of the worker
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        cls.index, cls.count, cls.control = index, count, control
+
+        try:
+            run_worker()
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            log.exception(f"Worker {index} crashed")
+            return 1
+
+        return 0
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        return {**cls.stats, "worker": cls.index, "workers": cls.count}